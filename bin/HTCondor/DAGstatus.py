@@ -2,6 +2,9 @@
 """
 Code to interpret a DAGman status output, and present it in a more user-friendly manner.
 
+Use --watch to keep monitoring many DAGs: each status file is only re-parsed
+when it changes, and a summary across all DAGs is printed every --interval seconds.
+
 TODO:
 - maybe use namedtuples instead of full-blown classes?
 """
@@ -13,6 +16,7 @@ import logging
 from pprint import pprint
 import re
 import os
+import time
 from collections import OrderedDict
 
 
@@ -20,6 +24,18 @@ logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
 log = logging.getLogger(__name__)
 
 
+# Matches one ClassAd block in the status file, with [ and ] on their own lines.
+# Goes line by line (rather than a lazy .*? match) as it's much faster
+CLASSAD_BLOCK_RE = re.compile(r'^\[[ \t]*\n((?:(?!\]).*\n)*)\]', re.M)
+
+# Matches one attribute in a ClassAd block: Key = value; /* "comment" */
+# Groups are key, quoted value (without quotes), unquoted value, and comment.
+# The comment, if there is one, holds the readable value,
+# e.g. NodeStatus = 5; /* "STATUS_DONE" */
+CLASSAD_ATTR_RE = re.compile(r'^[ \t]*(\w+)[ \t]*=[ \t]*(?:"([^"\n]*)"|([^;\n]*));'
+                             r'[ \t]*(?:/\*[ \t]*"?([^"\n]*?)"?[ \t]*\*/)?', re.M)
+
+
 def strip_doublequotes(line):
     if '"' in line:
         return re.search(r'\"(.*)\"', line).group(1)
@@ -127,66 +143,117 @@ class StatusEnd(ClassAd):
         self.next_update = strip_doublequotes(next_update)
 
 
-def process(status_filename, summary):
-    """Main function to process the status file"""
+def parse_status(text):
+    """Parse the contents of a DAG status file.
 
-    print status_filename, ":"
+    Parameters
+    ----------
+    text : str
+        Contents of status file.
 
+    Returns
+    -------
+    DagStatus, list[NodeStatus], StatusEnd
+    """
     dag_status = None
     node_statuses = []
     status_end = None
 
-    with open(status_filename) as sfile:
-        contents = {}
-        store_contents = False
-        for line in sfile:
-            if line.startswith("[") or "}" in line:
-                store_contents = True
-                continue
-            elif line.startswith("]"):
-                log.debug(contents)
-                # do something with contents here, depending on Type key
-                if contents['Type'] == '"DagStatus"':
-                    dag_status = DagStatus(timestamp=contents['Timestamp'],
-                                           dag_status=contents['DagStatus'],
-                                           nodes_total=contents['NodesTotal'],
-                                           nodes_done=contents['NodesDone'],
-                                           nodes_pre=contents['NodesPre'],
-                                           nodes_queued=contents['NodesQueued'],
-                                           nodes_post=contents['NodesPost'],
-                                           nodes_ready=contents['NodesReady'],
-                                           nodes_unready=contents['NodesUnready'],
-                                           nodes_failed=contents['NodesFailed'],
-                                           job_procs_held=contents['JobProcsHeld'],
-                                           job_procs_idle=contents['JobProcsIdle'])
-                elif contents['Type'] == '"NodeStatus"':
-                    node = NodeStatus(node=contents['Node'],
-                                      node_status=contents['NodeStatus'],
-                                      status_details=contents['StatusDetails'],
-                                      retry_count=contents['RetryCount'],
-                                      job_procs_queued=contents['JobProcsQueued'],
-                                      job_procs_held=contents['JobProcsHeld'])
-                    node_statuses.append(node)
-                elif contents['Type'] == '"StatusEnd"':
-                    status_end = StatusEnd(end_time=contents['EndTime'],
-                                           next_update=contents['NextUpdate'])
-                else:
-                    print contents['Type']
-                    raise KeyError("Unknown block Type")
-                contents = {}
-                store_contents = False
-                continue
-            elif "{" in line:
-                store_contents = False
-                continue
-            elif store_contents:
-                line = line.replace("\n", "").strip()
-                parts = line.split(" = ")
-                contents[parts[0]] = parts[1].split(';')[0].replace(';', '')
+    for block in CLASSAD_BLOCK_RE.findall(text):
+        contents = {key: comment or quoted or unquoted
+                    for key, quoted, unquoted, comment in CLASSAD_ATTR_RE.findall(block)}
+        log.debug(contents)
+        # do something with contents here, depending on Type key
+        if contents['Type'] == 'DagStatus':
+            dag_status = DagStatus(timestamp=contents['Timestamp'],
+                                   dag_status=contents['DagStatus'],
+                                   nodes_total=contents['NodesTotal'],
+                                   nodes_done=contents['NodesDone'],
+                                   nodes_pre=contents['NodesPre'],
+                                   nodes_queued=contents['NodesQueued'],
+                                   nodes_post=contents['NodesPost'],
+                                   nodes_ready=contents['NodesReady'],
+                                   nodes_unready=contents['NodesUnready'],
+                                   nodes_failed=contents['NodesFailed'],
+                                   job_procs_held=contents['JobProcsHeld'],
+                                   job_procs_idle=contents['JobProcsIdle'])
+        elif contents['Type'] == 'NodeStatus':
+            node = NodeStatus(node=contents['Node'],
+                              node_status=contents['NodeStatus'],
+                              status_details=contents['StatusDetails'],
+                              retry_count=contents['RetryCount'],
+                              job_procs_queued=contents['JobProcsQueued'],
+                              job_procs_held=contents['JobProcsHeld'])
+            node_statuses.append(node)
+        elif contents['Type'] == 'StatusEnd':
+            status_end = StatusEnd(end_time=contents['EndTime'],
+                                   next_update=contents['NextUpdate'])
+        else:
+            print contents['Type']
+            raise KeyError("Unknown block Type")
+
+    if dag_status is None:
+        raise ValueError("No DagStatus block in status file")
     dag_status.node_statuses = node_statuses
+    return dag_status, node_statuses, status_end
+
+
+class StatusFile(object):
+    """Holds the parsed contents of one status file.
+
+    update() only re-parses the file if its mtime or size have changed.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.dag_status = None
+        self.node_statuses = []
+        self.status_end = None
+        self._file_stat = None
+
+    def update(self):
+        """Re-parse the status file if it has changed.
+
+        If it can't be parsed (e.g. it is being written), the previous
+        contents are kept, and it will be tried again next time.
+
+        Returns
+        -------
+        bool
+            True if the file was re-parsed.
+        """
+        try:
+            stat = os.stat(self.filename)
+            file_stat = (stat.st_mtime, stat.st_size)
+            if file_stat == self._file_stat:
+                return False
+            with open(self.filename) as sfile:
+                parsed = parse_status(sfile.read())
+        except (IOError, OSError, KeyError, ValueError) as err:
+            log.warning("Cannot read %s: %s", self.filename, err)
+            return False
+        self.dag_status, self.node_statuses, self.status_end = parsed
+        self._file_stat = file_stat
+        return True
+
+
+def process(status_filename, summary):
+    """Main function to process the status file"""
+
+    print status_filename, ":"
+
+    with open(status_filename) as sfile:
+        dag_status, node_statuses, status_end = parse_status(sfile.read())
     print_table(dag_status, node_statuses, status_end, summary)
 
 
+def get_terminal_columns(default=120):
+    """Get width of terminal, or default if not in a terminal"""
+    try:
+        return int(os.popen('stty size 2>/dev/null', 'r').read().split()[1])
+    except (IndexError, ValueError):
+        return default
+
+
 def print_table(dag_status, node_statuses, status_end, summary):
     """Print a pretty-ish table with important info"""
     # Here we auto-create the formatting strings for each row,
@@ -222,9 +289,7 @@ def print_table(dag_status, node_statuses, status_end, summary):
     # Now figure out how many char columns to occupy for the *** and ---
     columns = len(summary_header) if summary else max(len(job_header), len(summary_header))
     columns += 1
-    term_rows, term_columns = os.popen('stty size', 'r').read().split()
-    term_rows = int(term_rows)
-    term_columns = int(term_columns)
+    term_columns = get_terminal_columns()
     if columns > term_columns:
         columns = term_columns
 
@@ -243,8 +308,6 @@ def print_table(dag_status, node_statuses, status_end, summary):
     print summary_header
     print "-" * columns
     # Make it coloured depending on job status
-    sum_col = bcolors.ENDC
-    # if summary:
     print (bcolors.color(dag_status.dag_status) +
         summary_format.format(*[getattr(dag_status, v) for v in summary_dict.values()]))
     if not summary:
@@ -255,14 +318,123 @@ def print_table(dag_status, node_statuses, status_end, summary):
     print bcolors.ENDC + "*" * columns
 
 
+class DagSummary(object):
+    """Summary of numbers of nodes over many DAGs"""
+    def __init__(self, dag_statuses):
+        self.dag_status = "ALL (%d DAGs)" % len(dag_statuses)
+        self.nodes_total = sum(d.nodes_total for d in dag_statuses)
+        self.nodes_done = sum(d.nodes_done for d in dag_statuses)
+        self.nodes_failed = sum(d.nodes_failed for d in dag_statuses)
+        self.nodes_queued = sum(d.nodes_queued for d in dag_statuses)
+        self.job_procs_held = sum(d.job_procs_held for d in dag_statuses)
+        self.job_procs_idle = sum(d.job_procs_idle for d in dag_statuses)
+        self.job_procs_running = sum(d.job_procs_running for d in dag_statuses)
+        if self.nodes_total:
+            self.nodes_done_percent = "{:.1f}".format(100. * self.nodes_done / self.nodes_total)
+        else:
+            self.nodes_done_percent = "-"
+
+
+def print_watch_table(status_files, history):
+    """Print one summary row for each DAG, and a row for all DAGs together,
+    followed by rates & ETA since watching started.
+
+    Parameters
+    ----------
+    status_files : list[StatusFile]
+        Status files to summarise. Ones not yet parsed are skipped.
+
+    history : list[(float, DagSummary)]
+        (time, summary) for the first refresh, and the current one.
+    """
+    summary_dict = OrderedDict()
+    summary_dict["DAG"] = "name"
+    summary_dict["DAG status"] = "dag_status"
+    summary_dict["Total"] = "nodes_total"
+    summary_dict["Queued"] = "nodes_queued"
+    summary_dict["Idle"] = "job_procs_idle"
+    summary_dict["Running"] = "job_procs_running"
+    summary_dict["Held"] = "job_procs_held"
+    summary_dict["Failed"] = "nodes_failed"
+    summary_dict["Done"] = "nodes_done"
+    summary_dict["Done %"] = "nodes_done_percent"
+
+    attrs = summary_dict.values()[1:]
+    rows = [[os.path.basename(s.filename)] + [getattr(s.dag_status, v) for v in attrs]
+            for s in status_files if s.dag_status]
+    total = history[-1][1]
+    rows.append(["TOTAL"] + [getattr(total, v) for v in attrs])
+    col_widths = [max([len(str(r[i])) for r in rows] + [len(k)])
+                  for i, k in enumerate(summary_dict.keys())]
+    row_format = "  |  ".join(["{{:<{}}}"] * len(summary_dict.keys())).format(*col_widths)
+    header = row_format.format(*summary_dict.keys())
+    columns = min(len(header) + 1, get_terminal_columns())
+
+    print "*" * columns
+    print bcolors.ENDC + header
+    print "-" * columns
+    for row in rows[:-1]:
+        print bcolors.color(row[1]) + row_format.format(*row)
+    print bcolors.ENDC + "-" * columns
+    print bcolors.BOLD + row_format.format(*rows[-1]) + bcolors.ENDC
+    print "-" * columns
+
+    # Rates since watching started
+    (start_time, start), (now, current) = history[0], history[-1]
+    minutes = (now - start_time) / 60.
+    if minutes > 0:
+        done_rate = (current.nodes_done - start.nodes_done) / minutes
+        failed_rate = (current.nodes_failed - start.nodes_failed) / minutes
+        rates_format = "Done: {:.1f}/min  |  Failed: {:.1f}/min  |  Held now: {}"
+        print rates_format.format(done_rate, failed_rate, current.job_procs_held)
+        remaining = current.nodes_total - current.nodes_done - current.nodes_failed
+        if remaining == 0:
+            print "ETA: finished"
+        elif done_rate > 0:
+            print "ETA: {:.0f} min".format(remaining / done_rate)
+        else:
+            print "ETA: unknown"
+    else:
+        print "Rates & ETA after next refresh"
+    print "Updated:", time.strftime("%H:%M:%S", time.localtime(now))
+    print "*" * columns
+
+
+def watch(status_filenames, interval):
+    """Keep printing a summary of all DAGs every `interval` seconds, until Ctrl-C.
+
+    Each status file is only re-parsed when it has changed.
+    """
+    status_files = [StatusFile(f) for f in status_filenames]
+    history = []
+    try:
+        while True:
+            n_parsed = sum(s.update() for s in status_files)
+            log.debug("Re-parsed %d/%d status files", n_parsed, len(status_files))
+            summary = DagSummary([s.dag_status for s in status_files if s.dag_status])
+            history = history[:1] + [(time.time(), summary)]
+            sys.stdout.write("\033[2J\033[H")  # clear screen
+            print_watch_table(status_files, history)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("-v", "--verbose", help="enable debugging mesages", action='store_true')
     parser.add_argument("-s", "--summary", help="only printout very short summary of all jobs", action='store_true')
+    parser.add_argument("-w", "--watch", help="keep printing a summary of all DAGs, "
+                        "only re-reading status files that change", action='store_true')
+    parser.add_argument("-i", "--interval", help="seconds between updates with --watch",
+                        type=float, default=30)
     parser.add_argument("statusFile", help="name(s) of DAG status file(s), separated by spaces", nargs="*")
     args = parser.parse_args()
     if args.verbose:
         log.setLevel(logging.DEBUG)
-    for f in args.statusFile:
-        process(f, args.summary)
+    if args.watch:
+        watch(args.statusFile, args.interval)
+    else:
+        for f in args.statusFile:
+            process(f, args.summary)
@@ -7,6 +7,14 @@ import os
 from subprocess import call
 import random
 import string
+import math
+import htcondenser as ht
+
+
+# Max number of files for each hadd job. If there are more, they are hadded in
+# a tree of intermediate hadd jobs, which start as soon as their inputs are
+# ready, so merging takes ~log(N) rather than N.
+HADD_FAN_IN = 20
 
 
 def update_setup_script(setup_script, cmssw_ver, root_dir):
@@ -59,3 +67,132 @@ def rand_str(length=3):
     """Generate a random string of user-specified length"""
     return ''.join(random.choice(string.ascii_uppercase + string.ascii_lowercase)
                    for _ in range(length))
+
+
+def add_hadd_tree(dagman, hadd_jobs, jobs, final_file, name, fan_in=HADD_FAN_IN):
+    """Add tree of hadd jobs to DAG, to hadd the outputs of `jobs` into `final_file`.
+
+    Each hadd job takes at most `fan_in` files. If there are more, they are
+    split into even groups, each hadded into an intermediate file (in the same
+    dir as `final_file`), and so on until there are few enough to hadd into
+    `final_file`. Groups keep the order of `jobs`, so the final file is the same
+    as hadding everything in one go.
+
+    Parameters
+    ----------
+    dagman : DAGMan
+        DAGMan object to add jobs to.
+
+    hadd_jobs : JobSet
+        JobSet to add hadd jobs to.
+
+    jobs : list[Job]
+        Jobs whose (first) output files are to be hadded together.
+
+    final_file : str
+        Final hadd-ed filename.
+
+    name : str
+        Name of final hadd job. Intermediate jobs are named after it.
+
+    fan_in : int, optional
+        Max number of files for each hadd job.
+
+    Returns
+    -------
+    list[Job]
+        All hadd jobs, with the final hadd job last.
+
+    Raises
+    ------
+    ValueError
+        If fan_in < 2.
+    """
+    if fan_in < 2:
+        raise ValueError('fan_in must be at least 2')
+    out_dir = os.path.dirname(final_file)
+    tree_jobs = []
+    level = 0
+    while len(jobs) > fan_in:
+        n_groups = int(math.ceil(len(jobs) * 1. / fan_in))
+        next_jobs = []
+        for i in range(n_groups):
+            job_group = jobs[i * len(jobs) // n_groups: (i + 1) * len(jobs) // n_groups]
+            if len(job_group) == 1:
+                # no point hadding 1 file by itself, pass it up to the next level
+                next_jobs.extend(job_group)
+                continue
+            inter_file = 'hadd_inter_%d_%d_%s.root' % (level, i, rand_str(5))
+            inter_job = add_hadd_job(dagman, hadd_jobs, job_group,
+                                     os.path.join(out_dir, inter_file),
+                                     '%sInter%d_%d' % (name, level, i))
+            tree_jobs.append(inter_job)
+            next_jobs.append(inter_job)
+        jobs = next_jobs
+        level += 1
+    tree_jobs.append(add_hadd_job(dagman, hadd_jobs, jobs, final_file, name))
+    return tree_jobs
+
+
+def add_hadd_job(dagman, hadd_jobs, jobs, output_file, name):
+    """Add one hadd job to DAG, to hadd the outputs of `jobs` into `output_file`.
+
+    Returns the hadd Job.
+    """
+    hadd_input = [j.output_files[0] for j in jobs]
+    hadd_job = ht.Job(name=name,
+                      args=[output_file] + hadd_input,
+                      input_files=hadd_input,
+                      output_files=[output_file])
+    hadd_jobs.add_job(hadd_job)
+    dagman.add_job(hadd_job, requires=jobs)
+    return hadd_job
+
+
+def add_rm_jobs(dagman, files, requires, log_dir, hdfs_store, name):
+    """Add jobs to DAG to delete files from /hdfs, once `requires` jobs are done.
+
+    Parameters
+    ----------
+    dagman : DAGMan
+        DAGMan object to add jobs to.
+
+    files : list[str]
+        Files to delete.
+
+    requires : list[Job]
+        Jobs that must finish before deleting.
+
+    log_dir : str
+        Directory for STDOUT/STDERR/LOG files.
+
+    hdfs_store : str
+        Directory for htcondenser to store files on /hdfs.
+
+    name : str
+        Stem for job & condor filenames.
+
+    Returns
+    -------
+    JobSet
+        JobSet for rm jobs.
+    """
+    log_stem = '%sRm.$(cluster).$(process)' % name
+
+    rm_jobs = ht.JobSet(exe='hadoop',
+                        copy_exe=False,
+                        filename='submit_%sRm.condor' % name,
+                        out_dir=log_dir, out_file=log_stem + '.out',
+                        err_dir=log_dir, err_file=log_stem + '.err',
+                        log_dir=log_dir, log_file=log_stem + '.log',
+                        cpus=1, memory='100MB', disk='10MB',
+                        transfer_hdfs_input=False,
+                        share_exe_setup=False,
+                        hdfs_store=hdfs_store)
+
+    for i, filename in enumerate(files):
+        rm_job = ht.Job(name='rm%d' % i,
+                        args=' fs -rm -skipTrash %s' % filename.replace('/hdfs', ''))
+        rm_jobs.add_job(rm_job)
+        dagman.add_job(rm_job, requires=requires)
+    return rm_jobs
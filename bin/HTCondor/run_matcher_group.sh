@@ -0,0 +1,53 @@
+#!/bin/bash -e
+#
+# Run a matcher executable over a group of ntuple files, and hadd the results
+# into one pairs file. This lets submit_matcher_dag.py pack many small ntuples
+# into one job, rather than having one job per ntuple.
+#
+# Usage:
+#     ./run_matcher_group.sh <matcher exe> <output file> <input files> -- <other matcher args>
+#
+# e.g.
+#     ./run_matcher_group.sh RunMatcherStage2L1Gen pairs.root L1Ntuple_1.root L1Ntuple_2.root -- --deltaR 0.25
+
+exe="$1"
+shift
+outputFile="$1"
+shift
+inputFiles=()
+while [[ $# -gt 0 && "$1" != "--" ]]; do
+    inputFiles+=("$1")
+    shift
+done
+if [[ $# -gt 0 ]]; then
+    shift  # the --
+fi
+
+echo "Matcher: $exe"
+echo "Output file: $outputFile"
+echo "Input files: ${inputFiles[@]}"
+echo "Matcher args: $@"
+
+if [[ ${#inputFiles[@]} -eq 0 ]]; then
+    echo "No input files!"
+    exit 1
+fi
+
+# the exe is transferred as an input file, so run the local copy
+exeBasename=$(basename "$exe")
+chmod u+x "$exeBasename"
+
+if [[ ${#inputFiles[@]} -eq 1 ]]; then
+    ./"$exeBasename" -I "${inputFiles[0]}" -O "$outputFile" "$@"
+    exit 0
+fi
+
+partFiles=()
+for i in "${!inputFiles[@]}"; do
+    partFile="matcher_part_${i}.root"
+    ./"$exeBasename" -I "${inputFiles[$i]}" -O "$partFile" "$@"
+    partFiles+=("$partFile")
+done
+
+hadd -f "$outputFile" "${partFiles[@]}"
+rm "${partFiles[@]}"
@@ -88,7 +88,7 @@ LOG_DIR = '/storage/%s/L1JEC/%s/L1JetEnergyCorrections/jobs/check/%s' % (os.envi
 
 
 def submit_all_checkCalib_dags(pairs_files, max_l1_pt, log_dir, append,
-                               pu_bins, eta_bins, force_submit):
+                               pu_bins, eta_bins, force_submit, hadd_fan_in=cc.HADD_FAN_IN):
     """Create and submit DAG checkCalibration jobs for all pairs files.
 
     Parameters
@@ -114,6 +114,9 @@ def submit_all_checkCalib_dags(pairs_files, max_l1_pt, log_dir, append,
     force_submit : bool, optional
         If True, forces job submission even if proposed output files already exists.
         Otherwise, program quits before submission.
+
+    hadd_fan_in : int, optional
+        Max number of files for each hadd job.
     """
     # Update the matcher script for the worker nodes
     setup_script = 'worker_setup.sh'
@@ -136,7 +139,8 @@ def submit_all_checkCalib_dags(pairs_files, max_l1_pt, log_dir, append,
                                       log_dir=log_dir, append=append,
                                       pu_bins=pu_bins, eta_bins=eta_bins,
                                       common_input_files=common_input_files,
-                                      force_submit=force_submit)
+                                      force_submit=force_submit,
+                                      hadd_fan_in=hadd_fan_in)
         status_files.append(sfile)
     status_files = list(chain.from_iterable(status_files))  # flatten the list
     print 'All statuses:'
@@ -145,7 +149,7 @@ def submit_all_checkCalib_dags(pairs_files, max_l1_pt, log_dir, append,
 
 def submit_checkCalib_dag(pairs_file, max_l1_pt, log_dir, append,
                           pu_bins, eta_bins, common_input_files,
-                          force_submit=False):
+                          force_submit=False, hadd_fan_in=cc.HADD_FAN_IN):
     """Submit one checkCalibration DAG for one pairs file.
 
     This will run checkCalibration over exclusive and inclusive eta bins,
@@ -176,6 +180,10 @@ def submit_checkCalib_dag(pairs_file, max_l1_pt, log_dir, append,
         already exists.
         Oherwise, program quits before submission.
 
+    hadd_fan_in : int, optional
+        Max number of files for each hadd job. Outputs are hadded in a tree
+        of hadd jobs.
+
     """
     cc.check_file_exists(pairs_file)
 
@@ -273,15 +281,6 @@ def submit_checkCalib_dag(pairs_file, max_l1_pt, log_dir, append,
 
         # Construct final hadded file name
         final_file = os.path.join(out_dir, out_stem + append.format(**fmt_dict) + '.root')
-        hadd_output = [final_file]
-        hadd_args = hadd_output + check_output_files
-
-        hadder = ht.Job(name='haddCheckCalib',
-                        args=hadd_args,
-                        input_files=check_output_files,
-                        output_files=hadd_output)
-
-        hadd_jobs.add_job(hadder)
 
         # Add all jobs to DAG, with necessary dependencies
         # ---------------------------------------------------------------------
@@ -291,7 +290,14 @@ def submit_checkCalib_dag(pairs_file, max_l1_pt, log_dir, append,
         for job in checkCalib_jobs:
             checker_dag.add_job(job)
 
-        checker_dag.add_job(hadder, requires=[j for j in checkCalib_jobs])
+        hadd_tree = cc.add_hadd_tree(checker_dag, hadd_jobs, [j for j in checkCalib_jobs],
+                                     final_file, name='haddCheckCalib', fan_in=hadd_fan_in)
+
+        # Delete intermediate hadd files, if any
+        if len(hadd_tree) > 1:
+            cc.add_rm_jobs(checker_dag, files=[j.output_files[0] for j in hadd_tree[:-1]],
+                           requires=[hadd_tree[-1]], log_dir=log_dir, hdfs_store=out_dir,
+                           name='checkCalibHadd')
 
         # Check if any of the output files already exists - maybe we mucked up?
         # ---------------------------------------------------------------------
@@ -317,8 +323,11 @@ if __name__ == "__main__":
                         help='Force submit - will run jobs even if final file '
                              'with same name already exists.',
                         action='store_true')
+    parser.add_argument('--hadd-fan-in', type=int, default=cc.HADD_FAN_IN,
+                        help='Max number of files for each hadd job.')
     args = parser.parse_args()
     submit_all_checkCalib_dags(pairs_files=PAIRS_FILES, max_l1_pt=MAX_L1_PT,
                                log_dir=LOG_DIR, append=APPEND,
                                pu_bins=PU_BINS, eta_bins=ETA_BINS,
-                               force_submit=args.force)
+                               force_submit=args.force,
+                               hadd_fan_in=args.hadd_fan_in)
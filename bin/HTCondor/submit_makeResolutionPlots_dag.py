@@ -39,6 +39,12 @@ MAX_L1_PT = 1022
 # Select eta bins to run over
 ETA_BINS = binning.eta_bins
 
+# Number of cores for each makeResolutionPlots job, to spread the eta bins over
+NUM_CORES = 4
+
+# Max number of files for each hadd job
+HADD_FAN_IN = cc.HADD_FAN_IN
+
 # Select PU bins to run over
 PU_BINS = None  # None if you don't want to cut on PU
 # PU_BINS = binning.pu_bins
@@ -55,7 +61,8 @@ LOG_DIR = '/storage/%s/L1JEC/%s/L1JetEnergyCorrections/jobs/res/%s' % (os.enviro
 
 
 def submit_all_resolution_dags(pairs_files, max_l1_pt, log_dir, append,
-                               pu_bins, eta_bins, force_submit):
+                               pu_bins, eta_bins, num_cores, force_submit,
+                               hadd_fan_in=cc.HADD_FAN_IN):
     """Create and submit DAG makeResolutionPlots jobs for all pairs files.
 
     Parameters
@@ -78,9 +85,15 @@ def submit_all_resolution_dags(pairs_files, max_l1_pt, log_dir, append,
     eta_bins : list[float], optional
         List of eta bin edges, including upper edge of last bin.
 
+    num_cores : int, optional
+        Number of cores for each job, to spread the eta bins over.
+
     force_submit : bool, optional
         If True, forces job submission even if proposed output files already exists.
         Otherwise, program quits before submission.
+
+    hadd_fan_in : int, optional
+        Max number of files for each hadd job.
     """
     # Update the matcher script for the worker nodes
     setup_script = 'worker_setup.sh'
@@ -100,17 +113,21 @@ def submit_all_resolution_dags(pairs_files, max_l1_pt, log_dir, append,
         submit_resolution_dag(pairs_file=pfile, max_l1_pt=max_l1_pt,
                               log_dir=log_dir, append=append,
                               pu_bins=pu_bins, eta_bins=eta_bins,
+                              num_cores=num_cores,
                               common_input_files=common_input_files,
-                              force_submit=force_submit)
+                              force_submit=force_submit,
+                              hadd_fan_in=hadd_fan_in)
 
 
 def submit_resolution_dag(pairs_file, max_l1_pt, log_dir, append,
-                          pu_bins, eta_bins, common_input_files,
-                          force_submit=False):
+                          pu_bins, eta_bins, num_cores, common_input_files,
+                          force_submit=False, hadd_fan_in=cc.HADD_FAN_IN):
     """Submit one makeResolutionPlots DAG for one pairs file.
 
     This will run makeResolutionPlots over exclusive and inclusive eta bins,
-    and then finally hadd the results together.
+    and then finally hadd the results together. All the exclusive eta bins
+    are done by one job, which reads the pairs file once and spreads the
+    eta bins over num_cores processes.
 
     Parameters
     ----------
@@ -132,11 +149,18 @@ def submit_resolution_dag(pairs_file, max_l1_pt, log_dir, append,
     eta_bins : list[float], optional
         List of eta bin edges, including upper edge of last bin.
 
+    num_cores : int, optional
+        Number of cores for each job, to spread the eta bins over.
+
     force_submit : bool, optional
         If True, forces job submission even if proposed output files
         already exists.
         Oherwise, program quits before submission.
 
+    hadd_fan_in : int, optional
+        Max number of files for each hadd job. Outputs are hadded in a tree
+        of hadd jobs.
+
     """
     cc.check_file_exists(pairs_file)
 
@@ -166,7 +190,7 @@ def submit_resolution_dag(pairs_file, max_l1_pt, log_dir, append,
                              out_dir=log_dir, out_file=log_stem + '.out',
                              err_dir=log_dir, err_file=log_stem + '.err',
                              log_dir=log_dir, log_file=log_stem + '.log',
-                             cpus=1, memory='100MB', disk='100MB',
+                             cpus=num_cores, memory='2GB', disk='100MB',
                              transfer_hdfs_input=False,
                              common_input_files=common_input_files,
                              hdfs_store=out_dir)
@@ -177,23 +201,23 @@ def submit_resolution_dag(pairs_file, max_l1_pt, log_dir, append,
         # Hold all output filenames
         res_output_files = []
 
-        # Add exclusive eta bins to this JobSet
-        for ind, (eta_min, eta_max) in enumerate(pairwise(eta_bins)):
-            out_file = out_stem + "_%d" % ind + append.format(**fmt_dict) + '.root'
-            out_file = os.path.join(out_dir, out_file)
-            res_output_files.append(out_file)
+        # Add one job for all exclusive eta bins to this JobSet
+        out_file = out_stem + "_excl" + append.format(**fmt_dict) + '.root'
+        out_file = os.path.join(out_dir, out_file)
+        res_output_files.append(out_file)
 
-            job_args = ['makeResolutionPlots.py', pairs_file, out_file,
-                        '--excl', #'--maxPt', max_l1_pt,
-                        #'--PUmin', pu_min, '--PUmax', pu_max,
-                        '--etaInd', ind]
+        job_args = ['makeResolutionPlots.py', pairs_file, out_file,
+                    '--excl', '--jobs', num_cores, '--no-column-cache',
+                    #'--maxPt', max_l1_pt,
+                    #'--PUmin', pu_min, '--PUmax', pu_max,
+                    '--etaInd'] + range(len(eta_bins) - 1)
 
-            res_job = ht.Job(name='res_%d' % ind,
-                             args=job_args,
-                             input_files=[pairs_file],
-                             output_files=[out_file])
+        res_job = ht.Job(name='res_excl',
+                         args=job_args,
+                         input_files=[pairs_file],
+                         output_files=[out_file])
 
-            res_jobs.add_job(res_job)
+        res_jobs.add_job(res_job)
 
         # Add inclusive bins (central, forward, all)
         # remove the [0:1] to do all - currently central only 'cos HF broke
@@ -203,7 +227,7 @@ def submit_resolution_dag(pairs_file, max_l1_pt, log_dir, append,
             res_output_files.append(out_file)
 
             job_args = ['makeResolutionPlots.py', pairs_file, out_file,
-                        '--incl'] #, '--maxPt', max_l1_pt,
+                        '--incl', '--no-column-cache'] #, '--maxPt', max_l1_pt,
                         # '--PUmin', pu_min, '--PUmax', pu_max]
             if incl != 'all':
                 job_args.append('--%s' % incl)
@@ -233,15 +257,6 @@ def submit_resolution_dag(pairs_file, max_l1_pt, log_dir, append,
 
         # Construct final hadded file name
         final_file = os.path.join(out_dir, out_stem + append.format(**fmt_dict) + '.root')
-        hadd_output = [final_file]
-        hadd_args = hadd_output + res_output_files
-
-        hadder = ht.Job(name='haddRes',
-                        args=hadd_args,
-                        input_files=res_output_files,
-                        output_files=hadd_output)
-
-        hadd_jobs.add_job(hadder)
 
         # Add all jobs to DAG, with necessary dependencies
         # ---------------------------------------------------------------------
@@ -251,7 +266,14 @@ def submit_resolution_dag(pairs_file, max_l1_pt, log_dir, append,
         for job in res_jobs:
             res_dag.add_job(job)
 
-        res_dag.add_job(hadder, requires=[j for j in res_jobs])
+        hadd_tree = cc.add_hadd_tree(res_dag, hadd_jobs, [j for j in res_jobs], final_file,
+                                     name='haddRes', fan_in=hadd_fan_in)
+
+        # Delete intermediate hadd files, if any
+        if len(hadd_tree) > 1:
+            cc.add_rm_jobs(res_dag, files=[j.output_files[0] for j in hadd_tree[:-1]],
+                           requires=[hadd_tree[-1]], log_dir=log_dir, hdfs_store=out_dir,
+                           name='resHadd')
 
         # Check if any of the output files already exists - maybe we mucked up?
         # ---------------------------------------------------------------------
@@ -275,4 +297,5 @@ if __name__ == "__main__":
     submit_all_resolution_dags(pairs_files=PAIRS_FILES, max_l1_pt=MAX_L1_PT,
                                log_dir=LOG_DIR, append=APPEND,
                                pu_bins=PU_BINS, eta_bins=ETA_BINS,
-                               force_submit=force_submit)
+                               num_cores=NUM_CORES, force_submit=force_submit,
+                               hadd_fan_in=HADD_FAN_IN)
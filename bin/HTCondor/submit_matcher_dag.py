@@ -10,6 +10,9 @@ Output files will be produced as follows: for ntuples in XXX/DATASET, individual
 pairs files will be in XXX/DATASET, whilst the hadded final file will be in
 XXX/pairs
 
+Ntuples are packed into groups of roughly equal size (see BYTES_PER_JOB and
+EVENTS_PER_JOB), and each matcher job runs over one group, making one pairs file.
+
 Requires the htcondenser package: https://github.com/raggleton/htcondenser
 
 TODO: some fancier way of switching between MC & Data setups?
@@ -23,8 +26,8 @@ import os
 import sys
 from time import strftime
 from distutils.spawn import find_executable
-from itertools import izip_longest, chain
-import math
+from itertools import chain
+from collections import OrderedDict
 import re
 import htcondenser as ht
 import condorCommon as cc
@@ -120,6 +123,26 @@ APPEND = 'ak4_ref%dto5000_l10to5000_dr%s' % (PT_REF_MIN, str(DELTA_R).replace('.
 if CLEANING_CUT:
     APPEND += '_clean%s' % CLEANING_CUT
 
+# Ntuples are packed into groups, with one matcher job per group, so that there
+# aren't thousands of tiny jobs, and jobs take a similar amount of time.
+# Groups are made with about BYTES_PER_JOB bytes of ntuples, or EVENTS_PER_JOB
+# events if that is set (slower to setup, as it opens every ntuple to count them).
+# Set both to 0/None for one job per ntuple. Can also set with commandline args.
+BYTES_PER_JOB = 2 * 1024 ** 3
+EVENTS_PER_JOB = None
+
+# Rough size of a pairs file compared to its ntuple, to estimate job disk requests
+PAIRS_SIZE_FRACTION = 0.1
+
+# Rough memory used per byte of ntuples in a job (ROOT buffers + hadd of the
+# parts), on top of a fixed amount for the matcher itself
+MEMORY_SIZE_FRACTION = 0.05
+MEMORY_BASE_MB = 100
+
+# Wrapper script that runs the matcher over a group of ntuples
+MATCHER_GROUP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    'run_matcher_group.sh')
+
 # Directory for logs (should be on /storage)
 # Will be created automatically by htcondenser
 datestamp = strftime("%d_%b_%y")
@@ -128,7 +151,8 @@ LOG_DIR = '/storage/%s/L1JEC/%s/L1JetEnergyCorrections/jobs/pairs/%s' % (os.envi
 
 def submit_all_matcher_dags(exe, ntuple_dirs, log_dir, append,
                             l1_dir, ref_dir, deltaR, ref_min_pt, cleaning_cut,
-                            force_submit):
+                            force_submit, bytes_per_job=None, events_per_job=None,
+                            hadd_fan_in=cc.HADD_FAN_IN):
     """Create and submit DAG checkCalibration jobs for all pairs files.
 
     Parameters
@@ -166,6 +190,16 @@ def submit_all_matcher_dags(exe, ntuple_dirs, log_dir, append,
         If True, forces job submission even if proposed output files
         already exists.
         Oherwise, program quits before submission.
+
+    bytes_per_job : int, optional
+        Target total size of ntuples for each matcher job.
+
+    events_per_job : int, optional
+        Target number of events for each matcher job. If set, used instead
+        of bytes_per_job.
+
+    hadd_fan_in : int, optional
+        Max number of files for each hadd job.
     """
     # Update the matcher script for the worker nodes
     setup_script = 'worker_setup.sh'
@@ -184,7 +218,10 @@ def submit_all_matcher_dags(exe, ntuple_dirs, log_dir, append,
                                    l1_dir=l1_dir, ref_dir=ref_dir,
                                    deltaR=deltaR, ref_min_pt=ref_min_pt,
                                    cleaning_cut=cleaning_cut,
-                                   append=append, force_submit=force_submit)
+                                   append=append, force_submit=force_submit,
+                                   bytes_per_job=bytes_per_job,
+                                   events_per_job=events_per_job,
+                                   hadd_fan_in=hadd_fan_in)
         status_files.append(sfile)
 
     if status_files:
@@ -193,10 +230,12 @@ def submit_all_matcher_dags(exe, ntuple_dirs, log_dir, append,
 
 
 def submit_matcher_dag(exe, ntuple_dir, log_dir, l1_dir, ref_dir, deltaR, ref_min_pt, cleaning_cut,
-                       append, force_submit):
+                       append, force_submit, bytes_per_job=None, events_per_job=None,
+                       hadd_fan_in=cc.HADD_FAN_IN):
     """Submit one matcher DAG for one directory of ntuples.
 
     This will run `exe` over all Ntuple files and then hadd the results together.
+    The ntuples are packed into groups, and each job runs over one group.
 
     Parameters
     ----------
@@ -228,26 +267,40 @@ def submit_matcher_dag(exe, ntuple_dir, log_dir, l1_dir, ref_dir, deltaR, ref_mi
         If True, forces job submission even if proposed output files
         already exists.
         Oherwise, program quits before submission.
+
+    bytes_per_job : int, optional
+        Target total size of ntuples for each job.
+
+    events_per_job : int, optional
+        Target number of events for each job. If set, used instead of bytes_per_job.
+        If neither is set, there is one job per ntuple.
+
+    hadd_fan_in : int, optional
+        Max number of files for each hadd job. Outputs are hadded in a tree
+        of hadd jobs.
     """
     # DAG for jobs
     stem = 'matcher_%s_%s' % (strftime("%H%M%S"), cc.rand_str(3))
     matcher_dag = ht.DAGMan(filename=os.path.join(log_dir, '%s.dag' % stem),
                             status_file=os.path.join(log_dir, '%s.status' % stem))
 
-    # JobSet for each matching job
+    # Get ntuples to run over, and pack them into groups, one per job
+    ntuples = sorted(n for n in os.listdir(ntuple_dir)
+                     if n.endswith('.root') and not n.startswith('pairs'))  # skip non-ntuple files
+    ntuple_abspaths = [os.path.join(ntuple_dir, n) for n in ntuples]
+    ntuple_bytes = [os.path.getsize(f) for f in ntuple_abspaths]
+    if events_per_job:
+        groups = pack_files([get_num_events(f) for f in ntuple_abspaths], events_per_job)
+    else:
+        groups = pack_files(ntuple_bytes, bytes_per_job)
+    log.info("Packed %d ntuples into %d matcher jobs", len(ntuples), len(groups))
+
+    # JobSets for matching jobs - one per resource request, since they're set per JobSet
     log_stem = 'matcher.$(cluster).$(process)'
+    matcher_jobsets = OrderedDict()
 
-    matcher_jobs = ht.JobSet(exe=find_executable(exe),
-                             copy_exe=True,
-                             filename='submit_matcher.condor',
-                             setup_script=None,
-                             out_dir=log_dir, out_file=log_stem + '.out',
-                             err_dir=log_dir, err_file=log_stem + '.err',
-                             log_dir=log_dir, log_file=log_stem + '.log',
-                             cpus=1, memory='100MB', disk='100MB',
-                             transfer_hdfs_input=False,
-                             share_exe_setup=True,
-                             hdfs_store=ntuple_dir)
+    # All matching jobs
+    matcher_jobs = []
 
     # For creating filenames later
     fmt_dict = dict()
@@ -256,21 +309,18 @@ def submit_matcher_dag(exe, ntuple_dir, log_dir, l1_dir, ref_dir, deltaR, ref_mi
     match_output_files = []
 
     # Additional files to copy across - JEC, etc
-    common_input_files = []
+    # The matcher exe is run by run_matcher_group.sh, so is copied as an input file
+    common_input_files = [find_executable(exe)]
 
-    # Add matcher job for each ntuple file
-    for ind, ntuple in enumerate(os.listdir(ntuple_dir)):
+    # Add matcher job for each group of ntuple files
+    for ind, group in enumerate(groups):
         # if ind > 10:
         #     break
 
-        # Skip non-ntuple files
-        if not ntuple.endswith('.root') or ntuple.startswith('pairs'):
-            continue
+        group_abspaths = [ntuple_abspaths[i] for i in group]
 
-        ntuple_abspath = os.path.join(ntuple_dir, ntuple)
-
-        # Construct output name
-        ntuple_name = os.path.splitext(ntuple)[0]
+        # Construct output name from the first ntuple in the group
+        ntuple_name = os.path.splitext(ntuples[group[0]])[0]
         # handle anything up to first underscore (L1Tree, L1Ntuple, ...)
         result = re.match(r'^[a-zA-Z0-9]*_', ntuple_name)
         if result:
@@ -282,21 +332,36 @@ def submit_matcher_dag(exe, ntuple_dir, log_dir, l1_dir, ref_dir, deltaR, ref_mi
         match_output_files.append(out_file)
 
         # Add matching job
-        job_args = ['-I', ntuple_abspath, '-O', out_file,
-                    '--refDir', ref_dir, '--l1Dir', l1_dir,
-                    '--draw 0', '--deltaR', deltaR, '--refMinPt', ref_min_pt]
+        job_args = [exe, out_file] + group_abspaths
+        job_args += ['--', '--refDir', ref_dir, '--l1Dir', l1_dir,
+                     '--draw 0', '--deltaR', deltaR, '--refMinPt', ref_min_pt]
         if cleaning_cut:
             job_args.extend(['--cleanJets', cleaning_cut])
 
-        input_files = common_input_files + [ntuple_abspath]
+        memory, disk = get_resource_request(len(group), sum(ntuple_bytes[i] for i in group))
+        if (memory, disk) not in matcher_jobsets:
+            condor_file = 'submit_matcher_%s_%s.condor' % (memory, disk)
+            matcher_jobsets[(memory, disk)] = ht.JobSet(exe=MATCHER_GROUP_SCRIPT,
+                                                        copy_exe=True,
+                                                        filename=condor_file,
+                                                        setup_script=None,
+                                                        out_dir=log_dir, out_file=log_stem + '.out',
+                                                        err_dir=log_dir, err_file=log_stem + '.err',
+                                                        log_dir=log_dir, log_file=log_stem + '.log',
+                                                        cpus=1, memory=memory, disk=disk,
+                                                        transfer_hdfs_input=False,
+                                                        common_input_files=common_input_files,
+                                                        share_exe_setup=True,
+                                                        hdfs_store=ntuple_dir)
 
         match_job = ht.Job(name='match_%d' % ind,
                            args=job_args,
-                           input_files=input_files,
+                           input_files=group_abspaths,
                            output_files=[out_file])
 
-        matcher_jobs.add_job(match_job)
+        matcher_jobsets[(memory, disk)].add_job(match_job)
         matcher_dag.add_job(match_job)
+        matcher_jobs.append(match_job)
 
     # Construct final filename
     # ---------------------------------------------------------------------
@@ -317,29 +382,29 @@ def submit_matcher_dag(exe, ntuple_dir, log_dir, l1_dir, ref_dir, deltaR, ref_mi
 
     # Add in hadding jobs
     # ---------------------------------------------------------------------
-    hadd_jobs = add_hadd_jobs(matcher_dag, matcher_jobs.jobs.values(), final_file, log_dir)
+    log_stem = 'matcherHadd.$(cluster).$(process)'
+
+    hadd_jobs = ht.JobSet(exe='hadd',
+                          copy_exe=False,
+                          filename='haddBig.condor',
+                          setup_script=None,
+                          out_dir=log_dir, out_file=log_stem + '.out',
+                          err_dir=log_dir, err_file=log_stem + '.err',
+                          log_dir=log_dir, log_file=log_stem + '.log',
+                          cpus=1, memory='100MB', disk='1GB',
+                          transfer_hdfs_input=False,
+                          share_exe_setup=True,
+                          hdfs_store=os.path.dirname(final_file))
+
+    hadd_tree = cc.add_hadd_tree(matcher_dag, hadd_jobs, matcher_jobs, final_file,
+                                 name='finalHadd', fan_in=hadd_fan_in)
 
     # Add in job to delete individual and intermediate hadd files
     # ---------------------------------------------------------------------
-    log_stem = 'matcherRm.$(cluster).$(process)'
-
-    rm_jobs = ht.JobSet(exe='hadoop',
-                        copy_exe=False,
-                        filename='submit_matcherRm.condor',
-                        out_dir=log_dir, out_file=log_stem + '.out',
-                        err_dir=log_dir, err_file=log_stem + '.err',
-                        log_dir=log_dir, log_file=log_stem + '.log',
-                        cpus=1, memory='100MB', disk='10MB',
-                        transfer_hdfs_input=False,
-                        share_exe_setup=False,
-                        hdfs_store=ntuple_dir)
-
-    for i, job in enumerate(chain(matcher_jobs, hadd_jobs[:-1])):
-        pairs_file = job.output_files[0]
-        rm_job = ht.Job(name='rm%d' % i,
-                        args=' fs -rm -skipTrash %s' % pairs_file.replace('/hdfs', ''))
-        rm_jobs.add_job(rm_job)
-        matcher_dag.add_job(rm_job, requires=hadd_jobs[-1])
+    cc.add_rm_jobs(matcher_dag,
+                   files=[j.output_files[0] for j in chain(matcher_jobs, hadd_tree[:-1])],
+                   requires=[hadd_tree[-1]], log_dir=log_dir, hdfs_store=ntuple_dir,
+                   name='matcher')
 
     # Submit
     # ---------------------------------------------------------------------
@@ -348,106 +413,91 @@ def submit_matcher_dag(exe, ntuple_dir, log_dir, l1_dir, ref_dir, deltaR, ref_mi
     return matcher_dag.status_file
 
 
-def add_hadd_jobs(dagman, jobs, final_file, log_dir):
-    """Add necessary hadd jobs to DAG. All jobs will be hadded together to make
-    `final_file`.
+def pack_files(sizes, target):
+    """Pack files into groups with a total size of about `target`, one group per job.
 
-    DAGs can only accept a maximum number of arguments, so we have to split
-    up hadd-ing into groups. Therefore we need an intermediate layer of hadd
-    jobs, and then finally hadd those intermediate output files
+    Uses first-fit decreasing: files are placed biggest first, each into the
+    first group with room for it, otherwise it starts a new group.
+    Files bigger than `target` get a group to themselves.
 
     Parameters
     ----------
-    dagman : DAGMan
-        DAGMan object to add jobs to.
+    sizes : list[int]
+        Size of each file (bytes, events, ...).
 
-    jobs : list[Job]
-        Collection of Jobs to be hadd-ed together.
-
-    final_file : str
-        Final hadd-ed filename.
+    target : int
+        Maximum total size for a group. If 0 or None, each file gets its own group.
 
     Returns
     -------
-    JobSet
-        JobSet for hadd jobs.
+    list[list[int]]
+        Indices of files in each group. Each group is sorted, and groups are
+        ordered by their first index, so the result doesn't depend on sizes
+        beyond which files go together.
     """
-    group_size = 200  # max files per hadding job
-    # adjust to avoid hadding 1 file by itself
-    if len(jobs) % group_size == 0:
-        group_size = 199
-    # calculate number of intermediate hadd jobs required
-    n_inter_jobs = int(math.ceil(len(jobs) * 1. / group_size))
+    if not target:
+        return [[i] for i in range(len(sizes))]
+    groups, totals = [], []
+    for ind in sorted(range(len(sizes)), key=lambda i: (-sizes[i], i)):
+        for i_group, total in enumerate(totals):
+            if total + sizes[ind] <= target:
+                groups[i_group].append(ind)
+                totals[i_group] += sizes[ind]
+                break
+        else:
+            groups.append([ind])
+            totals.append(sizes[ind])
+    return sorted(sorted(g) for g in groups)
+
+
+def get_num_events(filename, tree_name='l1EventTree/L1EventTree'):
+    """Get number of events in an ntuple"""
+    # only import when needed, as opening the file is slow
+    import ROOT
+    f = ROOT.TFile.Open(filename)
+    if not f or f.IsZombie():
+        raise IOError("Cannot open %s" % filename)
+    tree = f.Get(tree_name)
+    if not tree:
+        raise IOError("Cannot get %s from %s" % (tree_name, filename))
+    n_events = tree.GetEntries()
+    f.Close()
+    return n_events
+
+
+def get_resource_request(n_files, n_bytes):
+    """Get memory & disk requests for a matcher job, from its ntuples.
+
+    Ntuples are read from /hdfs, so disk is just for the pairs files: twice over
+    if parts are hadded together. Memory scales with the total ntuple size,
+    see MEMORY_SIZE_FRACTION. Both are rounded up to a power of 2 MB, so jobs
+    share a few JobSets.
 
-    log_stem = 'matcherHadd.$(cluster).$(process)'
+    Parameters
+    ----------
+    n_files : int
+        Number of ntuples in job.
 
-    hadd_jobs = ht.JobSet(exe='hadd',
-                          copy_exe=False,
-                          filename='haddBig.condor',
-                          setup_script=None,
-                          out_dir=log_dir, out_file=log_stem + '.out',
-                          err_dir=log_dir, err_file=log_stem + '.err',
-                          log_dir=log_dir, log_file=log_stem + '.log',
-                          cpus=1, memory='100MB', disk='1GB',
-                          transfer_hdfs_input=False,
-                          share_exe_setup=True,
-                          hdfs_store=os.path.dirname(final_file))
+    n_bytes : int
+        Total size of ntuples in job.
 
-    if n_inter_jobs == 1:
-        hadd_input = [j.output_files[0] for j in jobs]
-        hadd_args = [final_file] + hadd_input
-        hadd_job = ht.Job(name='finalHadd',
-                          args=hadd_args,
-                          input_files=hadd_input,
-                          output_files=[final_file])
-        hadd_jobs.add_job(hadd_job)
-        dagman.add_job(hadd_job, requires=jobs)
-    else:
-        # Go through groups of Jobs, make intermediate hadd files in same dir
-        # as final file
-        intermediate_jobs = []
-        for i, job_group in enumerate(grouper(jobs, group_size)):
-            # Note, job_group is guaranteed to be length group_size, and is
-            # padded with None if there arent' that many entries. So need to
-            # filter out NoneType
-            job_group = filter(None, job_group)
-            hadd_input = [j.output_files[0] for j in job_group]
-            inter_file = 'hadd_inter_%d_%s.root' % (i, cc.rand_str(5))
-            inter_file = os.path.join(os.path.dirname(final_file), inter_file)
-            hadd_args = [inter_file] + hadd_input
-            hadd_job = ht.Job(name='interHadd%d' % i,
-                              args=hadd_args,
-                              input_files=hadd_input,
-                              output_files=[inter_file])
-            hadd_jobs.add_job(hadd_job)
-            dagman.add_job(hadd_job, requires=job_group)
-            intermediate_jobs.append(hadd_job)
-
-        # Add final hadd job for intermediate files
-        hadd_input = [j.output_files[0] for j in intermediate_jobs]
-        hadd_args = [final_file] + hadd_input
-        hadd_job = ht.Job(name='finalHadd',
-                          args=hadd_args,
-                          input_files=hadd_input,
-                          output_files=[final_file])
-        hadd_jobs.add_job(hadd_job)
-        dagman.add_job(hadd_job, requires=intermediate_jobs)
-
-    return hadd_jobs
-
-
-def grouper(iterable, n, fillvalue=None):
-    """Collect data into fixed-length chunks or blocks.
-
-    If iterable does not divide by n with modulus 0, then the remaining entries
-    in the last iterable of grouper() will be padded with fillvalue.
-
-    Taken from https://docs.python.org/2/library/itertools.html#recipes
-    e.g.
-    >>> grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx
+    Returns
+    -------
+    str, str
+        Memory and disk requests.
     """
-    args = [iter(iterable)] * n
-    return izip_longest(fillvalue=fillvalue, *args)
+    input_mb = n_bytes / 1024. ** 2
+    memory_mb = round_up_mb(MEMORY_BASE_MB + input_mb * MEMORY_SIZE_FRACTION)
+    disk_mb = round_up_mb((2 if n_files > 1 else 1) * input_mb * PAIRS_SIZE_FRACTION)
+    return '%dMB' % memory_mb, '%dMB' % disk_mb
+
+
+def round_up_mb(size_mb, min_mb=100):
+    """Round size_mb up to min_mb times a power of 2."""
+    rounded_mb = min_mb
+    while rounded_mb < size_mb:
+        rounded_mb *= 2
+    return rounded_mb
 
 
 if __name__ == "__main__":
@@ -456,9 +506,20 @@ if __name__ == "__main__":
                         help='Force submit - will run jobs even if final file '
                              'with same name already exists.',
                         action='store_true')
+    parser.add_argument('--bytes-per-job', type=int, default=BYTES_PER_JOB,
+                        help='Target total size of ntuples (in bytes) for each matcher job. '
+                             'Set to 0 for one job per ntuple.')
+    parser.add_argument('--events-per-job', type=int, default=EVENTS_PER_JOB,
+                        help='Target number of events for each matcher job. '
+                             'Overrides --bytes-per-job, but slower to setup.')
+    parser.add_argument('--hadd-fan-in', type=int, default=cc.HADD_FAN_IN,
+                        help='Max number of files for each hadd job.')
     args = parser.parse_args()
     sys.exit(submit_all_matcher_dags(exe=EXE, ntuple_dirs=NTUPLE_DIRS, log_dir=LOG_DIR,
                                      l1_dir=L1_DIR, ref_dir=REF_DIR,
                                      deltaR=DELTA_R, ref_min_pt=PT_REF_MIN,
                                      cleaning_cut=CLEANING_CUT,
-                                     append=APPEND, force_submit=args.force))
+                                     append=APPEND, force_submit=args.force,
+                                     bytes_per_job=args.bytes_per_job,
+                                     events_per_job=args.events_per_job,
+                                     hadd_fan_in=args.hadd_fan_in))
@@ -80,7 +80,8 @@ datestamp = strftime("%d_%b_%y")
 LOG_DIR = '/storage/%s/L1JEC/%s/L1JetEnergyCorrections/jobs/calib/%s' % (os.environ['LOGNAME'], os.environ['CMSSW_VERSION'], datestamp)
 
 
-def submit_all_runCalib_dags(pairs_files, log_dir, append, pu_bins, eta_bins, force_submit):
+def submit_all_runCalib_dags(pairs_files, log_dir, append, pu_bins, eta_bins, force_submit,
+                             hadd_fan_in=cc.HADD_FAN_IN):
     """Create and submit DAG runCalibration jobs for all pairs files.
 
     Parameters
@@ -103,6 +104,9 @@ def submit_all_runCalib_dags(pairs_files, log_dir, append, pu_bins, eta_bins, fo
     force_submit : bool, optional
         If True, forces job submission even if proposed output files already exists.
         Otherwise, program quits before submission.
+
+    hadd_fan_in : int, optional
+        Max number of files for each hadd job.
     """
     # Update the matcher script for the worker nodes
     setup_script = 'worker_setup.sh'
@@ -124,7 +128,8 @@ def submit_all_runCalib_dags(pairs_files, log_dir, append, pu_bins, eta_bins, fo
         sfile = submit_runCalib_dag(pairs_file=pfile, log_dir=log_dir, append=append,
                                     pu_bins=pu_bins, eta_bins=eta_bins,
                                     common_input_files=common_input_files,
-                                    force_submit=force_submit)
+                                    force_submit=force_submit,
+                                    hadd_fan_in=hadd_fan_in)
         status_files.append(sfile)
 
     if status_files:
@@ -134,7 +139,7 @@ def submit_all_runCalib_dags(pairs_files, log_dir, append, pu_bins, eta_bins, fo
 
 
 def submit_runCalib_dag(pairs_file, log_dir, append, pu_bins, eta_bins, common_input_files,
-                        force_submit=False):
+                        force_submit=False, hadd_fan_in=cc.HADD_FAN_IN):
     """Submit one runCalibration DAG for one pairs file.
 
     This will run runCalibration over exclusive and inclusive eta bins,
@@ -162,6 +167,10 @@ def submit_runCalib_dag(pairs_file, log_dir, append, pu_bins, eta_bins, common_i
         already exists.
         Oherwise, program quits before submission.
 
+    hadd_fan_in : int, optional
+        Max number of files for each hadd job. Outputs are hadded in a tree
+        of hadd jobs.
+
     """
     cc.check_file_exists(pairs_file)
 
@@ -240,15 +249,6 @@ def submit_runCalib_dag(pairs_file, log_dir, append, pu_bins, eta_bins, common_i
 
         # Construct final hadded file name
         final_file = os.path.join(out_dir, out_stem + append.format(**fmt_dict) + '.root')
-        hadd_output = [final_file]
-        hadd_args = hadd_output + calib_output_files
-
-        hadder = ht.Job(name='haddRunCalib',
-                        args=hadd_args,
-                        input_files=calib_output_files,
-                        output_files=hadd_output)
-
-        hadd_jobs.add_job(hadder)
 
         # Add all jobs to DAG, with necessary dependencies
         # ---------------------------------------------------------------------
@@ -258,7 +258,14 @@ def submit_runCalib_dag(pairs_file, log_dir, append, pu_bins, eta_bins, common_i
         for job in runCalib_jobs:
             calib_dag.add_job(job)
 
-        calib_dag.add_job(hadder, requires=[j for j in runCalib_jobs])
+        hadd_tree = cc.add_hadd_tree(calib_dag, hadd_jobs, [j for j in runCalib_jobs], final_file,
+                                     name='haddRunCalib', fan_in=hadd_fan_in)
+
+        # Delete intermediate hadd files, if any
+        if len(hadd_tree) > 1:
+            cc.add_rm_jobs(calib_dag, files=[j.output_files[0] for j in hadd_tree[:-1]],
+                           requires=[hadd_tree[-1]], log_dir=log_dir, hdfs_store=out_dir,
+                           name='runCalibHadd')
 
         # Check if any of the output files already exists - maybe we mucked up?
         # ---------------------------------------------------------------------
@@ -284,6 +291,9 @@ if __name__ == "__main__":
                         help='Force submit - will run jobs even if final file '
                              'with same name already exists.',
                         action='store_true')
+    parser.add_argument('--hadd-fan-in', type=int, default=cc.HADD_FAN_IN,
+                        help='Max number of files for each hadd job.')
     args = parser.parse_args()
     submit_all_runCalib_dags(pairs_files=PAIRS_FILES, log_dir=LOG_DIR, append=APPEND,
-                             pu_bins=PU_BINS, eta_bins=ETA_BINS, force_submit=args.force)
+                             pu_bins=PU_BINS, eta_bins=ETA_BINS, force_submit=args.force,
+                             hadd_fan_in=args.hadd_fan_in)
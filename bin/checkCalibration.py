@@ -11,7 +11,10 @@ python checkCalibration.py -h
 
 
 import ROOT
+import os
 import sys
+import re
+import glob
 from array import array
 import numpy as np
 import argparse
@@ -27,7 +30,241 @@ ROOT.gStyle.SetOptFit(1111)
 ROOT.TH1.SetDefaultSumw2(True)
 
 
-def plot_checks(inputfile, outputfile, absetamin, absetamax, max_pt, pu_min, pu_max):
+#
+# Response cube: the pairs binned in |eta| x pt x ptRef x rsp (x PU), filled
+# once & cached to disk. All the hists are then made by selecting & summing
+# cells of the cube, instead of TTree::Draw.
+#
+# Each |eta|, pt & ptRef bin is split into 2 "sub-bins": values exactly on
+# its lower edge, and values strictly inside it. So any cut (<, >, <=, >=),
+# or hist bin edge, at one of the cube bin edges gives exactly the same
+# result as on the pairs themselves. pT cuts & hist edges should therefore
+# be multiples of CUBE_PT_STEP, and eta ranges should use CUBE_ETA_BINS edges.
+#
+CUBE_VERSION = 1
+CUBE_ETA_BINS = binning.eta_bins
+CUBE_PT_STEP = 0.5
+CUBE_PT_MAX = 1024
+CUBE_RSP_BINS = (100, 0, 5)  # nbins, min, max - must match the response hists
+# per-cell sums of these quantities (or products) are stored, for hist stats
+CUBE_SUMS = [("pt",), ("pt", "pt"), ("ptRef",), ("ptRef", "ptRef"), ("rsp",), ("rsp", "rsp"),
+             ("pt", "rsp"), ("ptRef", "rsp"), ("pt", "ptRef")]
+
+
+def get_cube_sum_name(*quantities):
+    return "sum_" + "_".join(sorted(quantities))
+
+
+def find_sub_bins(values, edges):
+    """Assign values to sub-bins of edges.
+
+    Each bin [edges[k], edges[k+1]) is split into the value edges[k] exactly
+    (sub-bin 2k+1), and the open interval (edges[k], edges[k+1]) (sub-bin 2k+2).
+    Sub-bin 0 is the underflow, and 2n+1 & 2n+2 are the last edge exactly
+    and above it, for n bins.
+
+    Returns
+    -------
+    np.array, np.array
+        Sub-bin index for each value, and a representative value for each
+        sub-bin, for applying cuts: the edge value itself, the bin centre,
+        or +/- infinity for under/overflows.
+    """
+    edges = np.asarray(edges, dtype=float)
+    n_bins = len(edges) - 1
+    ind = np.searchsorted(edges, values, side='right') - 1
+    on_edge = (ind >= 0) & (values == edges[np.clip(ind, 0, n_bins)])
+    sub_bins = 2 * ind + 2 - on_edge
+
+    rep_values = np.empty(2 * n_bins + 3)
+    rep_values[0] = -np.inf
+    rep_values[1::2] = edges
+    rep_values[2:-1:2] = 0.5 * (edges[:-1] + edges[1:])
+    rep_values[-1] = np.inf
+    return sub_bins, rep_values
+
+
+def make_response_cube(columns, eta_bins):
+    """Bin pairs into the response cube.
+
+    Parameters
+    ----------
+    columns : dict
+        Pair quantities, with eta, pt, ptRef, rsp, and optionally numPUVertices
+    eta_bins : list[float]
+        |eta| bin edges
+
+    Returns
+    -------
+    dict
+        The cube, stored sparsely: only cells with entries are kept.
+        "cells" holds the flat index of each cell, "counts" its number of
+        pairs, and "sum_*" the sums of quantities in CUBE_SUMS. The rest
+        describe the binning, see get_cube_values().
+    """
+    eta_ind, eta_values = find_sub_bins(np.abs(columns["eta"]), eta_bins)
+    pt_edges = np.arange(0, CUBE_PT_MAX + CUBE_PT_STEP, CUBE_PT_STEP)
+    pt_ind, pt_values = find_sub_bins(columns["pt"], pt_edges)
+    ptRef_ind, _ = find_sub_bins(columns["ptRef"], pt_edges)
+    rsp_ind = cu.find_bins(columns["rsp"], *CUBE_RSP_BINS)
+    if "numPUVertices" in columns:
+        pu_values, pu_ind = np.unique(columns["numPUVertices"], return_inverse=True)
+    else:
+        pu_values, pu_ind = np.array([np.nan]), np.zeros(len(eta_ind), dtype=int)
+
+    shape = (len(eta_values), len(pt_values), len(pt_values), CUBE_RSP_BINS[0] + 2, len(pu_values))
+    flat_ind = np.ravel_multi_index((eta_ind, pt_ind, ptRef_ind, rsp_ind, pu_ind), shape)
+    cells, cell_ind = np.unique(flat_ind, return_inverse=True)
+
+    cube = dict(cells=cells, counts=np.bincount(cell_ind, minlength=len(cells)),
+                shape=np.array(shape), eta_values=eta_values, pt_values=pt_values,
+                pu_values=pu_values, has_pu=np.array("numPUVertices" in columns))
+    for quantities in CUBE_SUMS:
+        weights = np.prod([columns[q] for q in quantities], axis=0)
+        cube[get_cube_sum_name(*quantities)] = np.bincount(cell_ind, weights=weights,
+                                                           minlength=len(cells))
+    return cube
+
+
+def get_response_cube(inputfile, eta_bins, use_cache=True):
+    """Get the response cube for a pairs file, from the cache next to it
+    if possible, otherwise make it (and cache it).
+
+    The cache is keyed on the input file & the cube binning, and lives in
+    the column cache directory, see common_utils.get_column_cache_dir().
+    """
+    tree_raw = cu.get_from_file(inputfile, "valid")
+    filename = inputfile.GetName()
+    cache_file = None
+    if use_cache and cu.check_file_exists(filename):
+        spec = repr((CUBE_VERSION, list(eta_bins), CUBE_PT_STEP, CUBE_PT_MAX, CUBE_RSP_BINS))
+        cache_dir = cu.get_column_cache_dir(filename)
+        cache_file = cu.get_column_cache_filename(cache_dir, filename, tree_raw.GetName(),
+                                                  "response_cube", spec)
+        cache_file = os.path.splitext(cache_file)[0] + ".npz"
+        if os.path.isfile(cache_file):
+            print "Loaded response cube from", cache_file
+            with np.load(cache_file) as f:
+                return {k: f[k] for k in f.files}
+
+    branches = ["eta", "pt", "ptRef", "rsp"]
+    if hasattr(tree_raw, "numPUVertices"):
+        branches.append("numPUVertices")
+    else:
+        print "No numPUVertices in tree - PU cuts will be ignored"
+    print "Reading columns", branches, "from", filename
+    if use_cache:
+        columns = cu.get_tree_columns_cached(tree_raw, branches)
+    else:
+        columns = cu.get_tree_columns(tree_raw, branches)
+    cube = make_response_cube(columns, eta_bins)
+    print "Response cube has %d non-empty cells" % len(cube["cells"])
+
+    if cache_file:
+        try:
+            cu.check_dir_exists_create(cache_dir)
+            # remove cubes for older versions of the input file
+            prefix = cache_file[:cache_file.rfind("_")]
+            for old_file in glob.glob(prefix + "_*.npz"):
+                if old_file != cache_file and re.match(r"_[0-9a-f]{16}\.npz$",
+                                                       old_file[len(prefix):]):
+                    os.remove(old_file)
+            # write to temp file & rename, so another process never sees half a file
+            tmp_file = "%s.%d.tmp.npz" % (cache_file, os.getpid())
+            np.savez(tmp_file, **cube)
+            os.rename(tmp_file, cache_file)
+            print "Cached response cube in", cache_file
+        except (IOError, OSError) as e:
+            print "Couldn't write response cube cache", cache_file, ":", e
+    return cube
+
+
+def get_cube_values(cube, quantity):
+    """Get the value of a quantity (eta [i.e. |eta|], pt, ptRef, numPUVertices)
+    for each cell of the cube, to apply cuts on.
+
+    For eta, pt & ptRef, this is the representative value of the cell's
+    sub-bin, see find_sub_bins().
+    """
+    axis = ["eta", "pt", "ptRef", "rsp", "numPUVertices"].index(quantity)
+    ind = np.unravel_index(cube["cells"], cube["shape"])[axis]
+    values = {"eta": cube["eta_values"], "pt": cube["pt_values"],
+              "ptRef": cube["pt_values"], "numPUVertices": cube["pu_values"]}[quantity]
+    return values[ind]
+
+
+def pass_pu_cut(cube, pu_min, pu_max):
+    """Mask of cube cells with pu_min <= numPUVertices <= pu_max.
+    Passes everything if the pairs have no PU info."""
+    if not cube["has_pu"]:
+        return np.ones(len(cube["cells"]), dtype=bool)
+    pu = get_cube_values(cube, "numPUVertices")
+    return (pu <= pu_max) & (pu >= pu_min)
+
+
+def fill_hist_from_cube(hist, cube, selected, x_quantity, y_quantity=None):
+    """Fill a TH1 or TH2 from the selected cells of the response cube, as
+    TTree::Draw("y:x>>hist", cut) would.
+
+    x_quantity & y_quantity are each one of pt, ptRef or rsp.
+    pt & ptRef axes can have any binning with edges that are multiples of
+    CUBE_PT_STEP. rsp axes must have the same binning as the cube.
+
+    Parameters
+    ----------
+    hist : ROOT.TH1 or ROOT.TH2
+        Hist to fill, any contents are overwritten
+    cube : dict
+        Response cube, from get_response_cube()
+    selected : np.array[bool]
+        Mask of cells to use
+    x_quantity, y_quantity : str
+        Quantities to plot on the x (& y) axis
+    """
+    cell_axes = np.unravel_index(cube["cells"][selected], cube["shape"])
+    counts = cube["counts"][selected]
+
+    def get_hist_bins(quantity, axis):
+        if quantity == "rsp":
+            if (axis.GetNbins(), axis.GetXmin(), axis.GetXmax()) != CUBE_RSP_BINS:
+                raise ValueError("Response axis binning of %s must be %s" %
+                                 (hist.GetName(), CUBE_RSP_BINS))
+            return cell_axes[3], axis.GetNbins()
+        edges = np.array([axis.GetBinLowEdge(i) for i in range(1, axis.GetNbins() + 2)])
+        if np.any(np.mod(edges[edges < CUBE_PT_MAX], CUBE_PT_STEP) != 0):
+            print "WARNING: %s bin edges not multiples of %g, will be approximate" % \
+                (hist.GetName(), CUBE_PT_STEP)
+        # hist bin for each sub-bin of the cube, using its representative value
+        sub_bin_hist_bins = np.searchsorted(edges, cube["pt_values"], side='right')
+        return sub_bin_hist_bins[cell_axes[["pt", "ptRef"].index(quantity) + 1]], axis.GetNbins()
+
+    x_bins, nx = get_hist_bins(x_quantity, hist.GetXaxis())
+    in_range = (x_bins > 0) & (x_bins <= nx)
+    global_bins = x_bins
+    n_cells = nx + 2
+    quantities = [x_quantity]
+    if y_quantity:
+        y_bins, ny = get_hist_bins(y_quantity, hist.GetYaxis())
+        in_range &= (y_bins > 0) & (y_bins <= ny)
+        global_bins = x_bins + n_cells * y_bins
+        n_cells *= ny + 2
+        quantities.append(y_quantity)
+
+    # Stats only include entries inside the hist range, as for TH1::Fill
+    sum_in_range = lambda *q: cube[get_cube_sum_name(*q)][selected][in_range].sum()
+    n_in_range = counts[in_range].sum()
+    stats = [n_in_range, n_in_range]
+    for q in quantities:
+        stats.extend([sum_in_range(q), sum_in_range(q, q)])
+    if y_quantity:
+        stats.append(sum_in_range(x_quantity, y_quantity))
+
+    hist_counts = np.bincount(global_bins, weights=counts, minlength=n_cells)
+    cu.set_hist_from_counts(hist, hist_counts, np.array(stats, dtype=float), counts.sum())
+    return hist
+
+
+def plot_checks(cube, outputfile, absetamin, absetamax, max_pt, pu_min, pu_max):
     """
     Do all the relevant response 1D and 2D hists, for one eta bin.
 
@@ -37,26 +274,21 @@ def plot_checks(inputfile, outputfile, absetamin, absetamax, max_pt, pu_min, pu_
 
     print "Doing eta bin: %g - %g, max L1 jet pt: %g" % (absetamin, absetamax, max_pt)
 
-    # Input tree
-    tree_raw = inputfile.Get("valid")
-
     # Output folders
     output_f = outputfile.mkdir('eta_%g_%g' % (absetamin, absetamax))
     output_f_hists = output_f.mkdir("Histograms")
 
-    # Eta cut string
-    eta_cutStr = " TMath::Abs(eta)<%g && TMath::Abs(eta) > %g " % (absetamax, absetamin)
-    # Pt cut string
-    pt_cutStr = "pt < %g" % max_pt
-    # PU cut string
-    pu_cutStr = "numPUVertices <= %f && numPUVertices >= %f" % (pu_max, pu_min)
+    abs_eta = get_cube_values(cube, "eta")
+    pt = get_cube_values(cube, "pt")
+    # Eta, pt & PU cuts
+    selected = (abs_eta < absetamax) & (abs_eta > absetamin) & (pt < max_pt)
+    selected &= pass_pu_cut(cube, pu_min, pu_max)
     # Avoid L1 saturated jets cut (from 2017 any l1 jet with a saturated tower is auto given pt=1024GeV)
-    avoidSaturation_cut = "pt < 1023.1"
-    cutStr = " && ".join([eta_cutStr, pt_cutStr, pu_cutStr, avoidSaturation_cut])
+    selected &= pt < 1023.1
 
-    # Draw response (pT^L1/pT^Gen) for all pt bins
-    tree_raw.Draw("rsp>>hrsp_eta_%g_%g(100,0,5)" % (absetamin, absetamax), cutStr)
-    hrsp_eta = ROOT.gROOT.FindObject("hrsp_eta_%g_%g" % (absetamin, absetamax))
+    # Response (pT^L1/pT^Gen) for all pt bins
+    hrsp_eta = ROOT.TH1F("hrsp_eta_%g_%g" % (absetamin, absetamax), "", 100, 0, 5)
+    fill_hist_from_cube(hrsp_eta, cube, selected, "rsp")
     hrsp_eta.SetTitle(";response (p_{T}^{L1}/p_{T}^{Ref});")
     if absetamin < 2.9:
         fit_result = hrsp_eta.Fit("gaus", "QER", "",
@@ -76,32 +308,32 @@ def plot_checks(inputfile, outputfile, absetamin, absetamax, max_pt, pu_min, pu_
     nb_pt, pt_min, pt_max = 512, 0, 1024  # for Stage 2
     nb_rsp, rsp_min, rsp_max = 100, 0, 5
 
-    # Draw rsp (pT^L1/pT^Gen) Vs GenJet pT
-    tree_raw.Draw("rsp:ptRef>>h2d_rsp_gen(%d,%g,%g,%d,%g,%g)" % (nb_pt, pt_min, pt_max, nb_rsp, rsp_min, rsp_max), cutStr)
-    h2d_rsp_gen = ROOT.gROOT.FindObject("h2d_rsp_gen")
+    # rsp (pT^L1/pT^Gen) Vs GenJet pT
+    h2d_rsp_gen = ROOT.TH2F("h2d_rsp_gen", "", nb_pt, pt_min, pt_max, nb_rsp, rsp_min, rsp_max)
+    fill_hist_from_cube(h2d_rsp_gen, cube, selected, "ptRef", "rsp")
     h2d_rsp_gen.SetTitle(";p_{T}^{Ref} [GeV];response (p_{T}^{L1}/p_{T}^{Ref})")
     output_f_hists.WriteTObject(h2d_rsp_gen)
 
     h2d_rsp_gen_norm = cu.norm_vertical_bins(h2d_rsp_gen)
     output_f_hists.WriteTObject(h2d_rsp_gen_norm)
 
-    # Draw rsp (pT^L1/pT^Gen) Vs L1 pT
-    tree_raw.Draw("rsp:pt>>h2d_rsp_l1(%d,%g,%g,%d,%g,%g)" % (nb_pt, pt_min, pt_max, nb_rsp, rsp_min, rsp_max), cutStr)
-    h2d_rsp_l1 = ROOT.gROOT.FindObject("h2d_rsp_l1")
+    # rsp (pT^L1/pT^Gen) Vs L1 pT
+    h2d_rsp_l1 = ROOT.TH2F("h2d_rsp_l1", "", nb_pt, pt_min, pt_max, nb_rsp, rsp_min, rsp_max)
+    fill_hist_from_cube(h2d_rsp_l1, cube, selected, "pt", "rsp")
     h2d_rsp_l1.SetTitle(";p_{T}^{L1} [GeV];response (p_{T}^{L1}/p_{T}^{Ref})")
     output_f_hists.WriteTObject(h2d_rsp_l1)
 
     h2d_rsp_l1_norm = cu.norm_vertical_bins(h2d_rsp_l1)
     output_f_hists.WriteTObject(h2d_rsp_l1_norm)
 
-    # Draw pT^Gen Vs pT^L1
-    tree_raw.Draw("pt:ptRef>>h2d_gen_l1(%d,%g,%g,%d,%g,%g)" % (nb_pt, pt_min, pt_max, nb_pt, pt_min, pt_max), cutStr)
-    h2d_gen_l1 = ROOT.gROOT.FindObject("h2d_gen_l1")
+    # pT^Gen Vs pT^L1
+    h2d_gen_l1 = ROOT.TH2F("h2d_gen_l1", "", nb_pt, pt_min, pt_max, nb_pt, pt_min, pt_max)
+    fill_hist_from_cube(h2d_gen_l1, cube, selected, "ptRef", "pt")
     h2d_gen_l1.SetTitle(";p_{T}^{Ref} [GeV];p_{T}^{L1} [GeV]")
     output_f_hists.WriteTObject(h2d_gen_l1)
 
 
-def plot_rsp_eta(inputfile, outputfile, eta_bins, pt_min, pt_max, pt_var, pu_min, pu_max):
+def plot_rsp_eta(cube, outputfile, eta_bins, pt_min, pt_max, pt_var, pu_min, pu_max):
     """Plot graph of response in bins of eta
 
     If the response hist for each bin exists already, then we use that.
@@ -113,9 +345,6 @@ def plot_rsp_eta(inputfile, outputfile, eta_bins, pt_min, pt_max, pt_var, pu_min
 
     gr_rsp_eta = ROOT.TGraphErrors()
 
-    # Input tree
-    tree_raw = inputfile.Get("valid")
-
     # Output folders
     output_f = outputfile.GetDirectory('eta_%g_%g' % (eta_bins[0], eta_bins[-1]))
     output_f_hists = None
@@ -125,25 +354,27 @@ def plot_rsp_eta(inputfile, outputfile, eta_bins, pt_min, pt_max, pt_var, pu_min
     else:
         output_f_hists = output_f.GetDirectory("Histograms")
 
+    # Cuts that are the same for all eta bins
+    abs_eta = get_cube_values(cube, "eta")
+    pt_values = get_cube_values(cube, pt_var)
+    common_selected = (pt_values < pt_max) & (pt_values > pt_min)
+    common_selected &= pass_pu_cut(cube, pu_min, pu_max)
+    # Avoid L1 saturated jets cut
+    common_selected &= get_cube_values(cube, "pt") < 1023.1
+
     # Go through eta bins, get response hist, fit with Gaussian and add to
     # the overall graph
     for i, eta in enumerate(eta_bins[:-1]):
         absetamin = eta
-        absetamax = eta_bins[i + 1] # Eta cut string
-
-        # Cut strings
-        eta_cutStr = "TMath::Abs(eta) < %f && TMath::Abs(eta) > %f" % (absetamax, absetamin)
-        pt_cutStr = "%s < %g && %s > %g" % (pt_var, pt_max, pt_var, pt_min)
-        pu_cutStr = "numPUVertices <= %f && numPUVertices >= %f" % (pu_max, pu_min)
-        avoidSaturation_cut = "pt < 1023.1"
-        cutStr = " && ".join([eta_cutStr, pt_cutStr, pu_cutStr, avoidSaturation_cut])
-        print cutStr
+        absetamax = eta_bins[i + 1]
+        print "%g < |eta| < %g, %g < %s < %g" % (absetamin, absetamax, pt_min, pt_var, pt_max)
+        selected = common_selected & (abs_eta < absetamax) & (abs_eta > absetamin)
 
         nb_rsp = 100
         rsp_min, rsp_max = 0, 5
         rsp_name = 'hrsp_eta_%g_%g_%s_%g_%g' % (absetamin, absetamax, pt_var, pt_min, pt_max)
-        tree_raw.Draw("rsp>>%s(%d,%g,%g)" % (rsp_name, nb_rsp, rsp_min, rsp_max), cutStr)
-        h_rsp = ROOT.gROOT.FindObject(rsp_name)
+        h_rsp = ROOT.TH1F(rsp_name, "", nb_rsp, rsp_min, rsp_max)
+        fill_hist_from_cube(h_rsp, cube, selected, "rsp")
         h_rsp.SetTitle(";response (p_{T}^{L1}/p_{T}^{Ref});")
 
         print 'Integral', h_rsp.Integral()
@@ -197,18 +428,15 @@ def check_gaus_fit(hist):
     return (abs(hist.GetFunction('gaus').GetParameter(1) - x_peak) / abs(x_peak)) < 0.1
 
 
-def plot_rsp_pt(inputfile, outputfile, absetamin, absetamax, pt_bins, pt_var, pt_max, pu_min, pu_max):
+def plot_rsp_pt(cube, outputfile, absetamin, absetamax, pt_bins, pt_var, pt_max, pu_min, pu_max):
     """Make a graph of response Vs pt for given eta bin
 
     pt_var allows the user to specify which pT to bin in & plot against.
-    Should be the name of a variable in the tree
+    Should be pt or ptRef
     pt_max is a cut on maxmimum value of pt (applied to l1 pt to
         avoid including saturation effects)
     """
 
-    # Input tree
-    tree_raw = inputfile.Get("valid")
-
     # Output folders
     output_f = outputfile.GetDirectory('eta_%g_%g' % (absetamin, absetamax))
     output_f_hists = None
@@ -220,13 +448,14 @@ def plot_rsp_pt(inputfile, outputfile, absetamin, absetamax, pt_bins, pt_var, pt
 
     gr_rsp_pt = ROOT.TGraphErrors()
 
-    # Cut strings
-    eta_cutStr = "TMath::Abs(eta) < %f && TMath::Abs(eta) > %f" % (absetamax, absetamin)
+    # Cuts
+    abs_eta = get_cube_values(cube, "eta")
+    pt = get_cube_values(cube, "pt")
+    selected = (abs_eta < absetamax) & (abs_eta > absetamin)
     # keep the pt < pt_max to safeguard against staurated L1 jets
-    pt_cutStr = "%s < %g && pt < %g" % (pt_var, pt_bins[-1], pt_max)
-    pu_cutStr = "numPUVertices <= %f && numPUVertices >= %f" % (pu_max, pu_min)
-    avoidSaturation_cut = "pt < 1023.1"
-    cutStr = " && ".join([eta_cutStr, pt_cutStr, pu_cutStr, avoidSaturation_cut])
+    selected &= (get_cube_values(cube, pt_var) < pt_bins[-1]) & (pt < pt_max)
+    selected &= pass_pu_cut(cube, pu_min, pu_max)
+    selected &= pt < 1023.1
 
     n_rsp_bins = 100
     rsp_min = 0
@@ -239,11 +468,15 @@ def plot_rsp_pt(inputfile, outputfile, absetamin, absetamax, pt_bins, pt_var, pt
                            "%g < |#eta| < %g;p_{T};response" % (absetamin, absetamax),
                            len(pt_bins) - 1, pt_array,
                            n_rsp_bins, rsp_min, rsp_max)
-    tree_raw.Draw("rsp:%s>>h2d_rsp_%s_%g_%g" % (pt_var, pt_var, absetamin, absetamax), cutStr)
+    fill_hist_from_cube(h2d_rsp_pt, cube, selected, pt_var, "rsp")
 
     output_f_hists.WriteTObject(h2d_rsp_pt)
 
-    # Now for each pt bin, do a projection on 1D hist of response and fit a Gaussian
+    # Fit a Gaussian to the response in every pt bin at once, within peak +- 1 RMS
+    pt_bin_ranges = [(i + 1, i + 1) for i in range(len(pt_bins) - 1)]
+    rsp_fits = cu.fit_gaussian_projections(h2d_rsp_pt, pt_bin_ranges, window_centre="peak")
+
+    # Now for each pt bin, do a projection on 1D hist of response and use the Gaussian fit
     print pt_bins
     for i, (pt_min, pt_max) in enumerate(pairwise(pt_bins)):
         h_rsp = h2d_rsp_pt.ProjectionY("rsp_%s_%g_%g" % (pt_var, pt_min, pt_max), i + 1, i + 1)
@@ -258,20 +491,17 @@ def plot_rsp_pt(inputfile, outputfile, absetamin, absetamax, pt_bins, pt_var, pt
         err = h_rsp.GetMeanError()
 
         peak = h_rsp.GetBinCenter(h_rsp.GetMaximumBin())
-        # if h_rsp.GetRMS() < 0.2:
-        #    fit_result = h_rsp.Fit("gaus", "QER", "", peak - h_rsp.GetRMS(), peak + h_rsp.GetRMS())
-        # else:
-        # fit_result = h_rsp.Fit("gaus", "QER", "", peak - 0.5*h_rsp.GetRMS(), peak + 0.5*h_rsp.GetRMS())
-        fit_result = h_rsp.Fit("gaus", "QER", "", peak - h_rsp.GetRMS(), peak + h_rsp.GetRMS())
-        # fit_result = h_rsp.Fit("gaus", "QER", "", mean - h_rsp.GetRMS(), mean + h_rsp.GetRMS())
+        fit_result = int(rsp_fits['status'][i])
+        if fit_result == 0:
+            cu.make_gaussian_fit_function(rsp_fits, i, hist=h_rsp)
 
         output_f_hists.WriteTObject(h_rsp)
 
         # TODO: better check against Gaussian fit - are peaks ~ similar?
-        # if int(fit_result) == 0 and check_gaus_fit(h_rsp):
-        if int(fit_result) == 0 and abs(h_rsp.GetFunction("gaus").GetParameter(1) - peak) / peak < 0.1:
-            mean = h_rsp.GetFunction("gaus").GetParameter(1)
-            err = h_rsp.GetFunction("gaus").GetParError(1)
+        # if fit_result == 0 and check_gaus_fit(h_rsp):
+        if fit_result == 0 and abs(rsp_fits['mean'][i] - peak) / peak < 0.1:
+            mean = rsp_fits['mean'][i]
+            err = rsp_fits['mean_err'][i]
             # Add the Gaussian to the total graph
             N = gr_rsp_pt.GetN()
             gr_rsp_pt.SetPoint(N, 0.5 * (pt_min + pt_max), mean)
@@ -313,6 +543,9 @@ def main(in_args=sys.argv[1:]):
                         help="Maximum number of PU vertices (refers to *actual* "
                              "number of PU vertices in the event, not the centre "
                              "of of the distribution)")
+    parser.add_argument("--no-cache", action='store_false', dest='cache',
+                        help="Don't use or make the cache of the response cube "
+                        "(in <input>.columns/), read the TTree directly instead.")
     args = parser.parse_args(args=in_args)
 
     # Open input & output files, check
@@ -337,31 +570,35 @@ def main(in_args=sys.argv[1:]):
     ptBins = binning.pt_bins
     ptBins = binning.pt_bins_stage2
 
+    # Bin all the pairs once - all plots are made from this
+    cube = get_response_cube(input_file, sorted(set(CUBE_ETA_BINS) | set(etaBins)),
+                             use_cache=args.cache)
+
     # Do plots for each eta bin
     if args.excl:
         for i, eta in enumerate(etaBins[:-1]):
             eta_min = eta
             eta_max = etaBins[i + 1]
 
-            plot_checks(input_file, output_file, eta_min, eta_max, args.maxPt, args.PUmin, args.PUmax)
+            plot_checks(cube, output_file, eta_min, eta_max, args.maxPt, args.PUmin, args.PUmax)
             # Do a response vs pt graph
-            plot_rsp_pt(input_file, output_file, eta_min, eta_max, ptBins, "pt", args.maxPt, args.PUmin, args.PUmax)
-            plot_rsp_pt(input_file, output_file, eta_min, eta_max, ptBins, "ptRef", args.maxPt, args.PUmin, args.PUmax)
+            plot_rsp_pt(cube, output_file, eta_min, eta_max, ptBins, "pt", args.maxPt, args.PUmin, args.PUmax)
+            plot_rsp_pt(cube, output_file, eta_min, eta_max, ptBins, "ptRef", args.maxPt, args.PUmin, args.PUmax)
 
     # Do an inclusive plot for all eta bins
     if args.incl and len(etaBins) > 2:
-        plot_checks(input_file, output_file, etaBins[0], etaBins[-1], args.maxPt, args.PUmin, args.PUmax)
+        plot_checks(cube, output_file, etaBins[0], etaBins[-1], args.maxPt, args.PUmin, args.PUmax)
         # Do a response vs pt graph
         # ptBins_wide = list(np.arange(10, 250, 8))
-        plot_rsp_pt(input_file, output_file, etaBins[0], etaBins[-1], ptBins, "pt", args.maxPt, args.PUmin, args.PUmax)
-        plot_rsp_pt(input_file, output_file, etaBins[0], etaBins[-1], ptBins, "ptRef", args.maxPt, args.PUmin, args.PUmax)
+        plot_rsp_pt(cube, output_file, etaBins[0], etaBins[-1], ptBins, "pt", args.maxPt, args.PUmin, args.PUmax)
+        plot_rsp_pt(cube, output_file, etaBins[0], etaBins[-1], ptBins, "ptRef", args.maxPt, args.PUmin, args.PUmax)
         # Do a response vs eta graph, inclusive over all pt
-        plot_rsp_eta(input_file, output_file, etaBins, 0, 1000, 'pt', args.PUmin, args.PUmax)
+        plot_rsp_eta(cube, output_file, etaBins, 0, 1000, 'pt', args.PUmin, args.PUmax)
 
         # Sub-binned by pt
         for pt_min, pt_max in binning.check_pt_bins:
-            plot_rsp_eta(input_file, output_file, etaBins, pt_min, pt_max, 'pt', args.PUmin, args.PUmax)
-            plot_rsp_eta(input_file, output_file, etaBins, pt_min, pt_max, 'ptRef', args.PUmin, args.PUmax)
+            plot_rsp_eta(cube, output_file, etaBins, pt_min, pt_max, 'pt', args.PUmin, args.PUmax)
+            plot_rsp_eta(cube, output_file, etaBins, pt_min, pt_max, 'ptRef', args.PUmin, args.PUmax)
 
     input_file.Close()
     output_file.Close()
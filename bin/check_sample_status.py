@@ -12,12 +12,15 @@ If it is fully present at atleast 1 T2, then it will print in green with a 'v'.
 For more detailed info about fractions for each T2 site, use the verbose switch,
 ./check_sample_status.py -v
 
+DAS results are cached on disk (see python/das_cache.py). To run offline from
+a DAS snapshot file instead, set L1JEC_DAS_OFFLINE=<snapshot JSON>.
+
 It ain't pretty, but it works.
 """
 
 
 import sys
-from subprocess import check_output
+import L1Trigger.L1JetEnergyCorrections.das_cache as das_cache
 
 
 SAMPLES = [
@@ -70,14 +73,11 @@ def check_dataset_presence(dataset, verbose=False):
     quantities = ['name', 'dataset_fraction', 'replica_fraction', 'block_fraction', 'block_completion']
 
     # Get site name and fractions for each site
-    # yes, you prob shouldn't use shell=True, but CBA to figure out how to split the string for das_client
-    grep_str = ' '.join(['site.%s' % q for q in quantities])
-    out = check_output('das_client --query="site dataset=%s | grep %s"' % (dataset, grep_str), shell=True)
+    results = das_cache.get_sites(dataset, quantities)
 
     site_dicts = []  # hold info about each site
 
     # Process the important lines, store in a dict for each site
-    results = [x for x in out.split('\n') if 'Showing' not in x and x != '']
     for line in results:
         # Don't care if it's at a T1
         if line.startswith('T1'):
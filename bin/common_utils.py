@@ -3,6 +3,9 @@
 
 import ROOT
 import os
+import re
+import glob
+import hashlib
 from subprocess import call
 from sys import platform as _platform
 import numpy as np
@@ -57,9 +60,17 @@ def check_dir_exists(filepath):
 
 
 def check_dir_exists_create(filepath):
-    """Check if directory exists. If not, create it."""
+    """Check if directory exists. If not, create it.
+
+    Safe to call from several processes at once: if another process makes
+    the directory between the check and makedirs, that's fine.
+    """
     if not check_dir_exists(filepath):
-        os.makedirs(cleanup_filepath(filepath))
+        try:
+            os.makedirs(cleanup_filepath(filepath))
+        except OSError:
+            if not check_dir_exists(filepath):
+                raise
 
 
 #
@@ -101,6 +112,43 @@ def get_from_file(tfile, obj_name, info=False):
         return tfile.Get(obj_name)
 
 
+def get_directory_contents(tdir, path=""):
+    """Read all objects in a TDirectory (recursively) into memory.
+
+    Histograms are detached from the directory, so they survive it being
+    closed, and can be e.g. pickled & sent to another process.
+
+    Returns a list of (directory path, object name, object). Directories
+    themselves are included as (directory path, None, None), so empty ones
+    aren't lost.
+    """
+    contents = []
+    for key in tdir.GetListOfKeys():
+        obj = key.ReadObj()
+        if obj.InheritsFrom("TDirectory"):
+            sub_path = "/".join([p for p in [path, key.GetName()] if p])
+            contents.append((sub_path, None, None))
+            contents.extend(get_directory_contents(obj, sub_path))
+        else:
+            if hasattr(obj, "SetDirectory"):
+                obj.SetDirectory(0)
+            contents.append((path, key.GetName(), obj))
+    return contents
+
+
+def write_directory_contents(tdir, contents, option="Overwrite"):
+    """Write objects from get_directory_contents() into a TDirectory,
+    creating any sub-directories as necessary."""
+    for path, name, obj in contents:
+        target = tdir
+        for part in [p for p in path.split("/") if p]:
+            if not target.GetDirectory(part):
+                target.mkdir(part)
+            target = target.GetDirectory(part)
+        if obj is not None:
+            target.WriteTObject(obj, name, option)
+
+
 def check_exp(n):
     """
     Checks if number has stupidly larger exponent
@@ -131,7 +179,637 @@ def get_exey(graph):
     return xarr, yarr
 
 
-def norm_vertical_bins(hist, rescale_peaks=False):
+#
+# Columnar fns: read a TTree once into numpy arrays, then fill hists from them
+#
+def get_tree_columns(tree, branches, cut=""):
+    """Read branches (or any TTree::Draw expressions) into numpy arrays.
+
+    Uses TTree::Draw with goff, which can only hold 4 expressions at once,
+    so branches are read in batches of 4. Each batch is one scan of the tree.
+
+    Parameters
+    ----------
+    tree : ROOT.TTree
+        Tree to read from
+    branches : list[str]
+        Names of branches/expressions to read
+    cut : str, optional
+        Selection to apply
+
+    Returns
+    -------
+    dict
+        branch name : np.array of values (as doubles)
+    """
+    tree.SetEstimate(tree.GetEntries() + 1)
+    columns = {}
+    for i in range(0, len(branches), 4):
+        batch = branches[i:i + 4]
+        n_rows = tree.Draw(":".join(batch), cut, "goff")
+        getters = [tree.GetV1, tree.GetV2, tree.GetV3, tree.GetV4]
+        for name, getter in zip(batch, getters):
+            if n_rows <= 0:
+                columns[name] = np.zeros(0)
+            else:
+                # copy, since ROOT re-uses the buffer on the next Draw
+                columns[name] = np.array(np.ndarray(n_rows, 'd', getter()))
+    return columns
+
+
+def get_column_cache_dir(filename):
+    """Default directory for the column cache of a ROOT file:
+    a directory next to it, e.g. pairs.root -> pairs.root.columns/"""
+    return cleanup_filepath(filename) + ".columns"
+
+
+def get_column_cache_filename(cache_dir, filename, tree_name, branch, cut=""):
+    """Filename of the cached column for a given file, tree, branch & cut.
+
+    The name is <tree>_<branch>_<column hash>_<file hash>.npy, where the
+    column hash is of the tree name, branch & cut, and the file hash is of the
+    absolute file path, its size and modification time. So any change to the
+    input file means a new cache file, and older ones can be found by
+    matching everything up to the file hash.
+    """
+    filename = cleanup_filepath(filename)
+    stat = os.stat(filename)
+    column_key = "\n".join([tree_name, branch, cut])
+    file_key = "\n".join([filename, str(stat.st_size), repr(stat.st_mtime)])
+    readable = re.sub(r"[^\w]+", "_", branch).strip("_")[:40]
+    return os.path.join(cache_dir, "%s_%s_%s_%s.npy" % (tree_name, readable,
+                                                        hashlib.sha1(column_key).hexdigest()[:8],
+                                                        hashlib.sha1(file_key).hexdigest()[:16]))
+
+
+def get_file_fingerprint(filename, chunk_size=1024 * 1024):
+    """Cheap content fingerprint of a file, to tell if it has changed.
+
+    Hashes the file size, and the first & last chunk_size bytes, rather than
+    the whole file. For ROOT files this covers the header (with the file's
+    UUID) and the keys list & streamer info written at the end, so any
+    rewrite of the file changes the fingerprint. Unlike the modification time,
+    it doesn't change if the file is just copied.
+    """
+    size = os.path.getsize(filename)
+    sha = hashlib.sha1(str(size))
+    with open(filename, 'rb') as f:
+        sha.update(f.read(chunk_size))
+        if size > chunk_size:
+            f.seek(max(chunk_size, size - chunk_size))
+            sha.update(f.read(chunk_size))
+    return sha.hexdigest()
+
+
+def get_tree_columns_cached(tree, branches, cut="", cache_dir=None):
+    """Same as get_tree_columns(), but caches each column as an uncompressed
+    .npy file, so subsequent calls don't have to decompress the TTree again.
+
+    Cached columns are memory-mapped (read-only), so only the parts actually
+    used are read from disk. Only the columns not already in the cache are
+    read from the tree.
+
+    The cache is keyed by file path, size, modification time, tree name,
+    branch & cut, so it is automatically remade if the input file changes.
+    Stale cache files for the same tree/branch are removed.
+
+    Falls back to get_tree_columns() if the tree isn't in a local file
+    (e.g. a TChain, or a file over xrootd), or the cache directory
+    can't be written to.
+
+    Parameters
+    ----------
+    tree : ROOT.TTree
+        Tree to read from
+    branches : list[str]
+        Names of branches/expressions to read
+    cut : str, optional
+        Selection to apply
+    cache_dir : str, optional
+        Directory to store the cache in. Defaults to get_column_cache_dir()
+
+    Returns
+    -------
+    dict
+        branch name : np.array of values (as doubles)
+    """
+    tfile = tree.GetCurrentFile()
+    filename = tfile.GetName() if tfile else ""
+    if isinstance(tree, ROOT.TChain) or not check_file_exists(filename):
+        print "Can't cache columns for", filename, "- reading directly"
+        return get_tree_columns(tree, branches, cut)
+
+    cache_dir = cache_dir or get_column_cache_dir(filename)
+    tree_name = tree.GetName()
+    cache_files = {b: get_column_cache_filename(cache_dir, filename, tree_name, b, cut)
+                   for b in branches}
+
+    columns = {}
+    for branch, cache_file in cache_files.iteritems():
+        if os.path.isfile(cache_file):
+            columns[branch] = np.load(cache_file, mmap_mode='r')
+
+    missing = [b for b in branches if b not in columns]
+    if not missing:
+        print "Loaded columns from cache", cache_dir
+        return columns
+
+    columns.update(get_tree_columns(tree, missing, cut))
+
+    try:
+        check_dir_exists_create(cache_dir)
+        for branch in missing:
+            cache_file = cache_files[branch]
+            # remove caches from older versions of the input file
+            prefix = cache_file[:cache_file.rfind("_")]
+            for old_file in glob.glob(prefix + "_*.npy"):
+                if old_file != cache_file and re.match(r"_[0-9a-f]{16}\.npy$",
+                                                       old_file[len(prefix):]):
+                    os.remove(old_file)
+            # write to temp file & rename, so another process never sees half a file
+            tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+            with open(tmp_file, "wb") as f:
+                np.save(f, columns[branch])
+            os.rename(tmp_file, cache_file)
+        print "Cached columns", missing, "in", cache_dir
+    except (IOError, OSError) as e:
+        print "Couldn't write column cache in", cache_dir, ":", e
+
+    return columns
+
+
+def get_tree_selection_cached(tree, cut="", cache_dir=None):
+    """Evaluate a TTree::Draw selection for every entry, as a boolean mask.
+
+    The selection is read & cached as a column in its own right with
+    get_tree_columns_cached(), so the columns it is applied to only need
+    caching once, whatever cuts are applied to them later. Only meant for
+    trees of scalar branches, i.e. one row per entry.
+
+    Parameters
+    ----------
+    tree : ROOT.TTree
+        Tree to read from
+    cut : str, optional
+        Selection. An empty (or "1") cut selects every entry.
+    cache_dir : str, optional
+        Directory to store the cache in. Defaults to get_column_cache_dir()
+
+    Returns
+    -------
+    np.array
+        Boolean mask, True for entries passing the selection
+    """
+    if cut.strip() in ["", "1"]:
+        return np.ones(int(tree.GetEntries()), dtype=bool)
+    return get_tree_columns_cached(tree, [cut], cache_dir=cache_dir)[cut] != 0
+
+
+def find_bins(values, nbins, xmin, xmax):
+    """Vectorised version of TAxis::FindBin for fixed-width binning.
+
+    nbins, xmin & xmax can either be numbers, or arrays with the binning to
+    use for each value (e.g. when values are headed for different hists).
+
+    Returns an array of bin indices, where 0 is the underflow and nbins + 1
+    is the overflow (as in ROOT).
+    """
+    values = np.asarray(values, dtype=float)
+    nbins, xmin, xmax = [np.broadcast_to(a, values.shape) for a in (nbins, xmin, xmax)]
+    in_range = (values >= xmin) & (values < xmax)
+    bins = np.where(values < xmin, 0, nbins + 1)
+    nbins, xmin, xmax = nbins[in_range], xmin[in_range], xmax[in_range]
+    bins[in_range] = 1 + (nbins * (values[in_range] - xmin) / (xmax - xmin)).astype(int)
+    # guard against rounding pushing the last bin into the overflow
+    bins[in_range] = np.minimum(bins[in_range], nbins)
+    return bins
+
+
+def find_axis_bins(values, axis):
+    """Vectorised version of TAxis::FindBin, for fixed or variable-width binning.
+
+    Returns an array of bin indices, where 0 is the underflow and
+    axis.GetNbins() + 1 is the overflow (as in ROOT).
+    """
+    nbins = axis.GetNbins()
+    if axis.GetXbins().GetSize() == 0:
+        return find_bins(values, nbins, axis.GetXmin(), axis.GetXmax())
+    edges = np.array([axis.GetBinLowEdge(i) for i in range(1, nbins + 2)])
+    return np.searchsorted(edges, np.asarray(values, dtype=float), side='right')
+
+
+def calc_hist_stats(x, y=None):
+    """Calculate the stats array that TH1/TH2::Fill would accumulate,
+    for unit weights, in the format expected by TH1::PutStats.
+
+    Only pass values that fall inside the histogram range,
+    since ROOT ignores under/overflows when calculating statistics.
+    """
+    stats = [len(x), len(x), np.sum(x), np.sum(x * x)]
+    if y is not None:
+        stats.extend([np.sum(y), np.sum(y * y), np.sum(x * y)])
+    return np.array(stats, dtype=float)
+
+
+def set_hist_from_counts(hist, counts, stats, entries):
+    """Set the contents, errors, stats & number of entries of a histogram.
+
+    Parameters
+    ----------
+    hist : ROOT.TH1
+        Histogram to set. Any contents are overwritten.
+    counts : np.array
+        Contents of every cell, including under/overflows, in ROOT global bin order.
+    stats : np.array
+        Statistics array as from calc_hist_stats()
+    entries : int
+        Number of entries
+    """
+    counts = np.ascontiguousarray(counts, dtype=float)
+    hist.SetContent(counts)
+    if hist.GetSumw2N() > 0:
+        # unit weights, so sum of weights^2 = counts
+        hist.GetSumw2().Set(len(counts), counts)
+    hist.PutStats(np.ascontiguousarray(stats, dtype=float))
+    hist.SetEntries(entries)
+
+
+def fill_hist_arrays(hist, x, y=None):
+    """Fill a TH1 or TH2 from numpy arrays in one go.
+
+    Equivalent to calling hist.Fill() for each entry with unit weight,
+    but bins are calculated in one vectorised pass and the contents are
+    accumulated with np.bincount. Any previous contents are overwritten.
+
+    Parameters
+    ----------
+    hist : ROOT.TH1 or ROOT.TH2
+        Histogram to fill
+    x : np.array
+        x values
+    y : np.array, optional
+        y values, for 2D hists
+    """
+    x = np.asarray(x, dtype=float)
+    xax = hist.GetXaxis()
+    nx = xax.GetNbins()
+    xbins = find_axis_bins(x, xax)
+    in_range = (xbins > 0) & (xbins <= nx)
+    n_cells = nx + 2
+    global_bins = xbins
+
+    if y is not None:
+        y = np.asarray(y, dtype=float)
+        yax = hist.GetYaxis()
+        ny = yax.GetNbins()
+        ybins = find_axis_bins(y, yax)
+        in_range &= (ybins > 0) & (ybins <= ny)
+        n_cells *= ny + 2
+        global_bins = xbins + (nx + 2) * ybins
+
+    counts = np.bincount(global_bins, minlength=n_cells)
+    stats = calc_hist_stats(x[in_range], None if y is None else y[in_range])
+    set_hist_from_counts(hist, counts, stats, len(x))
+    return hist
+
+
+def make_auto_range_hist(name, title, nbins, values):
+    """Make a TH1F with nbins, whose range is automatically calculated from
+    the values, in the same way as TTree::Draw("x>>h(nbins)") does,
+    then fill it with values.
+    """
+    vmin = np.min(values) if len(values) else 0.
+    vmax = np.max(values) if len(values) else 1.
+    if vmin >= vmax:
+        vmin, vmax = vmin - 1., vmax + 1.
+    hist = ROOT.TH1F(name, title, nbins, vmin, vmax)
+    ROOT.THLimitsFinder.GetLimitsFinder().FindGoodLimits(hist, vmin, vmax)
+    return fill_hist_arrays(hist, values)
+
+
+#
+# Batched fitting fns: fit many histograms (as rows of an array) at once
+#
+def get_hist_contents(hist):
+    """Return bin contents of a TH1 as an np.array, excluding under/overflows."""
+    nbins = hist.GetNbinsX()
+    if hist.InheritsFrom("TH1F"):
+        return np.array(np.ndarray(nbins + 2, 'f', hist.GetArray())[1:-1], dtype=float)
+    if hist.InheritsFrom("TH1D"):
+        return np.array(np.ndarray(nbins + 2, 'd', hist.GetArray())[1:-1], dtype=float)
+    return np.array([hist.GetBinContent(i) for i in range(1, nbins + 1)])
+
+
+def get_hist_edges(hist):
+    """Return bin edges of a TH1 x axis as an np.array."""
+    xax = hist.GetXaxis()
+    return np.array([xax.GetBinLowEdge(i) for i in range(1, xax.GetNbins() + 2)])
+
+
+def _gaussian_design(centres, offset):
+    """Gaussian-fit design arrays, with x measured from offset for numerical stability."""
+    u = centres - offset[:, np.newaxis]
+    return u, np.stack([np.ones_like(u), u, u * u], axis=-1)
+
+
+def _check_invertible(matrices, ok):
+    """Return ok mask, updated to exclude (near-)singular matrices,
+    which would make np.linalg.solve/inv fail for the whole batch."""
+    diag = np.abs(np.diagonal(matrices, axis1=1, axis2=2)).prod(axis=1)
+    det = np.abs(np.linalg.det(matrices))
+    return ok & np.isfinite(det) & (det > 1E-12 * diag)
+
+
+def _weighted_gram(weights, design):
+    """Return sum over bins of weight * outer(design, design), for each slice"""
+    return np.einsum('ijk,ijl->ikl', weights[..., np.newaxis] * design, design)
+
+
+def _solve_batch(matrices, vectors, ok):
+    """Solve matrices[i] . x = vectors[i] for all i where ok[i] (and matrix not singular).
+
+    Returns solutions (NaN where not solved), and the updated ok mask.
+    """
+    ok = _check_invertible(matrices, ok)
+    result = np.full(vectors.shape, np.nan)
+    if np.any(ok):
+        result[ok] = np.linalg.solve(matrices[ok], vectors[ok][..., np.newaxis])[..., 0]
+    return result, ok
+
+
+def fit_gaussian_slices(counts, bin_edges, window_centre="mean", window_width=1.,
+                        min_entries=3, max_iterations=20):
+    """Fit a Gaussian to each row of a 2D array of bin contents, all at once.
+
+    This is the batched equivalent of doing, for each row as a TH1:
+
+        h.Fit("gaus", "QER", "", c - w * h.GetRMS(), c + w * h.GetRMS())
+
+    where c is the mean or peak bin centre of the row, and w is window_width.
+    As in ROOT, it is a chi2 fit using only non-empty bins whose centre is in
+    the fit window, with error sqrt(N) on each bin.
+
+    Starting values come from a weighted linear least squares fit of a parabola
+    to log(counts). This is then refined with Gauss-Newton iterations on the
+    full chi2, done for all rows simultaneously. Each iteration is only
+    accepted for a row if it decreases the chi2.
+
+    Parameters
+    ----------
+    counts : np.array
+        2D array of bin contents, shape (number of slices, number of bins),
+        e.g. from a TH2 with one row per pt bin. Should NOT include under/overflows.
+    bin_edges : np.array
+        Bin edges, length = number of bins + 1
+    window_centre : str {"mean", "peak"}
+        Centre the fit window on the mean of each row, or the centre of the maximum bin.
+    window_width : float
+        Half-width of the fit window, in units of the RMS of each row.
+    min_entries : int
+        Rows with fewer entries are not fitted.
+    max_iterations : int
+        Maximum number of Gauss-Newton iterations
+
+    Returns
+    -------
+    dict
+        Each value is an np.array with one entry per row:
+        - constant, mean, sigma: fitted parameters
+        - constant_err, mean_err, sigma_err: errors on them
+        - chi2, ndf: fit chi2 & number of degrees of freedom
+        - status: 0 if fit was good, otherwise:
+            1 if too few entries or non-empty bins in the fit window,
+            2 if it doesn't look like a peak (or can't be solved),
+            3 if the fit didn't converge or gave a silly result
+        - raw_mean, raw_mean_err, raw_rms: from the bin contents
+        - fit_min, fit_max: fit window
+    """
+    counts = np.atleast_2d(np.asarray(counts, dtype=float))
+    bin_edges = np.asarray(bin_edges, dtype=float)
+    # NaNs in empty/failed slices are expected, and handled via status
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        return _fit_gaussian_slices(counts, bin_edges, window_centre, window_width,
+                                    min_entries, max_iterations)
+
+
+def _fit_gaussian_slices(counts, bin_edges, window_centre, window_width, min_entries,
+                         max_iterations):
+    """Does the work for fit_gaussian_slices()"""
+    centres = 0.5 * (bin_edges[:-1] + bin_edges[1:])
+    n_slices = counts.shape[0]
+
+    entries = counts.sum(axis=1)
+    raw_mean = (counts * centres).sum(axis=1) / entries
+    raw_rms = np.sqrt(np.maximum((counts * centres**2).sum(axis=1) / entries - raw_mean**2, 0))
+    raw_mean_err = raw_rms / np.sqrt(entries)
+
+    if window_centre == "mean":
+        centre = raw_mean
+    elif window_centre == "peak":
+        centre = centres[np.argmax(counts, axis=1)]
+    else:
+        raise RuntimeError('window_centre must be "mean" or "peak"')
+    fit_min = centre - window_width * raw_rms
+    fit_max = centre + window_width * raw_rms
+
+    above_min = centres[np.newaxis, :] >= fit_min[:, np.newaxis]
+    below_max = centres[np.newaxis, :] <= fit_max[:, np.newaxis]
+    in_window = above_min & below_max
+    use = in_window & (counts > 0)
+    n_points = use.sum(axis=1)
+
+    # Only keep the columns spanning the fit window of each slice,
+    # so the fitting doesn't waste time on all the bins outside it
+    n_bins = len(centres)
+    first = np.argmax(use, axis=1)
+    last = n_bins - 1 - np.argmax(use[:, ::-1], axis=1)
+    n_cols = max(int(np.max(np.where(n_points > 0, last - first + 1, 1))), 1) if n_slices else 1
+    cols = first[:, np.newaxis] + np.arange(n_cols)[np.newaxis, :]
+    in_range = cols < n_bins
+    cols = np.minimum(cols, n_bins - 1)
+    rows = np.arange(n_slices)[:, np.newaxis]
+    counts = counts[rows, cols]
+    use = use[rows, cols] & in_range
+    centres = centres[cols]
+
+    status = np.full(n_slices, 1, dtype=int)
+    ok = (entries >= min_entries) & (n_points >= 3)
+    status[ok] = 2
+    offset = np.where(ok, centre, 0)
+    u, design = _gaussian_design(centres, offset)
+
+    # Starting values: log(N) = a + b.u + c.u^2, each bin weighted by N (= 1 / var(log N))
+    weights = np.where(use, counts, 0)
+    log_counts = np.log(np.where(use, counts, 1))
+    matrices = _weighted_gram(weights, design)
+    vectors = np.einsum('ij,ijk->ik', weights * log_counts, design)
+    coeffs, ok = _solve_batch(matrices, vectors, ok)
+    ok &= coeffs[:, 2] < 0
+    sigma = np.sqrt(-0.5 / coeffs[:, 2])
+    mu = -coeffs[:, 1] / (2 * coeffs[:, 2])
+    amp = np.exp(coeffs[:, 0] - coeffs[:, 1]**2 / (4 * coeffs[:, 2]))
+    ok &= np.isfinite(sigma) & np.isfinite(mu) & np.isfinite(amp)
+    params = np.where(ok[:, np.newaxis], np.stack([amp, mu, sigma], axis=-1), np.nan)
+    status[ok] = 0
+
+    # chi2 weights = 1 / N for the used bins
+    chi2_weights = np.where(use, 1. / np.where(use, counts, 1), 0)
+
+    def calc_model(params, u):
+        """Return model values, and its derivatives wrt the params"""
+        amp, mu, sigma = [params[:, i][:, np.newaxis] for i in range(3)]
+        diff = u - mu
+        gaus = np.exp(-0.5 * (diff / sigma)**2)
+        model = amp * gaus
+        jac = np.stack([gaus, model * diff / sigma**2, model * diff**2 / sigma**3], axis=-1)
+        return model, jac
+
+    def calc_chi2(model, rows):
+        return (chi2_weights[rows] * (counts[rows] - model)**2).sum(axis=1)
+
+    model, jac = calc_model(params, u)
+    chi2 = calc_chi2(model, slice(None))
+    active = ok.copy()
+    for _ in range(max_iterations):
+        # only iterate the slices that haven't converged yet
+        rows = np.flatnonzero(active)
+        if len(rows) == 0:
+            break
+        matrices = _weighted_gram(chi2_weights[rows], jac[rows])
+        vectors = np.einsum('ij,ijk->ik', chi2_weights[rows] * (counts[rows] - model[rows]),
+                            jac[rows])
+        step, solved = _solve_batch(matrices, vectors, np.ones(len(rows), dtype=bool))
+        new_params = np.where(solved[:, np.newaxis], params[rows] + step, params[rows])
+        new_model, new_jac = calc_model(new_params, u[rows])
+        new_chi2 = calc_chi2(new_model, rows)
+        improved = np.isfinite(new_chi2) & (new_chi2 <= chi2[rows])
+        better = solved & improved & (new_params[:, 2] > 0)
+        converged = ~better | (chi2[rows] - new_chi2 <= 1E-7 * np.maximum(chi2[rows], 1))
+        params[rows[better]] = new_params[better]
+        model[rows[better]] = new_model[better]
+        jac[rows[better]] = new_jac[better]
+        chi2[rows[better]] = new_chi2[better]
+        active[rows[converged]] = False
+
+    # Errors from the covariance matrix = inverse of (J^T W J)
+    matrices = _weighted_gram(chi2_weights, jac)
+    errors = np.full(params.shape, np.nan)
+    solvable = _check_invertible(matrices, ok)
+    if np.any(solvable):
+        cov = np.linalg.inv(matrices[solvable])
+        errors[solvable] = np.sqrt(np.abs(np.diagonal(cov, axis1=1, axis2=2)))
+    ok &= solvable
+    ok &= np.isfinite(params).all(axis=1) & (params[:, 2] > 0)
+    # mean should be somewhere in the histogram
+    ok &= (params[:, 1] + offset >= bin_edges[0]) & (params[:, 1] + offset <= bin_edges[-1])
+    status[(status == 0) & ~ok] = 3
+
+    return dict(constant=params[:, 0], mean=params[:, 1] + offset, sigma=params[:, 2],
+                constant_err=errors[:, 0], mean_err=errors[:, 1], sigma_err=errors[:, 2],
+                chi2=np.where(status == 0, chi2, np.nan), ndf=n_points - 3, status=status,
+                raw_mean=raw_mean, raw_mean_err=raw_mean_err, raw_rms=raw_rms,
+                fit_min=fit_min, fit_max=fit_max)
+
+
+def make_gaussian_fit_function(fits, ind, name="gaus", hist=None):
+    """Make a TF1 with the result of fit_gaussian_slices() for one slice,
+    as if the slice histogram had been fitted with h.Fit("gaus").
+
+    If hist is given, the TF1 is added to its list of functions, so it gets
+    drawn & saved with the hist as usual. The hist then owns the TF1, so
+    Python won't also delete it.
+    """
+    func = ROOT.TF1(name, "gaus", fits['fit_min'][ind], fits['fit_max'][ind])
+    for i, par in enumerate(['constant', 'mean', 'sigma']):
+        func.SetParameter(i, fits[par][ind])
+        func.SetParError(i, fits[par + '_err'][ind])
+    func.SetChisquare(fits['chi2'][ind])
+    func.SetNDF(int(fits['ndf'][ind]))
+    if hist is not None:
+        ROOT.SetOwnership(func, False)
+        hist.GetListOfFunctions().Add(func)
+    return func
+
+
+def fit_gaussian_projections(hist, x_bin_ranges, **kwargs):
+    """Fit a Gaussian to the y projection of a TH2 for each range of x bins, all at once.
+
+    Parameters
+    ----------
+    hist : ROOT.TH2
+        2D histogram to project
+    x_bin_ranges : list[(int, int)]
+        First & last x bin (inclusive) of each projection, as for TH2::ProjectionY
+    **kwargs
+        Passed to fit_gaussian_slices()
+
+    Returns
+    -------
+    dict
+        From fit_gaussian_slices(), with one entry per projection.
+    """
+    contents, _ = get_hist2d_arrays(hist)
+    counts = np.array([contents[first:last + 1, 1:-1].sum(axis=0)
+                       for first, last in x_bin_ranges])
+    yax = hist.GetYaxis()
+    edges = np.array([yax.GetBinLowEdge(i) for i in range(1, yax.GetNbins() + 2)])
+    return fit_gaussian_slices(counts, edges, **kwargs)
+
+
+def get_hist2d_arrays(hist):
+    """Get the bin contents & sum of weights^2 of a TH2 as 2D np.arrays, in one go.
+
+    Parameters
+    ----------
+    hist : ROOT.TH2
+        2D histogram to read
+
+    Returns
+    -------
+    np.array, np.array
+        Contents & sum of weights^2 (i.e. errors^2), indexed [x bin, y bin],
+        including under/overflows (so [1, 1] is the first bin proper).
+        If the hist has no Sumw2, the contents are used, as TH1::Sumw2() does.
+    """
+    nx, ny = hist.GetNbinsX() + 2, hist.GetNbinsY() + 2
+    ncells = nx * ny
+    if hist.InheritsFrom("TH2F") or hist.InheritsFrom("TH2D"):
+        fmt = 'f' if hist.InheritsFrom("TH2F") else 'd'
+        contents = np.array(np.ndarray(ncells, fmt, hist.GetArray()), dtype=float)
+    else:
+        contents = np.array([hist.GetBinContent(b) for b in range(ncells)], dtype=float)
+    if hist.GetSumw2N() > 0:
+        sumw2 = np.array(np.ndarray(ncells, 'd', hist.GetSumw2().GetArray()))
+    else:
+        sumw2 = contents.copy()
+    return contents.reshape(ny, nx).T, sumw2.reshape(ny, nx).T
+
+
+def set_hist2d_arrays(hist, contents, sumw2=None):
+    """Set the bin contents (& optionally sum of weights^2) of a TH2 from
+    2D np.arrays as from get_hist2d_arrays(), in one go.
+
+    As with SetBinContent(), the stats are recalculated from the new contents.
+    The number of entries is not changed.
+    """
+    entries = hist.GetEntries()
+    hist.SetContent(np.ascontiguousarray(contents.T.ravel(), dtype=float))
+    if sumw2 is not None:
+        if hist.GetSumw2N() == 0:
+            hist.Sumw2()
+        sumw2 = np.ascontiguousarray(sumw2.T.ravel(), dtype=float)
+        hist.GetSumw2().Set(len(sumw2), sumw2)
+    hist.SetEntries(entries)
+
+
+def _sum_adjacent_columns(contents):
+    """Sum of contents[i, 1:-1] + contents[i+1, 1:-1] for each x bin i,
+    added up in the same order as TH2::Integral(i, i+1, 1, nbins_y)."""
+    pairs = np.stack([contents[1:-1, 1:-1], contents[2:, 1:-1]], axis=-1)
+    return np.cumsum(pairs.reshape(len(pairs), -1), axis=1)[:, -1]
+
+
+def norm_vertical_bins(hist, rescale_peaks=False, compat=True):
     """Return a copy of the 2D hist, with x bin contents normalised to 1.
     This way you can clearly see the distribution per x bin,
     rather than underlying distribution across x bins.
@@ -144,42 +822,108 @@ def norm_vertical_bins(hist, rescale_peaks=False):
         Scales all bin contents such that all x bins have the same peak value.
         This way the colour system works across all bins, but absolute values
         are useless.
+    compat : bool, optional
+        Reproduce the results of the original bin-by-bin version exactly:
+        each x bin is normalised by the integral over it *and the next x bin*
+        (Integral(i, i+1, ...)), and rescale_peaks skips the top y bin, and
+        scales the un-normalised bin errors. If False, each x bin is
+        normalised by its own integral, and rescaling treats all bins &
+        errors consistently.
     """
 
     hnew = hist.Clone(hist.GetName() + "_normX")
-    nbins_y = hnew.GetNbinsY()
-    maximums = []
-    for i in range(1, hnew.GetNbinsX() + 1, 1):
-        y_int = hnew.Integral(i, i + 1, 1, nbins_y)
-        peak = 0
-        if y_int > 0:
-            scale_factor = 1. / y_int
-            for j in range(1, nbins_y + 1, 1):
-                if hnew.GetBinContent(i, j) > 0:
-                    new_bin_value = hist.GetBinContent(i, j) * scale_factor
-                    if new_bin_value > peak:
-                        peak = new_bin_value
-                    hnew.SetBinContent(i, j, new_bin_value)
-                    hnew.SetBinError(i, j, hist.GetBinError(i, j) * scale_factor)
-        maximums.append(peak)
+    contents, sumw2 = get_hist2d_arrays(hist)
+    # only touch the bins proper, not under/overflows
+    new_contents, new_sumw2 = contents.copy(), sumw2.copy()
+    inner_contents = new_contents[1:-1, 1:-1]
+    inner_sumw2 = new_sumw2[1:-1, 1:-1]
+    orig_errors = np.sqrt(np.abs(sumw2[1:-1, 1:-1]))
+
+    if compat:
+        y_int = _sum_adjacent_columns(contents)
+    else:
+        y_int = contents[1:-1, 1:-1].sum(axis=1)
+    has_int = y_int > 0
+    scale_factor = np.where(has_int, 1. / np.where(has_int, y_int, 1.), 0.)[:, np.newaxis]
+
+    normed = (inner_contents > 0) & has_int[:, np.newaxis]
+    normed_contents = inner_contents * scale_factor
+    inner_contents[normed] = normed_contents[normed]
+    normed_errors = orig_errors * scale_factor
+    inner_sumw2[normed] = (normed_errors * normed_errors)[normed]
+    n_set = np.count_nonzero(normed)
+    maximums = np.where(normed, normed_contents, 0).max(axis=1)
+
+    if hist.InheritsFrom("TH2F"):
+        # the hist stores floats, so rescaling starts from the rounded values
+        inner_contents[normed] = inner_contents[normed].astype(np.float32)
 
     # Rescale so all peaks have same value = same color
     if rescale_peaks:
-        max_peak = max(maximums)
-        for i in range(1, hnew.GetNbinsX() + 1, 1):
-            if maximums[i - 1] == 0:
-                continue
-            sf = 1. * max_peak / maximums[i - 1]
-            for j in range(1, hnew.GetNbinsY()):
-                if hnew.GetBinContent(i, j) > 0:
-                    hnew.SetBinContent(i, j, hnew.GetBinContent(i, j) * sf)
-                    hnew.SetBinError(i, j, hist.GetBinError(i, j) * sf)
+        max_peak = maximums.max()
+        has_peak = maximums > 0
+        sf = np.where(has_peak, 1. * max_peak / np.where(has_peak, maximums, 1.), 0.)[:, np.newaxis]
+        rescaled = (inner_contents > 0) & has_peak[:, np.newaxis]
+        if compat:
+            rescaled[:, -1] = False
+            rescaled_errors = orig_errors * sf
+        else:
+            rescaled_errors = normed_errors * sf
+        inner_sumw2[rescaled] = (rescaled_errors * rescaled_errors)[rescaled]
+        inner_contents[rescaled] = (inner_contents * sf)[rescaled]
+        n_set += np.count_nonzero(rescaled)
+
+    if n_set > 0:
+        set_hist2d_arrays(hnew, new_contents, new_sumw2)
+        # SetBinContent() counts as an entry
+        hnew.SetEntries(hnew.GetEntries() + n_set)
 
     # rescale Z axis otherwise it just removes a lot of small bins
     # set new minimum such that it includes all points, and the z axis min is
     # a negative integer power of 10
     min_bin = hnew.GetMinimum(0)
-    max_bin = max(maximums) if rescale_peaks else hnew.GetMaximum()
     max_bin = hnew.GetMaximum()
     hnew.SetAxisRange(10**math.floor(math.log10(min_bin)), max_bin, 'Z')
-    return hnew
\ No newline at end of file
+    return hnew
+
+
+#
+# Sub-range means: for extracting a constant from a graph by "jackknifing"
+#
+def calc_subrange_means(values):
+    """Calculate the mean of every contiguous sub-range of values.
+
+    Uses prefix sums, so each mean is one subtraction & division,
+    rather than summing the sub-range each time.
+
+    Parameters
+    ----------
+    values : np.array
+        Values, e.g. y values of a graph.
+
+    Returns
+    -------
+    np.array
+        Means of all N(N+1)/2 sub-ranges [start:end], ordered by decreasing end,
+        then increasing start (i.e. the whole range first).
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    # subtract off first value so the prefix sums don't get large
+    offset = values[0] if n else 0.
+    prefix_sums = np.concatenate(([0.], np.cumsum(values - offset)))
+    starts, ends = np.triu_indices(n + 1, 1)
+    order = np.lexsort((starts, -ends))
+    starts, ends = starts[order], ends[order]
+    return offset + (prefix_sums[ends] - prefix_sums[starts]) / (ends - starts)
+
+
+def calc_jackknife_means(values):
+    """Calculate the N jackknife means of values, i.e. the mean of values
+    with each value left out in turn.
+
+    Returns NaNs if there is only 1 value.
+    """
+    values = np.asarray(values, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (values.sum() - values) / (len(values) - 1)
@@ -347,18 +347,11 @@ def do_constant_fit(graph, eta_min, eta_max, output_dir):
     xarr, yarr = cu.get_xy(graph)
     xarr, yarr = np.array(xarr), np.array(yarr)  # use numpy array for easy slicing
 
-    # "my jackknifing": Loop over all possible subgraphs, and calculate a mean for each
-    end = len(yarr)
-    means = []
-    while end > 0:
-        start = 0
-        while start < end:
-            means.append(yarr[start:end].mean())
-            start += 1
-        end -= 1
+    # "my jackknifing": calculate a mean for every possible subgraph
+    means = cu.calc_subrange_means(yarr)
 
     # "proper" Jackknife means
-    jack_means = [np.delete(yarr, i).mean() for i in range(len(yarr))]
+    jack_means = cu.calc_jackknife_means(yarr)
 
     # Do plotting & peak finding, for both methods
     plot_name = os.path.join(output_dir, 'means_hist_%g_%g_myjackknife.pdf' % (eta_min, eta_max))
@@ -396,12 +389,11 @@ def find_peak_and_average_plot(values, eta_min, eta_max, plot_filename, title='J
     float, float
         Peak mean, and average mean.
     """
-    values = np.array(values)
+    values = np.asarray(values)
     # auto-generate histogram x axis limits using min/max of values + spacer
     num_bins = 75 if len(values) > 200 else 50
     hist = ROOT.TH1D('h_mean', '', num_bins, 0.95 * values.min(), 1.05 * values.max())
-    for m in values:
-        hist.Fill(m)
+    cu.fill_hist_arrays(hist, values)
     # find peak
     peak_bin = hist.GetMaximumBin()
     peak = hist.GetBinCenter(peak_bin)
@@ -22,7 +22,7 @@ import os
 import common_utils as cu
 from collections import OrderedDict
 from bisect import bisect_left
-from multifunc import MultiFunc
+from multifunc import MultiFunc, eval_array
 from binning import pairwise, eta_bin_colors
 from itertools import izip, ifilterfalse
 from math import ceil, floor
@@ -120,8 +120,29 @@ def complete_pt_mapping(compressed_map, hw_pt):
     return full_map
 
 
+def calc_corrections(func, pt_orig):
+    """Evaluate correction function for all pt values in one go.
+
+    Parameters
+    ----------
+    func : TF1 or MultiFunc
+        Correction function
+    pt_orig : numpy.array
+        Array of physical PT values
+
+    Returns
+    -------
+    numpy.array
+        Correction factor for each pt. pt = 0 gets 0 correction factor.
+    """
+    corr = np.zeros(len(pt_orig))
+    nonzero = pt_orig > 0
+    corr[nonzero] = eval_array(func, pt_orig[nonzero])
+    return corr
+
+
 def do_pt_compression(fit_functions, pt_orig, target_num_pt_bins,
-                      merge_algorithm, merge_criterion):
+                      merge_algorithm, merge_criterion, dp_cost='max'):
     """Mega function to figure out the optimal PT compression scheme using the correction curves
 
     Parameters
@@ -133,9 +154,11 @@ def do_pt_compression(fit_functions, pt_orig, target_num_pt_bins,
     target_num_pt_bins : int
         NUmber of bins to compress PT range into
     merge_algorithm : str
-        "greedy" or "kmeans"
+        "greedy", "kmeans", or "dp"
     merge_criterion : float
         For greedy algorithm, specifies maximum size of a bin
+    dp_cost : str
+        For dp algorithm, "max" or "sum". See calc_compressed_pt_mapping_dp()
 
     Returns
     -------
@@ -156,9 +179,7 @@ def do_pt_compression(fit_functions, pt_orig, target_num_pt_bins,
     merge_below = fit_functions[eta_ind_lowest].functions_dict.keys()[0][1]
     print 'Merge below', merge_below
 
-    # do 0 separately as it should have 0 correction factor
-    corr_orig = np.array([0.] + [fit_functions[eta_ind_lowest].Eval(pt)
-                                 for pt in pt_orig if pt > 0])
+    corr_orig = calc_corrections(fit_functions[eta_ind_lowest], pt_orig)
 
     with open('corr_dump.txt', 'w') as dump:
         dump.write(','.join(((str(x) for x in corr_orig))))
@@ -173,6 +194,11 @@ def do_pt_compression(fit_functions, pt_orig, target_num_pt_bins,
         new_pt_mapping = calc_compressed_pt_mapping_kmeans(pt_orig, corr_orig,
                                                            target_num_pt_bins,
                                                            merge_above, merge_below)
+    elif merge_algorithm == 'dp':
+        new_pt_mapping = calc_compressed_pt_mapping_dp(pt_orig, corr_orig,
+                                                       target_num_pt_bins,
+                                                       merge_above, merge_below,
+                                                       dp_cost)
     else:
         raise RuntimeError('merge_algorithm argument incorrect')
 
@@ -188,41 +214,32 @@ def do_pt_compression(fit_functions, pt_orig, target_num_pt_bins,
     return new_pt_mapping, pt_index
 
 
-def calc_compressed_pt_mapping_greedy(pt_orig, corr_orig, target_num_bins,
-                                      merge_criterion, merge_above=None, merge_below=None):
-    """Calculate new compressed pt mapping. Uses corrections
-    to decide how to merge bins via "greedy" method.
+def init_pt_mapping(pt_orig, merge_above=None, merge_below=None):
+    """Setup the original:compressed pt mapping, before the actual compression.
 
-    Returns a dicts for original:quantised pt mapping, where the quantised pT
-    is the centre of the pT bin (for lack of anything better)
+    All pts above merge_above are merged into one bin, as are all pts
+    below merge_below (except pt = 0, which always stays 0).
 
     Parameters
     ----------
     pt_orig: numpy.array
         Array of original pt bin edges (physical pT, not HW)
 
-    corr_orig: numpy.array
-        Array of original correction factors (floats, not ints)
-
-    target_num_bins: int
-        Target number of pT bins
-
-    merge_criterion: float
-        Bins will be merged if min(bins) * merge_crit > max(bins)
-
     merge_above: float
-        Bins above this value will be merged, ignoring merge_criterion
+        Bins above this value will be merged
 
     merge_below: float
-        Bins below this value will be merged, ignoring merge_criterion
+        Bins below this value will be merged
 
     Returns
     -------
     new_pt_mapping: OrderedDict
         Dict of {original pt: compressed pt}, both physical pT.
+    start_ind: int
+        Index in pt_orig of first pt still to be compressed
+    end_ind: int
+        Index in pt_orig of last pt still to be compressed
     """
-    print 'Calculating new mapping for compressed ET'
-
     # hold pt mapping
     new_pt_mapping = {p: p for p in pt_orig}
     new_pt_mapping[0] = 0.
@@ -244,7 +261,7 @@ def calc_compressed_pt_mapping_greedy(pt_orig, corr_orig, target_num_bins,
                 new_pt_mapping[pt] = mean_merge
         end_ind = merge_above_ind
 
-    orig_start_ind = 2
+    start_ind = 2
 
     if merge_below:
         # round to nearest 0.5
@@ -263,7 +280,47 @@ def calc_compressed_pt_mapping_greedy(pt_orig, corr_orig, target_num_bins,
                 continue
             if pt <= merge_below:
                 new_pt_mapping[pt] = mean_merge
-        orig_start_ind = merge_below_ind
+        start_ind = merge_below_ind
+
+    return new_pt_mapping, start_ind, end_ind
+
+
+def calc_compressed_pt_mapping_greedy(pt_orig, corr_orig, target_num_bins,
+                                      merge_criterion, merge_above=None, merge_below=None):
+    """Calculate new compressed pt mapping. Uses corrections
+    to decide how to merge bins via "greedy" method.
+
+    Returns a dicts for original:quantised pt mapping, where the quantised pT
+    is the centre of the pT bin (for lack of anything better)
+
+    Parameters
+    ----------
+    pt_orig: numpy.array
+        Array of original pt bin edges (physical pT, not HW)
+
+    corr_orig: numpy.array
+        Array of original correction factors (floats, not ints)
+
+    target_num_bins: int
+        Target number of pT bins
+
+    merge_criterion: float
+        Bins will be merged if min(bins) * merge_crit > max(bins)
+
+    merge_above: float
+        Bins above this value will be merged, ignoring merge_criterion
+
+    merge_below: float
+        Bins below this value will be merged, ignoring merge_criterion
+
+    Returns
+    -------
+    new_pt_mapping: OrderedDict
+        Dict of {original pt: compressed pt}, both physical pT.
+    """
+    print 'Calculating new mapping for compressed ET'
+
+    new_pt_mapping, orig_start_ind, end_ind = init_pt_mapping(pt_orig, merge_above, merge_below)
 
     last_num_bins = 111111111
 
@@ -348,47 +405,7 @@ def calc_compressed_pt_mapping_kmeans(pt_orig, corr_orig, target_num_bins,
     """
     print 'Calculating new mapping for compressed ET'
 
-    # hold pt mapping
-    new_pt_mapping = {p: p for p in pt_orig}
-    new_pt_mapping[0] = 0.
-    new_pt_mapping = OrderedDict(sorted(new_pt_mapping.items(), key=lambda t: t))
-
-    end_ind = len(pt_orig) - 1
-
-    # enforce truncation at 8 bits, since we only use bits 1:8
-    if not merge_above or merge_above >= 255.:
-        merge_above = 254.5
-        print 'Overriding merge_above to', merge_above
-
-    if merge_above:
-        # set all bins above this value to merge, and set to mean pt
-        merge_above_ind = bisect_left(new_pt_mapping.keys(), merge_above)
-        mean_merge = round_to_half(np.array(new_pt_mapping.keys()[merge_above_ind:]).mean())
-        for ind, pt in enumerate(new_pt_mapping.iterkeys()):
-            if pt >= merge_above:
-                new_pt_mapping[pt] = mean_merge
-        end_ind = merge_above_ind
-
-    start_ind = 2
-
-    if merge_below:
-        # round to nearest 0.5
-        merge_below = round_to_half(merge_below)
-        # check it's a half number, then the bin above is for even number
-        if float(merge_below).is_integer():
-            merge_below += 0.5
-        print 'Overriding merge_below to', merge_below
-
-        # set all bins below this value to merge, and set to mean pt
-        merge_below_ind = bisect_left(new_pt_mapping.keys(), merge_below)
-        mean_merge = round_to_half(np.array(new_pt_mapping.keys()[1:merge_below_ind]).mean())
-        for ind, pt in enumerate(new_pt_mapping.iterkeys()):
-            # keep pt = 0 set to 0
-            if ind == 0:
-                continue
-            if pt <= merge_below:
-                new_pt_mapping[pt] = mean_merge
-        start_ind = merge_below_ind
+    new_pt_mapping, start_ind, end_ind = init_pt_mapping(pt_orig, merge_above, merge_below)
 
     # actually do the clustering
     corr_data = corr_orig[start_ind: end_ind + 1]
@@ -427,6 +444,144 @@ def calc_compressed_pt_mapping_kmeans(pt_orig, corr_orig, target_num_bins,
     return new_pt_mapping
 
 
+def calc_contiguous_segments(values, num_segments, cost='max'):
+    """Find the optimal way to split values into num_segments contiguous
+    segments, using dynamic programming.
+
+    Segment costs come from prefix arrays (cumulative sums, or running
+    max/min), so the cost of every possible segment is calculated in one go.
+    Then each of the num_segments steps of the DP is one vectorised
+    minimisation over all (segment start, segment end) pairs.
+
+    Parameters
+    ----------
+    values : numpy.array
+        Values to split up, e.g. correction factors
+    num_segments : int
+        Number of segments. If larger than the number of values,
+        each value gets its own segment.
+    cost : str {'max', 'sum'}
+        'max': minimise the largest (max - min) within any segment.
+        'sum': minimise the total sum of squared deviations from each segment mean.
+
+    Returns
+    -------
+    list[int]
+        Index of the first value in each segment, in ascending order.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    num_segments = min(num_segments, n)
+    if num_segments <= 1:
+        return [0][:n]
+
+    # costs[j, i] is the cost of segment values[j:i+1]
+    start = np.arange(n)[:, np.newaxis]
+    end = np.arange(n)[np.newaxis, :]
+    valid = end >= start
+    if cost == 'sum':
+        sum_x = np.concatenate(([0.], np.cumsum(values)))
+        sum_x2 = np.concatenate(([0.], np.cumsum(values ** 2)))
+        count = np.maximum(end - start + 1, 1)
+        seg_sum = sum_x[end + 1] - sum_x[start]
+        costs = (sum_x2[end + 1] - sum_x2[start]) - (seg_sum ** 2 / count)
+        combine = np.add
+    elif cost == 'max':
+        seg_max = np.maximum.accumulate(np.where(valid, values[np.newaxis, :], -np.inf), axis=1)
+        seg_min = np.minimum.accumulate(np.where(valid, values[np.newaxis, :], np.inf), axis=1)
+        costs = seg_max - seg_min
+        combine = np.maximum
+    else:
+        raise RuntimeError('cost argument must be "max" or "sum"')
+    costs = np.where(valid, costs, np.inf)
+
+    # best[i] = best cost for values[:i+1] split into the current number of segments
+    best = costs[0].copy()
+    best_starts = []  # for each number of segments, best start of the last segment
+    for _ in range(1, num_segments):
+        # the last segment starts at j, so the previous ones cover values[:j]
+        previous = np.concatenate(([np.inf], best[:-1]))
+        candidates = combine(previous[:, np.newaxis], costs)
+        last_start = np.argmin(candidates, axis=0)
+        best = candidates[last_start, np.arange(n)]
+        best_starts.append(last_start)
+
+    # backtrack to get the start of each segment
+    starts = []
+    last = n - 1
+    for last_start in reversed(best_starts):
+        starts.append(int(last_start[last]))
+        last = starts[-1] - 1
+    starts.append(0)
+    return starts[::-1]
+
+
+def calc_compressed_pt_mapping_dp(pt_orig, corr_orig, target_num_bins,
+                                  merge_above=None, merge_below=None, cost='max'):
+    """Calculate new compressed pT binning by finding the optimal contiguous
+    grouping of correction factors, using dynamic programming.
+
+    Unlike k-means, this respects the ordering in pT, and unlike the greedy
+    algorithm, it always succeeds and gives exactly the requested number of bins.
+
+    Parameters
+    ----------
+    pt_orig: numpy.array
+        Array of original pt bin edges (physical pT, not HW)
+
+    corr_orig: numpy.array
+        Array of original correction factors (floats, not ints)
+
+    target_num_bins: int
+        Target number of pT bins
+
+    merge_above: float
+        Bins above this value will be merged
+
+    merge_below: float
+        Bins below this value will be merged
+
+    cost: str {'max', 'sum'}
+        Whether to minimise the maximum spread of correction factors in any bin,
+        or the summed squared deviations from each bin's mean correction.
+
+    Returns
+    -------
+    new_pt_mapping: OrderedDict
+        Dict of {original pt: compressed pt}, both physical pT.
+    """
+    print 'Calculating new mapping for compressed ET'
+
+    new_pt_mapping, start_ind, end_ind = init_pt_mapping(pt_orig, merge_above, merge_below)
+
+    corr_data = corr_orig[start_ind: end_ind + 1]
+    int_mask = np.equal(np.mod(pt_orig[start_ind: end_ind + 1], 1), 0)
+    pt_int = pt_orig[start_ind: end_ind + 1][int_mask]  # remove half integer pTs
+    corr_int = corr_data[int_mask]  # remove half integer pTs
+    new_target_num_bins = target_num_bins - 3  # to account for 0, merge_below, and merge_above
+
+    starts = calc_contiguous_segments(corr_int, new_target_num_bins, cost)
+
+    for seg_start, seg_end in pairwise(starts + [len(pt_int)]):
+        pt_mean = round_to_half(pt_int[seg_start:seg_end].mean())
+        for pt in np.arange(pt_int[seg_start], pt_int[seg_end - 1] + 1, 0.5):
+            new_pt_mapping[pt] = pt_mean
+
+    # now go back and set all the half integers to have same correction as whole integers
+    for i in range(len(pt_orig) / 2):
+        if new_pt_mapping[i + 0.5] != new_pt_mapping[i]:
+            new_pt_mapping[i + 0.5] = new_pt_mapping[i]
+
+    unique_mask = [k != v for k, v in new_pt_mapping.iteritems()]
+    if any(unique_mask):
+        # -1 required with .index() as otherwise it picks up wrong index
+        print 'Compressed above (inclusive):', pt_orig[unique_mask.index(True) - 1]
+    else:
+        print 'No pT compression required'
+
+    return new_pt_mapping
+
+
 def generate_address(iet_index, ieta_index):
     """Convert iEt, iEta indices to address. These are NOT HW values.
 
@@ -508,11 +663,100 @@ def generate_corr_matrix(max_iet, max_hw_correction, right_shift, add_factor=Non
         Correction matrix.
     """
     # corr_m[x, y] holds iet post-correction for correction factor x on iet y
-    corr_m = np.ndarray(shape=(max_hw_correction + 1, max_iet + 1), dtype=int)
-    for i in range(max_hw_correction + 1):
-        iet = np.arange(0, max_iet + 1)
-        corr_m[i] = correct_iet(iet, i, right_shift, add_factor=add_factor)
-    return corr_m
+    corr_factors = np.arange(0, max_hw_correction + 1)[:, np.newaxis]
+    iet = np.arange(0, max_iet + 1)[np.newaxis, :]
+    corr_m = correct_iet(iet, corr_factors, right_shift, add_factor=add_factor)
+    return corr_m.astype(int)
+
+
+def generate_corr_matrix_index(corr_matrix):
+    """Generate an index of the correction matrix, for fast lookup of the
+    correction factor for many (iet pre, iet post) pairs at once.
+
+    For a given iet, corrected iet is monotonic in correction factor,
+    so each column of corr_matrix is sorted. We store the columns one
+    after another, offsetting each column so that the whole flattened array
+    is sorted. Then all lookups can be done with one np.searchsorted.
+
+    Parameters
+    ----------
+    corr_matrix: numpy.ndarray
+        From generate_corr_matrix()
+
+    Returns
+    -------
+    dict
+        Index info, to pass to calc_hw_corr_factors()
+    """
+    min_value, max_value = corr_matrix.min(), corr_matrix.max()
+    # +2 so a value above the maximum is still inside a column's span
+    span = max_value - min_value + 2
+    columns = corr_matrix.T
+    offsets = np.arange(columns.shape[0])[:, np.newaxis] * span
+    return dict(matrix=corr_matrix,
+                columns=np.ascontiguousarray(columns),
+                flat=(columns - min_value + offsets).ravel(),
+                min_value=min_value,
+                max_value=max_value,
+                span=span)
+
+
+def round_half_away(values):
+    """Round to nearest integer, with halves rounded away from 0
+    (like python's round(), unlike np.round())"""
+    values = np.asarray(values, dtype=float)
+    return (np.sign(values) * np.floor(np.abs(values) + 0.5)).astype(int)
+
+
+def calc_hw_corr_factors(corr_index, iet_pre, iet_post):
+    """Return multiplicative factors (for hardware) that give the closest
+    values to iet_post for each iet_pre. Vectorised version of
+    calc_hw_corr_factor().
+
+    Parameters
+    ----------
+    corr_index: dict
+        From generate_corr_matrix_index()
+
+    iet_pre: numpy.array
+        HW pts before calibration
+
+    iet_post: numpy.array
+        Target HW pts post calibration
+
+    Returns
+    -------
+    numpy.array
+        Correction factor that gives closest iet_post for each entry
+
+    """
+    iet_pre = np.atleast_1d(round_half_away(iet_pre))
+    iet_post = np.atleast_1d(round_half_away(iet_post))
+    columns = corr_index['columns']
+    n_factors = columns.shape[1]
+
+    # find first factor with corrected iet >= iet_post, for each column
+    min_value = corr_index['min_value']
+    offset = np.clip(iet_post, min_value, corr_index['max_value'] + 1) - min_value
+    query = offset + (iet_pre * corr_index['span'])
+    ind = np.searchsorted(corr_index['flat'], query, side='left') - (iet_pre * n_factors)
+
+    # if not an exact match, find the closest to iet_post
+    factors = ind.copy()
+    above_all = ind == n_factors
+    factors[above_all] = n_factors - 1
+    check = ~above_all
+    value_above = columns[iet_pre[check], ind[check]]
+    # NB ind - 1 = -1 wraps to the last factor, as in calc_hw_corr_factor()
+    value_below = columns[iet_pre[check], ind[check] - 1]
+    target = iet_post[check]
+    below_closer = np.abs(value_above - target) >= np.abs(value_below - target)
+    use_below = (value_above != target) & below_closer
+    factors[np.flatnonzero(check)[use_below]] -= 1
+
+    # always return factor 0 when input pt = 0
+    factors[iet_pre == 0] = 0
+    return factors
 
 
 def calc_hw_corr_factor(corr_matrix, iet_pre, iet_post):
@@ -540,25 +784,25 @@ def calc_hw_corr_factor(corr_matrix, iet_pre, iet_post):
     # always return factor 0 when input pt = 0
     if iet_pre == 0:
         return 0
-    try:
-        # try and find an exact match
-        ind = int(np.where(corr_matrix[:, iet_pre] == iet_post)[0][0])
+    # column is sorted, so first factor that gives >= iet_post
+    # is either an exact match or the one just above
+    column = corr_matrix[:, iet_pre]
+    ind = int(np.searchsorted(column, iet_post, side='left'))
+    if ind == len(column):
+        return ind - 1
+    if column[ind] == iet_post:
         return ind
-    except IndexError:
-        # if not, find the closest to iet_post
-        ind = bisect_left(corr_matrix[:, iet_pre], iet_post)
-        if ind == len(corr_matrix[:, iet_pre]):
-            return ind - 1
-        diff_above = abs(corr_matrix[ind, iet_pre] - iet_post)
-        diff_below = abs(corr_matrix[ind-1, iet_pre] - iet_post)
-        if diff_above < diff_below:
-            return ind
-        else:
-            return ind - 1
+    # if not, find the closest to iet_post
+    diff_above = abs(column[ind] - iet_post)
+    diff_below = abs(column[ind-1] - iet_post)
+    if diff_above < diff_below:
+        return ind
+    else:
+        return ind - 1
 
 
 def calc_hw_correction_addition_ints(map_info, corr_matrix, right_shift,
-                                     num_add_bits, max_hw_pt):
+                                     num_add_bits, max_hw_pt, corr_index=None):
     """For each pt bin calculate the integer correction factor and additive
     factor that gives the closest factor to the equivalent entry in corrections.
 
@@ -579,6 +823,10 @@ def calc_hw_correction_addition_ints(map_info, corr_matrix, right_shift,
     max_hw_pt : int
         Maximum HW PT
 
+    corr_index : dict, optional
+        Index of corr_matrix from generate_corr_matrix_index().
+        Pass it in if calling this many times with the same corr_matrix.
+
     Returns
     -------
     list[int], list[int]
@@ -587,18 +835,23 @@ def calc_hw_correction_addition_ints(map_info, corr_matrix, right_shift,
     """
     print 'Assigning HW correction factors'
 
+    if corr_index is None:
+        corr_index = generate_corr_matrix_index(corr_matrix)
+
     hw_corrections, hw_additions = [], []
 
     hw_pt_orig = map_info['hw_pt_orig']
     hw_pt_post = map_info['hw_pt_post_corr_orig']
 
     # Figure out indices ofr the start & end of each compressed pt bin
-    pt_indices = list(map_info['pt_index'])
-    unique_inds = [pt_indices.index(x) for x
-                   in sorted(set(map_info['pt_index']))] + [len(pt_indices)]
+    pt_indices = np.asarray(map_info['pt_index'])
+    unique_values, first_inds = np.unique(pt_indices, return_index=True)
+    unique_inds = list(first_inds) + [len(pt_indices)]
 
+    # First figure out the target for each bin, so that the correction
+    # factors can be found for all bins at once
+    bins = []
     for lo, hi in pairwise(unique_inds):
-        print '-----'
         # average correction factor for this bin i.e. gradient
         # we use the edges of the bin to ensure continuity between bins
         hi_orig = hi
@@ -607,29 +860,41 @@ def calc_hw_correction_addition_ints(map_info, corr_matrix, right_shift,
         if hw_pt_post_hi > max_hw_pt:
             hw_pt_post_hi = max_hw_pt
             # now refind the index of the entry that is closest to max_hw_pt
-            hi = min(range(len(hw_pt_post)),
-                     key=lambda x: abs(hw_pt_post[x] - max_hw_pt)) + 1
+            hi = int(np.argmin(np.abs(hw_pt_post - max_hw_pt))) + 1
             print 'Upper limit of post-corrected pt >', max_hw_pt, ', setting to', hw_pt_post_hi
 
         corr_factor = (hw_pt_post_hi - hw_pt_post[lo]) / (1.* hw_pt_orig[hi-1] - hw_pt_orig[lo])
 
         # add factor i.e. y-intercept
         intercept = int(round(hw_pt_post[lo] - (corr_factor  * hw_pt_orig[lo])))
-        ideal_intercept = intercept
-
-        # apply y = mx + c to bin edges
-        ideal_lo = (hw_pt_orig[lo]*corr_factor) + ideal_intercept
-        ideal_hi = (hw_pt_orig[hi-1]*corr_factor) + ideal_intercept
 
         # get pre/post centers to get integer for this bin
         # this ensure we get the correct multiplier, esp for low pT
         mean_hw_pt_pre = int(round(0.5 * (hw_pt_orig[hi-1] + hw_pt_orig[lo])))
         mean_hw_pt_post = int(round(0.5 * (hw_pt_post_hi + hw_pt_post[lo])))
 
-        # subtract intercept as want factor just for gradient
-        corr_factor_int = calc_hw_corr_factor(corr_matrix,
-                                              mean_hw_pt_pre,
-                                              mean_hw_pt_post - intercept)
+        bins.append(dict(lo=lo, hi=hi, hi_orig=hi_orig, hw_pt_post_hi=hw_pt_post_hi,
+                         corr_factor=corr_factor, intercept=intercept,
+                         mean_hw_pt_pre=mean_hw_pt_pre, mean_hw_pt_post=mean_hw_pt_post))
+
+    # subtract intercept as want factor just for gradient
+    corr_factor_ints = calc_hw_corr_factors(corr_index,
+                                            [b['mean_hw_pt_pre'] for b in bins],
+                                            [b['mean_hw_pt_post'] - b['intercept'] for b in bins])
+
+    for b, corr_factor_int in izip(bins, corr_factor_ints):
+        print '-----'
+        lo, hi, hi_orig = b['lo'], b['hi'], b['hi_orig']
+        hw_pt_post_hi = b['hw_pt_post_hi']
+        corr_factor = b['corr_factor']
+        mean_hw_pt_pre, mean_hw_pt_post = b['mean_hw_pt_pre'], b['mean_hw_pt_post']
+        intercept = b['intercept']
+        ideal_intercept = intercept
+        corr_factor_int = int(corr_factor_int)
+
+        # apply y = mx + c to bin edges
+        ideal_lo = (hw_pt_orig[lo]*corr_factor) + ideal_intercept
+        ideal_hi = (hw_pt_orig[hi-1]*corr_factor) + ideal_intercept
 
         # subtlety - if corr_factor_int is the maximum it can be
         # (but should be larger), then we will undercorrect.
@@ -952,7 +1217,8 @@ def print_Stage2_lut_files(fit_functions,
                            read_pt_compression=None,
                            target_num_pt_bins=2**4,
                            merge_criterion=1.05,
-                           merge_algorithm='greedy' # or 'kmeans'
+                           merge_algorithm='greedy', # or 'kmeans' or 'dp'
+                           dp_cost='max'
                            ):
     """Make LUTs for Stage 2.
 
@@ -1007,7 +1273,7 @@ def print_Stage2_lut_files(fit_functions,
         be combined if the maximum correction factor = merge_criterion * minimum
         correction factor for those pt values.
 
-    merge_algorithm : str {'greedy' , 'kmeans'}
+    merge_algorithm : str {'greedy' , 'kmeans', 'dp'}
         Merge algorithm to use to decide upon compressed ET binning.
 
         greedy: my own algo, that merges bins within a certain tolerance until
@@ -1015,6 +1281,13 @@ def print_Stage2_lut_files(fit_functions,
 
         kmeans: use k-means algorithm in scikit-learn
 
+        dp: optimal contiguous binning via dynamic programming.
+            Always gives target_num_pt_bins.
+
+    dp_cost : str {'max', 'sum'}
+        For the dp algorithm, whether to minimise the maximum spread in
+        correction factor in any bin, or the sum of squared deviations.
+
     Raises
     ------
     IndexError
@@ -1038,6 +1311,8 @@ def print_Stage2_lut_files(fit_functions,
         print ' - target num pt bins (per eta bin):', target_num_pt_bins
         print ' - merge criterion:', merge_criterion
         print ' - merge algorithm:', merge_algorithm
+        if merge_algorithm == 'dp':
+            print ' - dp cost:', dp_cost
     print ' - # corr bits:', num_corr_bits
     print ' - # addend bits:', num_add_bits
     print ' - right shift:', right_shift
@@ -1059,7 +1334,8 @@ def print_Stage2_lut_files(fit_functions,
                                                      pt_orig,
                                                      target_num_pt_bins,
                                                      merge_algorithm,
-                                                     merge_criterion)
+                                                     merge_criterion,
+                                                     dp_cost)
 
         write_pt_compress_lut(pt_lut_filename, hw_pt_orig, pt_index)
 
@@ -1072,6 +1348,7 @@ def print_Stage2_lut_files(fit_functions,
                                                 max_hw_correction=(2**num_corr_bits) - 1,
                                                 right_shift=right_shift,
                                                 add_factor=0)
+    corr_index_add_none = generate_corr_matrix_index(corr_matrix_add_none)
 
     # figure out new correction mappings for each eta bin
     for eta_ind, func in enumerate(fit_functions):
@@ -1090,7 +1367,7 @@ def print_Stage2_lut_files(fit_functions,
                         pt_post_hw_corr_compressed=None  # phys pt post HW correction factor
                         )
 
-        corr_orig = np.array([0.] + [func.Eval(pt) for pt in pt_orig if pt > 0.])
+        corr_orig = calc_corrections(func, pt_orig)
         map_info['corr_orig'] = corr_orig
 
         map_info['pt_post_corr_orig'] = pt_orig * corr_orig
@@ -1101,7 +1378,8 @@ def print_Stage2_lut_files(fit_functions,
                                                                    corr_matrix_add_none,
                                                                    right_shift,
                                                                    num_add_bits,
-                                                                   max_hw_pt)
+                                                                   max_hw_pt,
+                                                                   corr_index_add_none)
         map_info['hw_corr_compressed'], map_info['hw_corr_compressed_add'] = corr_ints_new, add_ints
 
         # Store the result of applying the HW correction ints
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+"""
+Benchmark the Stage 2 LUT making in correction_LUT_stage2.py.
+
+Times each stage (pt compression, correction matrix, correction/addend ints,
+LUT writing) on synthetic correction curves for 16 eta bins, using stand-in
+TF1 objects, so no ROOT file or fits are needed.
+
+Each stage is run in a separate (forked) process, so that its peak memory can
+be measured. Reports the best wall time over several repeats, and the peak
+memory above the process baseline.
+
+Results can be saved as a baseline, and later runs compared against it, e.g.:
+
+    python correction_LUT_stage2_benchmark.py --save-baseline lut_benchmark.json
+    (...edit LUT code...)
+    python correction_LUT_stage2_benchmark.py --compare lut_benchmark.json
+
+Exits with status 1 if any stage is slower (or uses more memory) than the
+baseline by more than the tolerance.
+
+Baselines are machine-specific - only compare runs from the same machine.
+"""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import traceback
+import multiprocessing
+from collections import OrderedDict
+import numpy as np
+import common_utils as cu
+import correction_LUT_stage2 as cls
+from multifunc import MultiFunc, compile_numpy_function
+
+
+# Same form as the correction function fitted in runCalibration
+CORR_FUNC_STR = "[0]+[1]/(pow(log10(x),2)+[2])+[3]*exp(-[4]*(log10(x)-[5])*(log10(x)-[5]))"
+
+# Typical fit parameters for a central eta bin
+CORR_FUNC_PARAMS = [3.18556244, 25.56760298, 2.51677342, -103.26529010, 0.00678420, -18.73657857]
+
+
+class StubTF1(object):
+    """Stand-in for a TF1, with the bare minimum needed by the LUT code."""
+
+    def __init__(self, name, formula, params, xmin, xmax):
+        self.name = name
+        self.formula = formula
+        self.params = list(params)
+        self.xmin = xmin
+        self.xmax = xmax
+        self.kernel = compile_numpy_function(self)
+
+    def GetName(self):
+        return self.name
+
+    def GetExpFormula(self):
+        return self.formula
+
+    def GetNpar(self):
+        return len(self.params)
+
+    def GetParameter(self, i):
+        return self.params[i]
+
+    def Eval(self, x):
+        return float(self.kernel(np.array([x], dtype=float))[0])
+
+    def GetMinimumX(self):
+        xmax = min(self.xmax, 1023.5)
+        x = np.arange(self.xmin, xmax, 0.01)
+        return x[np.argmin(self.kernel(x))]
+
+
+def make_fit_functions(num_eta_bins=16):
+    """Make a MultiFunc for each eta bin, in the same way as
+    correction_LUT_plot.py: constant plateau at low pT, then the correction
+    curve, then constant above 1023.5.
+
+    The curves & plateau ends vary a bit with eta bin,
+    with the lowest plateau end in eta bin 0.
+    """
+    functions = []
+    for eta_ind in range(num_eta_bins):
+        params = list(CORR_FUNC_PARAMS)
+        params[0] += 0.02 * eta_ind
+        params[1] *= 1 + 0.01 * eta_ind
+        pt_merge = 8. + 0.5 * eta_ind
+        curve = StubTF1("fitfcn_%d" % eta_ind, CORR_FUNC_STR, params, pt_merge * 0.75, 1024)
+        constant = StubTF1("constant_%d" % eta_ind, "[0]", [curve.Eval(pt_merge)], 0, pt_merge)
+        constant_highpT = StubTF1("constant_highpT_%d" % eta_ind, "[0]", [curve.Eval(1023.5)],
+                                  1023.5, ((2**16) - 1) * 0.5)
+        functions.append(MultiFunc({(0, pt_merge): constant,
+                                    (pt_merge, 1023.5): curve,
+                                    (1023.4, np.inf): constant_highpT}))
+    return functions
+
+
+#
+# The stages to benchmark. Each takes the state dict (setup + outputs of
+# earlier stages), and returns a dict of outputs to add to it.
+#
+def stage_pt_compression(state, merge_algorithm):
+    new_pt_mapping, pt_index = cls.do_pt_compression(state['fit_functions'],
+                                                     state['pt_orig'],
+                                                     state['target_num_pt_bins'],
+                                                     merge_algorithm,
+                                                     state['merge_criterion'])
+    return {'pt_index_%s' % merge_algorithm: pt_index}
+
+
+def stage_generate_corr_matrix(state):
+    corr_matrix = cls.generate_corr_matrix(max_iet=state['max_hw_pt'],
+                                           max_hw_correction=(2**state['num_corr_bits']) - 1,
+                                           right_shift=state['right_shift'],
+                                           add_factor=0)
+    return {'corr_matrix': corr_matrix}
+
+
+def stage_generate_corr_matrix_index(state):
+    return {'corr_index': cls.generate_corr_matrix_index(state['corr_matrix'])}
+
+
+def stage_calc_corrections(state):
+    all_mapping_info = OrderedDict()
+    pt_orig = state['pt_orig']
+    for eta_ind, func in enumerate(state['fit_functions']):
+        corr_orig = cls.calc_corrections(func, pt_orig)
+        pt_post_corr_orig = pt_orig * corr_orig
+        all_mapping_info[eta_ind] = dict(pt_orig=pt_orig,
+                                         hw_pt_orig=state['hw_pt_orig'],
+                                         pt_index=state['pt_index'],
+                                         corr_orig=corr_orig,
+                                         pt_post_corr_orig=pt_post_corr_orig,
+                                         hw_pt_post_corr_orig=(pt_post_corr_orig * 2.).astype(int))
+    return {'all_mapping_info': all_mapping_info}
+
+
+def stage_calc_hw_correction_addition_ints(state):
+    all_mapping_info = state['all_mapping_info']
+    for map_info in all_mapping_info.itervalues():
+        corr_ints, add_ints = cls.calc_hw_correction_addition_ints(map_info,
+                                                                   state['corr_matrix'],
+                                                                   state['right_shift'],
+                                                                   state['num_add_bits'],
+                                                                   state['max_hw_pt'],
+                                                                   state['corr_index'])
+        map_info['hw_corr_compressed'], map_info['hw_corr_compressed_add'] = corr_ints, add_ints
+    return {'all_mapping_info': all_mapping_info}
+
+
+def stage_write_multiplier_lut(state):
+    cls.write_stage2_multiplier_lut(os.path.join(state['output_dir'], 'mult.txt'),
+                                    state['all_mapping_info'])
+    return {}
+
+
+def stage_write_addition_lut(state):
+    cls.write_stage2_addition_lut(os.path.join(state['output_dir'], 'add.txt'),
+                                  state['all_mapping_info'])
+    return {}
+
+
+def stage_write_addend_multiplicative_lut(state):
+    cls.write_stage2_addend_multiplicative_lut(os.path.join(state['output_dir'], 'add_mult.txt'),
+                                               state['all_mapping_info'],
+                                               state['num_add_bits'],
+                                               state['num_corr_bits'])
+    return {}
+
+
+def get_stages():
+    """Return list of (stage name, stage function), in the order they must run."""
+    stages = [('pt_compression_greedy', lambda state: stage_pt_compression(state, 'greedy'))]
+    if cls.USE_SKLEARN:
+        stages.append(('pt_compression_kmeans',
+                       lambda state: stage_pt_compression(state, 'kmeans')))
+    else:
+        print 'No scikit-learn, skipping pt_compression_kmeans'
+    stages.extend([
+        ('pt_compression_dp', lambda state: stage_pt_compression(state, 'dp')),
+        ('generate_corr_matrix', stage_generate_corr_matrix),
+        ('generate_corr_matrix_index', stage_generate_corr_matrix_index),
+        ('calc_corrections', stage_calc_corrections),
+        ('calc_hw_correction_addition_ints', stage_calc_hw_correction_addition_ints),
+        ('write_stage2_multiplier_lut', stage_write_multiplier_lut),
+        ('write_stage2_addition_lut', stage_write_addition_lut),
+        ('write_stage2_addend_multiplicative_lut', stage_write_addend_multiplicative_lut),
+    ])
+    return stages
+
+
+def get_max_rss_mb():
+    """Peak resident memory of this process in MB (ru_maxrss is in kB on Linux, bytes on OS X)"""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss /= 1024.
+    return max_rss / 1024.
+
+
+def _stage_worker(stage_func, state, repeat, verbose, conn):
+    """Run one stage several times in a child process, and send back
+    the timings, peak memory, and outputs of the last run."""
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        rss_start = get_max_rss_mb()
+        times = []
+        for _ in range(repeat):
+            # some stages modify their inputs, so start from the same state each time
+            run_state = dict(state)
+            if 'all_mapping_info' in run_state:
+                run_state['all_mapping_info'] = OrderedDict(
+                    (k, dict(v)) for k, v in state['all_mapping_info'].iteritems())
+            start = time.time()
+            outputs = stage_func(run_state)
+            times.append(time.time() - start)
+        conn.send((times, get_max_rss_mb() - rss_start, outputs))
+    except BaseException:
+        # includes SystemExit, e.g. if the greedy algorithm gets stuck
+        conn.send(traceback.format_exc())
+    conn.close()
+
+
+def run_stage(stage_func, state, repeat, verbose=False):
+    """Run one stage in a forked process.
+
+    Returns
+    -------
+    list[float], float, dict
+        Wall times for each repeat, peak memory (MB) above the baseline of the
+        process, and the outputs of the stage
+    """
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=_stage_worker,
+                                   args=(stage_func, state, repeat, verbose, child_conn))
+    proc.start()
+    child_conn.close()
+    result = parent_conn.recv()
+    proc.join()
+    if isinstance(result, str):
+        raise RuntimeError('Benchmark stage failed:\n%s' % result)
+    return result
+
+
+def run_benchmark(num_eta_bins=16, repeat=3, verbose=False):
+    """Run all the stages, and return the results as a dict"""
+    max_hw_pt = (2**11 - 1)
+    pt_orig = np.arange(0, max_hw_pt * 0.5 + 0.5, 0.5)
+    output_dir = tempfile.mkdtemp(prefix='lut_benchmark_')
+    state = dict(fit_functions=make_fit_functions(num_eta_bins),
+                 pt_orig=pt_orig,
+                 hw_pt_orig=(pt_orig * 2).astype(int),
+                 max_hw_pt=max_hw_pt,
+                 target_num_pt_bins=2**4,
+                 # the greedy algorithm gets stuck on these curves for anything tighter
+                 merge_criterion=1.08,
+                 right_shift=9,
+                 num_corr_bits=10,
+                 num_add_bits=8,
+                 output_dir=output_dir)
+
+    results = OrderedDict()
+    # do_pt_compression dumps a file into the current directory, keep it out of the way
+    cwd = os.getcwd()
+    os.chdir(output_dir)
+    try:
+        for stage_name, stage_func in get_stages():
+            times, peak_mem, outputs = run_stage(stage_func, state, repeat, verbose)
+            state.update(outputs)
+            if stage_name == 'pt_compression_greedy':
+                state['pt_index'] = state['pt_index_greedy']
+            results[stage_name] = dict(time=min(times),
+                                       time_median=float(np.median(times)),
+                                       peak_mem_mb=peak_mem)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(output_dir)
+
+    return OrderedDict([
+        ('stages', results),
+        ('total_time', sum(r['time'] for r in results.itervalues())),
+        ('num_eta_bins', num_eta_bins),
+        ('repeat', repeat),
+        ('python', platform.python_version()),
+        ('numpy', np.__version__),
+        ('host', platform.node()),
+        ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+    ])
+
+
+def print_results(results):
+    print '%-40s %10s %10s %12s' % ('Stage', 'best [s]', 'median [s]', 'peak mem [MB]')
+    for stage_name, res in results['stages'].iteritems():
+        values = (stage_name, res['time'], res['time_median'], res['peak_mem_mb'])
+        print '%-40s %10.4f %10.4f %12.1f' % values
+    print '%-40s %10.4f' % ('Total', results['total_time'])
+
+
+def compare_results(results, baseline, tolerance, min_time, min_mem):
+    """Compare results to baseline, printing out the differences.
+
+    A stage counts as a regression if it is slower (or uses more memory) than
+    the baseline by more than the fractional tolerance, AND by more than
+    min_time seconds (or min_mem MB), to avoid flagging noise in tiny numbers.
+
+    Returns
+    -------
+    list[str]
+        Descriptions of any regressions
+    """
+    regressions = []
+    headers = ('Stage', 'base [s]', 'now [s]', 'ratio', 'base [MB]', 'now [MB]')
+    print '%-40s %10s %10s %8s %12s %12s' % headers
+    for stage_name, res in results['stages'].iteritems():
+        if stage_name not in baseline['stages']:
+            print '%-40s not in baseline' % stage_name
+            continue
+        base = baseline['stages'][stage_name]
+        ratio = res['time'] / base['time'] if base['time'] > 0 else float('inf')
+        values = (stage_name, base['time'], res['time'], ratio,
+                  base['peak_mem_mb'], res['peak_mem_mb'])
+        print '%-40s %10.4f %10.4f %8.2f %12.1f %12.1f' % values
+        slower = res['time'] > base['time'] * (1 + tolerance)
+        if slower and res['time'] - base['time'] > min_time:
+            regressions.append('%s: time %.4f s -> %.4f s'
+                               % (stage_name, base['time'], res['time']))
+        bigger = res['peak_mem_mb'] > base['peak_mem_mb'] * (1 + tolerance)
+        if bigger and res['peak_mem_mb'] - base['peak_mem_mb'] > min_mem:
+            regressions.append('%s: peak memory %.1f MB -> %.1f MB'
+                               % (stage_name, base['peak_mem_mb'], res['peak_mem_mb']))
+    return regressions
+
+
+def main(in_args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=cu.CustomFormatter)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times to run each stage. Best time is used.")
+    parser.add_argument("--numEtaBins", type=int, default=16,
+                        help="Number of eta bins (i.e. correction functions)")
+    parser.add_argument("--save-baseline",
+                        help="Save results as a baseline JSON file")
+    parser.add_argument("--compare",
+                        help="Compare results against this baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Fractional slowdown/memory increase allowed before "
+                        "it counts as a regression")
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="Ignore slowdowns smaller than this (seconds)")
+    parser.add_argument("--min-mem", type=float, default=5,
+                        help="Ignore memory increases smaller than this (MB)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="Show output from the LUT functions")
+    args = parser.parse_args(args=in_args)
+
+    if args.repeat < 1:
+        raise RuntimeError("--repeat must be >= 1")
+
+    results = run_benchmark(num_eta_bins=args.numEtaBins, repeat=args.repeat,
+                            verbose=args.verbose)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print 'Saved baseline to', args.save_baseline
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print 'Comparing against baseline from %s on %s' % (baseline['date'], baseline['host'])
+        regressions = compare_results(results, baseline, args.tolerance,
+                                      args.min_time, args.min_mem)
+        if regressions:
+            print 'REGRESSIONS:'
+            for reg in regressions:
+                print ' -', reg
+            return 1
+        print 'No regressions'
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -32,7 +32,8 @@ def check_sorted(iterable):
 class TestLUTMethods(unittest.TestCase):
     def setUp(self):
         """One eta bin"""
-        p0, p1, p2, p3, p4, p5 = 3.18556244, 25.56760298, 2.51677342, -103.26529010, 0.00678420, -18.73657857
+        p0, p1, p2 = 3.18556244, 25.56760298, 2.51677342
+        p3, p4, p5 = -103.26529010, 0.00678420, -18.73657857
         self.func = TestFunc(p0, p1, p2, p3, p4, p5)
         self.max_pt = 1024
         self.target_num_pt_bins = 255
@@ -126,5 +127,70 @@ class TestLUTMethods(unittest.TestCase):
     # def test_(self):
 
 
+class TestCorrections(unittest.TestCase):
+    def setUp(self):
+        p0, p1, p2 = 3.18556244, 25.56760298, 2.51677342
+        p3, p4, p5 = -103.26529010, 0.00678420, -18.73657857
+        self.func = TestFunc(p0, p1, p2, p3, p4, p5)
+        self.pt_orig = np.arange(0, 1023.5 + 0.5, 0.5)
+
+    def test_calc_corrections_zero(self):
+        """Check pt = 0 gets correction factor 0"""
+        corr = cls.calc_corrections(self.func, self.pt_orig)
+        self.assertEqual(corr[0], 0)
+
+    def test_calc_corrections_matches_eval(self):
+        """Check array evaluation matches evaluating one pt at a time"""
+        corr = cls.calc_corrections(self.func, self.pt_orig)
+        expected = np.array([0.] + [self.func.Eval(pt) for pt in self.pt_orig if pt > 0])
+        self.assertTrue(np.allclose(corr, expected))
+
+
+class TestCorrFactors(unittest.TestCase):
+    def setUp(self):
+        self.right_shift = 9
+        self.corr_matrix = cls.generate_corr_matrix(max_iet=2047, max_hw_correction=1023,
+                                                    right_shift=self.right_shift, add_factor=0)
+        self.corr_index = cls.generate_corr_matrix_index(self.corr_matrix)
+
+    def test_corr_matrix_broadcast(self):
+        """Check the correction matrix matches correcting one factor at a time"""
+        for corr_int in [0, 1, 511, 1023]:
+            expected = cls.correct_iet(np.arange(0, 2048), corr_int, self.right_shift, 0)
+            self.assertTrue(np.array_equal(self.corr_matrix[corr_int], expected))
+
+    def test_corr_factors_match_single(self):
+        """Check batched correction factors match the one-at-a-time version"""
+        iet_pre = np.array([0, 1, 10, 10, 57, 200, 511, 1000, 2047, 30])
+        iet_post = np.array([0, 3, 12, 14, 80, 190, 700, 1900, 4095, -2])
+        factors = cls.calc_hw_corr_factors(self.corr_index, iet_pre, iet_post)
+        expected = [cls.calc_hw_corr_factor(self.corr_matrix, pre, post)
+                    for pre, post in zip(iet_pre, iet_post)]
+        self.assertEqual(list(factors), expected)
+
+
+class TestContiguousSegments(unittest.TestCase):
+    def setUp(self):
+        self.values = np.array([1.5, 1.49, 1.2, 1.19, 1.18, 1.05, 1.04, 1.0])
+
+    def test_num_segments(self):
+        """Check we get the requested number of contiguous segments"""
+        for cost in ['max', 'sum']:
+            starts = cls.calc_contiguous_segments(self.values, 4, cost)
+            self.assertEqual(len(starts), 4)
+            self.assertEqual(starts[0], 0)
+            self.assertTrue(check_sorted(starts))
+
+    def test_obvious_segments(self):
+        """Check obvious groupings are found"""
+        for cost in ['max', 'sum']:
+            self.assertEqual(cls.calc_contiguous_segments(self.values, 3, cost), [0, 2, 5])
+
+    def test_more_segments_than_values(self):
+        """Check each value gets its own segment if too many segments requested"""
+        starts = cls.calc_contiguous_segments(self.values, 20)
+        self.assertEqual(starts, range(len(self.values)))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+"""
+NumPy version of the DeltaR_Matcher C++ class (src/DeltaR_Matcher.cc),
+for matching L1 jets to reference jets from Python, e.g. to scan the max
+deltaR cut, without rerunning the RunMatcher executables.
+
+Jets for many events are stored as jagged arrays: a dict with flat 'pt',
+'eta', 'phi' arrays for all jets, and 'offsets', where the jets for event i
+are [offsets[i], offsets[i+1]).
+
+The matching is the same as DeltaR_Matcher::getMatchingPairs():
+
+- jets go through the same TLorentzVector::SetPtEtaPhiM round trip, so the
+  pt/eta/phi used for cuts & deltaR are exactly what the C++ sees,
+- jets must pass pt & |eta| cuts, and are sorted by descending pt,
+- going down the list of L1 jets, each is matched to the closest remaining
+  ref jet with deltaR < max_dr, which is then removed from the list.
+
+This is done for a block of events at a time, using arrays padded to the
+largest number of jets in an event in the block.
+
+Note that std::sort isn't stable, but for up to 16 jets it is (libstdc++
+uses an insertion sort), so jets with equal pt are kept in input order here,
+as in the C++ for all but very busy events.
+"""
+
+
+import numpy as np
+
+
+def make_jets(pt, eta, phi, offsets):
+    """Make a dict of jagged jet arrays.
+
+    Parameters
+    ----------
+    pt, eta, phi : numpy.ndarray
+        Flat arrays of jet quantities, for all events.
+    offsets : numpy.ndarray
+        Index of first jet for each event, plus total number of jets at the end.
+
+    Returns
+    -------
+    dict
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if offsets[-1] != len(pt) or len(pt) != len(eta) or len(pt) != len(phi):
+        raise ValueError("pt/eta/phi/offsets have inconsistent sizes: %d/%d/%d/%d"
+                         % (len(pt), len(eta), len(phi), offsets[-1]))
+    return dict(pt=np.asarray(pt, dtype=float),
+                eta=np.asarray(eta, dtype=float),
+                phi=np.asarray(phi, dtype=float),
+                offsets=offsets)
+
+
+def make_jets_from_counts(pt, eta, phi, counts):
+    """Make a dict of jagged jet arrays, using the number of jets per event."""
+    return make_jets(pt, eta, phi, np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]))
+
+
+def lorentz_vector_pt_eta_phi(pt, eta, phi):
+    """Get pt, eta, phi as a TLorentzVector would return them after SetPtEtaPhiM(pt, eta, phi, 0).
+
+    These aren't exactly the input values, due to the conversion to & from px, py, pz.
+    """
+    pt = np.abs(pt)
+    px = pt * np.cos(phi)
+    py = pt * np.sin(phi)
+    pz = pt * np.sinh(eta)
+
+    lv_pt = np.sqrt(px * px + py * py)
+
+    # TVector3::PseudoRapidity()
+    mag = np.sqrt(px * px + py * py + pz * pz)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos_theta = np.where(mag == 0, 1., pz / np.where(mag == 0, 1., mag))
+        lv_eta = -0.5 * np.log((1. - cos_theta) / (1. + cos_theta))
+    lv_eta = np.where(cos_theta * cos_theta < 1, lv_eta,
+                      np.where(pz == 0, 0., np.where(pz > 0, 10e10, -10e10)))
+
+    lv_phi = np.where((px == 0) & (py == 0), 0., np.arctan2(py, px))
+    return lv_pt, lv_eta, lv_phi
+
+
+def phi_mpi_pi(x):
+    """Put angle into [-pi, pi), exactly as TVector2::Phi_mpi_pi."""
+    x = np.array(x, dtype=float)
+    while True:
+        with np.errstate(invalid='ignore'):  # NaN stays NaN
+            high = x >= np.pi
+            low = x < -np.pi
+        if not (high.any() or low.any()):
+            return x
+        x[high] -= 2. * np.pi
+        x[low] += 2. * np.pi
+
+
+def delta_r(eta1, phi1, eta2, phi2):
+    """deltaR between jets, as TLorentzVector::DeltaR (arrays broadcast)."""
+    deta = eta1 - eta2
+    dphi = phi_mpi_pi(phi1 - phi2)
+    return np.sqrt(deta * deta + dphi * dphi)
+
+
+def select_jets(jets, min_pt, max_pt, max_eta):
+    """Apply the kinematic cuts, and sort by descending pt within each event.
+
+    Same as DeltaR_Matcher::setL1Jets / setRefJets.
+
+    Returns
+    -------
+    dict
+        Jagged arrays of TLorentzVector pt, eta, phi, as well as 'index',
+        the index of each jet in the input flat arrays.
+    """
+    pt, eta, phi = lorentz_vector_pt_eta_phi(jets['pt'], jets['eta'], jets['phi'])
+    n_events = len(jets['offsets']) - 1
+    event = np.repeat(np.arange(n_events), np.diff(jets['offsets']))
+
+    passed = np.flatnonzero((pt >= min_pt) & (pt <= max_pt) & (np.abs(eta) <= max_eta))
+    # lexsort is stable, so equal pt jets stay in input order
+    order = passed[np.lexsort((-pt[passed], event[passed]))]
+
+    counts = np.bincount(event[order], minlength=n_events)
+    selected = make_jets(pt[order], eta[order], phi[order],
+                         np.concatenate([[0], np.cumsum(counts)]))
+    selected['index'] = order
+    return selected
+
+
+def _pad_block(jets, first_event, last_event):
+    """Make 2D (event, jet) arrays for a block of events, padded with NaN / -1.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray, numpy.ndarray
+        Flat index of each jet in the jets dict (-1 for padding), eta, phi.
+    """
+    offsets = jets['offsets'][first_event:last_event + 1]
+    counts = np.diff(offsets)
+    n_events = len(counts)
+    max_jets = counts.max() if n_events else 0
+
+    flat = np.arange(offsets[0], offsets[-1])
+    row = np.repeat(np.arange(n_events), counts)
+    col = flat - offsets[row]
+
+    index = np.full((n_events, max_jets), -1, dtype=np.int64)
+    index[row, col] = flat
+    eta = np.full((n_events, max_jets), np.nan)
+    eta[row, col] = jets['eta'][flat]
+    phi = np.full((n_events, max_jets), np.nan)
+    phi[row, col] = jets['phi'][flat]
+    return index, eta, phi
+
+
+def _match_block(l1_index, ref_index, dr, max_dr):
+    """Greedy matching for a block of events.
+
+    Parameters
+    ----------
+    l1_index, ref_index : numpy.ndarray
+        2D (event, jet) arrays of jet indices, -1 for padding.
+        Jets must be sorted by descending pt.
+    dr : numpy.ndarray
+        3D (event, L1 jet, ref jet) array of deltaR.
+    max_dr : float
+        Only match if deltaR < max_dr.
+
+    Returns
+    -------
+    numpy.ndarray, numpy.ndarray
+        Index of L1 & ref jet for each matched pair, ordered by event then
+        descending L1 pt.
+    """
+    n_events = l1_index.shape[0]
+    rows = np.arange(n_events)
+    # ref jets that are still free to be matched
+    available = ref_index >= 0
+    l1_matches, ref_matches = [], []
+    for l1_col in range(l1_index.shape[1]):
+        # NaN deltaR (i.e. padding) fails the < too, as in the C++
+        with np.errstate(invalid='ignore'):
+            candidates = available & (dr[:, l1_col, :] < max_dr)
+        if not candidates.any():
+            l1_matches.append(np.full(n_events, -1, dtype=np.int64))
+            ref_matches.append(np.full(n_events, -1, dtype=np.int64))
+            continue
+        this_dr = np.where(candidates, dr[:, l1_col, :], np.inf)
+        # argmin takes the first of any equal deltaR, i.e. the higher pt ref jet
+        ref_col = np.argmin(this_dr, axis=1)
+        matched = candidates[rows, ref_col] & (l1_index[:, l1_col] >= 0)
+        available[rows[matched], ref_col[matched]] = False
+        l1_matches.append(np.where(matched, l1_index[:, l1_col], -1))
+        ref_matches.append(np.where(matched, ref_index[rows, ref_col], -1))
+
+    if not l1_matches:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    # (event, L1 jet) order
+    l1_matches = np.stack(l1_matches, axis=1).ravel()
+    ref_matches = np.stack(ref_matches, axis=1).ravel()
+    matched = l1_matches >= 0
+    return l1_matches[matched], ref_matches[matched]
+
+
+def match_jets_dr_scan(l1_jets, ref_jets, max_drs,
+                       min_ref_pt=0., max_ref_pt=9999., min_l1_pt=0., max_l1_pt=9999., max_eta=99.,
+                       block_size=50000):
+    """Match L1 & reference jets, for several max deltaR cuts.
+
+    The selection, sorting, and deltaR calculation is only done once,
+    so this is much quicker than calling match_jets() for each cut.
+
+    Parameters
+    ----------
+    l1_jets, ref_jets : dict
+        Jagged arrays of jets, see make_jets(). Must have the same number of events.
+    max_drs : list[float]
+        Maximum deltaR for a match (exclusive) for each matching.
+    min_ref_pt, max_ref_pt, min_l1_pt, max_l1_pt, max_eta : float, optional
+        Jet cuts, with the same defaults as in DeltaR_Matcher.
+    block_size : int, optional
+        Number of events to match at once. Larger is faster, but uses more memory.
+
+    Returns
+    -------
+    list[dict]
+        Matched pairs for each max deltaR. See match_jets().
+    """
+    n_events = len(l1_jets['offsets']) - 1
+    if len(ref_jets['offsets']) - 1 != n_events:
+        raise ValueError("Different number of events for L1 (%d) and ref (%d) jets"
+                         % (n_events, len(ref_jets['offsets']) - 1))
+
+    l1_sel = select_jets(l1_jets, min_l1_pt, max_l1_pt, max_eta)
+    ref_sel = select_jets(ref_jets, min_ref_pt, max_ref_pt, max_eta)
+
+    matches = [([], []) for _ in max_drs]
+    for first_event in xrange(0, n_events, block_size):
+        last_event = min(first_event + block_size, n_events)
+        l1_index, l1_eta, l1_phi = _pad_block(l1_sel, first_event, last_event)
+        ref_index, ref_eta, ref_phi = _pad_block(ref_sel, first_event, last_event)
+        # ref_it->DeltaR(l1_it), so ref - L1
+        dr = delta_r(ref_eta[:, np.newaxis, :], ref_phi[:, np.newaxis, :],
+                     l1_eta[:, :, np.newaxis], l1_phi[:, :, np.newaxis])
+        for (l1_matches, ref_matches), max_dr in zip(matches, max_drs):
+            l1_ind, ref_ind = _match_block(l1_index, ref_index, dr, max_dr)
+            l1_matches.append(l1_ind)
+            ref_matches.append(ref_ind)
+
+    results = []
+    l1_event = np.repeat(np.arange(n_events), np.diff(l1_sel['offsets']))
+    for l1_matches, ref_matches in matches:
+        l1_ind = np.concatenate(l1_matches) if l1_matches else np.zeros(0, dtype=np.int64)
+        ref_ind = np.concatenate(ref_matches) if ref_matches else np.zeros(0, dtype=np.int64)
+        pairs = dict(event=l1_event[l1_ind],
+                     l1_index=l1_sel['index'][l1_ind],
+                     ref_index=ref_sel['index'][ref_ind],
+                     pt=l1_sel['pt'][l1_ind],
+                     eta=l1_sel['eta'][l1_ind],
+                     phi=l1_sel['phi'][l1_ind],
+                     ptRef=ref_sel['pt'][ref_ind],
+                     etaRef=ref_sel['eta'][ref_ind],
+                     phiRef=ref_sel['phi'][ref_ind])
+        pairs['dr'] = delta_r(pairs['etaRef'], pairs['phiRef'], pairs['eta'], pairs['phi'])
+        results.append(pairs)
+    return results
+
+
+def match_jets(l1_jets, ref_jets, max_dr, **kwargs):
+    """Match L1 & reference jets, as DeltaR_Matcher::getMatchingPairs does.
+
+    Parameters
+    ----------
+    l1_jets, ref_jets : dict
+        Jagged arrays of jets, see make_jets(). Must have the same number of events.
+    max_dr : float
+        Maximum deltaR for a match (exclusive).
+    **kwargs
+        Jet cuts & block size, passed to match_jets_dr_scan().
+
+    Returns
+    -------
+    dict
+        Arrays for each matched pair, in the order the C++ makes them (by event,
+        then descending L1 pt): 'event', 'l1_index' & 'ref_index' (index of
+        the jets in the input flat arrays), 'pt', 'eta', 'phi' (L1 jet),
+        'ptRef', 'etaRef', 'phiRef', and 'dr'. Names match the pairs tree.
+    """
+    return match_jets_dr_scan(l1_jets, ref_jets, [max_dr], **kwargs)[0]
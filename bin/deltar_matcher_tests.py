@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""Unit tests for NumPy DeltaR matcher"""
+
+
+import deltar_matcher as dm
+import unittest
+import numpy as np
+import math
+
+
+def reference_match(l1_jets, ref_jets, max_dr, min_ref_pt=0., max_ref_pt=9999.,
+                    min_l1_pt=0., max_l1_pt=9999., max_eta=99.):
+    """Straight translation of DeltaR_Matcher (one event & jet at a time), to test against.
+
+    Returns list of (event, l1 index, ref index).
+    """
+
+    def make_vec(pt, eta, phi, ind):
+        pt = abs(pt)
+        px, py, pz = pt * math.cos(phi), pt * math.sin(phi), pt * math.sinh(eta)
+        mag = math.sqrt(px * px + py * py + pz * pz)
+        cos_theta = 1.0 if mag == 0 else pz / mag
+        if cos_theta * cos_theta < 1:
+            v_eta = -0.5 * math.log((1.0 - cos_theta) / (1.0 + cos_theta))
+        else:
+            v_eta = 0 if pz == 0 else (10e10 if pz > 0 else -10e10)
+        v_phi = 0.0 if px == 0 and py == 0 else math.atan2(py, px)
+        return (math.sqrt(px * px + py * py), v_eta, v_phi, ind)
+
+    def select(jets, ev, min_pt, max_pt):
+        start, end = jets['offsets'][ev], jets['offsets'][ev + 1]
+        vecs = [make_vec(jets['pt'][i], jets['eta'][i], jets['phi'][i], i)
+                for i in range(start, end)]
+        vecs = [v for v in vecs if v[0] >= min_pt and v[0] <= max_pt and abs(v[1]) <= max_eta]
+        return sorted(vecs, key=lambda v: -v[0])  # stable, like std::sort for few jets
+
+    def delta_r(a, b):
+        deta = a[1] - b[1]
+        dphi = a[2] - b[2]
+        while dphi >= math.pi:
+            dphi -= 2. * math.pi
+        while dphi < -math.pi:
+            dphi += 2. * math.pi
+        return math.sqrt(deta * deta + dphi * dphi)
+
+    pairs = []
+    for ev in range(len(l1_jets['offsets']) - 1):
+        l1s = select(l1_jets, ev, min_l1_pt, max_l1_pt)
+        refs = select(ref_jets, ev, min_ref_pt, max_ref_pt)
+        for l1 in l1s:
+            possible = [(ref, delta_r(ref, l1)) for ref in refs]
+            possible = sorted([p for p in possible if p[1] < max_dr], key=lambda p: p[1])
+            if possible:
+                pairs.append((ev, l1[3], possible[0][0][3]))
+                refs.remove(possible[0][0])
+    return pairs
+
+
+def random_jets(n_events, max_jets, pt_step, rng):
+    """Make random jets, with pt rounded to pt_step to make plenty of equal pt jets"""
+    counts = rng.randint(0, max_jets + 1, size=n_events)
+    n_jets = counts.sum()
+    pt = np.round(rng.exponential(30, size=n_jets) / pt_step) * pt_step
+    eta = rng.uniform(-5, 5, size=n_jets)
+    phi = rng.uniform(-np.pi, np.pi, size=n_jets)
+    return dm.make_jets_from_counts(pt, eta, phi, counts)
+
+
+class TestDeltaRMatcher(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        n_events = 500
+        self.l1_jets = random_jets(n_events, 12, 0.5, rng)
+        self.ref_jets = random_jets(n_events, 16, 0.01, rng)
+        # put ref jets near some L1 jets so there is competition for them
+        n_copy = min(len(self.l1_jets['pt']), len(self.ref_jets['pt']))
+        n_near = (n_copy + 1) // 2
+        self.ref_jets['eta'][:n_copy:2] = self.l1_jets['eta'][:n_copy:2] + rng.normal(0, .1, n_near)
+        self.ref_jets['phi'][:n_copy:2] = self.l1_jets['phi'][:n_copy:2] + rng.normal(0, .1, n_near)
+
+    def check_same(self, pairs, ref_pairs):
+        self.assertEqual(zip(pairs['event'], pairs['l1_index'], pairs['ref_index']), ref_pairs)
+
+    def test_matches_reference(self):
+        for max_dr in [0.2, 0.4, 0.7]:
+            pairs = dm.match_jets(self.l1_jets, self.ref_jets, max_dr, block_size=64)
+            self.check_same(pairs, reference_match(self.l1_jets, self.ref_jets, max_dr))
+
+    def test_cuts(self):
+        cuts = dict(min_ref_pt=10., max_ref_pt=60., min_l1_pt=5., max_l1_pt=80., max_eta=3.)
+        pairs = dm.match_jets(self.l1_jets, self.ref_jets, 0.4, **cuts)
+        self.check_same(pairs, reference_match(self.l1_jets, self.ref_jets, 0.4, **cuts))
+
+    def test_dr_scan(self):
+        max_drs = [0.2, 0.3, 0.4]
+        scan = dm.match_jets_dr_scan(self.l1_jets, self.ref_jets, max_drs)
+        for pairs, max_dr in zip(scan, max_drs):
+            single = dm.match_jets(self.l1_jets, self.ref_jets, max_dr)
+            for key in single:
+                self.assertTrue(np.array_equal(pairs[key], single[key]))
+            self.assertTrue(np.all(pairs['dr'] < max_dr))
+
+    def test_higher_pt_l1_matched_first(self):
+        """Two L1 jets closest to the same ref jet: the higher pt one gets it"""
+        l1_jets = dm.make_jets_from_counts([20., 40.], [0.1, 0.3], [0., 0.], [2])
+        ref_jets = dm.make_jets_from_counts([30.], [0.], [0.], [1])
+        pairs = dm.match_jets(l1_jets, ref_jets, 0.4)
+        self.assertEqual(list(pairs['l1_index']), [1])
+        self.assertEqual(list(pairs['ref_index']), [0])
+
+    def test_no_jets(self):
+        l1_jets = dm.make_jets_from_counts([], [], [], [0, 0])
+        ref_jets = dm.make_jets_from_counts([10.], [0.], [0.], [0, 1])
+        pairs = dm.match_jets(l1_jets, ref_jets, 0.4)
+        self.assertEqual(len(pairs['event']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -51,18 +51,11 @@ def process_file(filename, eta_bins=binning.eta_bins_forward):
         xarr, yarr = cu.get_xy(gr)
         xarr, yarr = np.array(xarr), np.array(yarr)  # use numpy array for easy slicing
 
-        # Loop over all possible subgraphs, and calculate a mean for each
-        end = len(yarr)
-        means = []
-        while end > 0:
-            start = 0
-            while start < end:
-                means.append(yarr[start:end].mean())
-                start += 1
-            end -= 1
+        # Calculate a mean for every possible subgraph
+        means = cu.calc_subrange_means(yarr)
 
         # Jackknife means
-        jack_means = [np.delete(yarr, i).mean() for i in range(len(yarr))]
+        jack_means = cu.calc_jackknife_means(yarr)
 
         # Do plotting & peak finding in both ROOT and MPL...not sure which is better?
         # peak = plot_find_peak_mpl(means, eta_min, eta_max, os.path.dirname(os.path.realpath(filename)))
@@ -94,12 +87,11 @@ def plot_jacknife_root(means, eta_min, eta_max, output_dir):
     float
         Peak mean.
     """
-    means = np.array(means)
+    means = np.asarray(means)
     # auto-generate histogram x axis limits using min/max of means + spacer
     num_bins = 75 if len(means) > 200 else 50
     hist = ROOT.TH1D('h_mean', '', num_bins, 0.95 * means.min(), 1.05 * means.max())
-    for m in means:
-        hist.Fill(m)
+    cu.fill_hist_arrays(hist, means)
     # find peak
     peak_bin = hist.GetMaximumBin()
     peak = hist.GetBinCenter(peak_bin)
@@ -140,12 +132,11 @@ def plot_find_peak_root(means, eta_min, eta_max, output_dir):
     float
         Peak mean.
     """
-    means = np.array(means)
+    means = np.asarray(means)
     # auto-generate histogram x axis limits using min/max of means + spacer
     num_bins = 75 if len(means) > 200 else 50
     hist = ROOT.TH1D('h_mean', '', num_bins, 0.95 * means.min(), 1.05 * means.max())
-    for m in means:
-        hist.Fill(m)
+    cu.fill_hist_arrays(hist, means)
     # find peak
     peak_bin = hist.GetMaximumBin()
     peak = hist.GetBinCenter(peak_bin)
@@ -181,7 +172,7 @@ def plot_find_peak_mpl(means, eta_min, eta_max, output_dir):
     float
         Peak mean.
     """
-    means = np.array(means)
+    means = np.asarray(means)
     print len(means)
     # Plot
     num_bins = 75 if len(means) > 200 else 50
@@ -197,7 +197,7 @@ def make_2d_plot(tree,
     output_filename : str
         Output filename for plot
     cut : str, optional
-        Cut string to apply when doing Draw()
+        Cut string (as for TTree::Draw) to select entries
     title : str, optional
         Title of plot
     logz : bool, optional
@@ -227,7 +227,10 @@ def make_2d_plot(tree,
         title += " (NormX, log Z scale)"
     h = ROOT.TH2D(hname, ';'.join([title, xtitle, ytitle]),
                   xbins, xmin, xmax, ybins, ymin, ymax)
-    tree.Draw("%s:%s>>%s" % (yvar, xvar, hname), cut, 'COLZ')
+    columns = cu.get_tree_columns_cached(tree, [xvar, yvar])
+    selected = cu.get_tree_selection_cached(tree, cut)
+    cu.fill_hist_arrays(h, columns[xvar][selected], columns[yvar][selected])
+    h.Draw('COLZ')
     h.SetTitleOffset(1.15, 'X')
     h.SetTitleOffset(1.2, 'Y')
     if normx:
@@ -314,10 +317,11 @@ def make_slice_plots(tree, var, xtitle, xbins, xmin, xmax, cuts,
     hstack = ROOT.THStack("hst", ';'.join([title, xtitle, ytitle]))
     draw_opts = 'HISTE'
     leg = ROOT.TLegend(0.5, 0.6, 0.88, 0.88)
+    values = cu.get_tree_columns_cached(tree, [var])[var]
     for i, cut in enumerate(cuts):
         hname = str(uuid.uuid1())
         h = ROOT.TH1D(hname, ';'.join([title, xtitle, ytitle]), xbins, xmin, xmax)
-        tree.Draw("%s>>%s" % (var, hname), cut, draw_opts)
+        cu.fill_hist_arrays(h, values[cu.get_tree_selection_cached(tree, cut)])
         h.SetLineWidth(2)
         if h.Integral() == 0:
             continue
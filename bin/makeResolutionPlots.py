@@ -30,13 +30,15 @@ python makeResolutionPlots -h
 import ROOT
 import sys
 from array import array
-import numpy
+import numpy as np
 from pprint import pprint
 from itertools import izip
 import os
 import argparse
+import multiprocessing
 import binning
 from binning import pairwise
+import common_utils as cu
 
 
 ROOT.PyConfig.IgnoreCommandLineOptions = True
@@ -69,7 +71,21 @@ def check_fit_width(fit_res, hist):
     rms = hist.GetRMS()
     return abs(rms - fit_res.Parameters()[2]) < 0.2 * abs(rms)
 
-def plot_bin_fit(res_2d, ptmin, ptmax, hist_title, hist_name, graph, output, divide=False):
+def get_pt_bin_range(res_2d, ptmin, ptmax):
+    """Get the first & last x bin indices of res_2d for a pt bin"""
+    return res_2d.GetXaxis().FindBin(ptmin), res_2d.GetXaxis().FindBin(ptmax) - 1
+
+
+def fit_pt_bins(res_2d, ptBins):
+    """Fit a Gaussian to the resolution for every pt bin of res_2d at once,
+    within peak +- 1 RMS. Returns the fits for plot_bin_fit()."""
+    return cu.fit_gaussian_projections(res_2d, [get_pt_bin_range(res_2d, ptmin, ptmax)
+                                                for ptmin, ptmax in pairwise(ptBins)],
+                                       window_centre="peak")
+
+
+def plot_bin_fit(res_2d, ptmin, ptmax, hist_title, hist_name, graph, output, divide=False,
+                 fits=None, fit_ind=0):
     """
     Does a resolution plot for one pt bin, and fits a Gaussian to it.
 
@@ -81,6 +97,8 @@ def plot_bin_fit(res_2d, ptmin, ptmax, hist_title, hist_name, graph, output, div
     graph is TGraphErrors object to add point to, adds new point at (pt, width)
     output is where you want to write hist + fit to
     divide is flag, whether to divide the width by the mean pt (default is False)
+    fits is the result of fit_pt_bins() for res_2d, with fit_ind the index of
+    this pt bin. If None, the projection is fitted by itself.
     """
 
     # Get average pt value - could be lazy and use midpoint of bin,
@@ -96,25 +114,27 @@ def plot_bin_fit(res_2d, ptmin, ptmax, hist_title, hist_name, graph, output, div
 
     # Projection of res values for given pt range
     # Get bin indices corresponding to physical pt values
-    bin_low = res_2d.GetXaxis().FindBin(ptmin)
-    bin_high = res_2d.GetXaxis().FindBin(ptmax)-1
+    bin_low, bin_high = get_pt_bin_range(res_2d, ptmin, ptmax)
     h_res = res_2d.ProjectionY(hist_name, bin_low, bin_high)
     h_res.SetTitle(hist_title)
 
     if h_res.GetEntries() > 0:
-        peak = h_res.GetBinCenter(h_res.GetMaximumBin())
-        fit_res = h_res.Fit("gaus", "QESR", "R", peak - (1. * h_res.GetRMS()), peak + (1. * h_res.GetRMS()))
-        # fit_res = h_res.Fit("gaus", "QESR", "R", h_res.GetMean() - 1. * h_res.GetRMS(), h_res.GetMean() + 1. * h_res.GetRMS())
-        # fit_res = h_res.Fit("gaus", "QMS")
-        print "gaus prob:", fit_res.Prob(), hist_name
+        if fits is None:
+            fits = cu.fit_gaussian_slices(cu.get_hist_contents(h_res), cu.get_hist_edges(h_res),
+                                          window_centre="peak")
+            fit_ind = 0
+        fit_status = int(fits['status'][fit_ind])
+        fit_prob = ROOT.TMath.Prob(fits['chi2'][fit_ind], int(fits['ndf'][fit_ind]))
+        print "gaus prob:", fit_prob, hist_name
         # default values for the width & its error - safe if the fit went wrong
         width = h_res.GetRMS()
         width_err = h_res.GetRMSError()
 
         # check fit converged, and is sensible
-        if fit_res and int(fit_res) == 0: # and check_fit_width(fit_res, h_res):
-            width =  fit_res.Parameters()[2]
-            width_err = fit_res.Errors()[2]
+        if fit_status == 0:
+            cu.make_gaussian_fit_function(fits, fit_ind, hist=h_res)
+            width = fits['sigma'][fit_ind]
+            width_err = fits['sigma_err'][fit_ind]
             # add point to graph
             if graph:
                 count = graph.GetN()
@@ -131,51 +151,153 @@ def plot_bin_fit(res_2d, ptmin, ptmax, hist_title, hist_name, graph, output, div
     output.WriteTObject(h_res)
 
 
-def plot_resolution(inputfile, outputfile, ptBins, absetamin, absetamax):
-    """Do various resolution plots for given eta bin, for all pT bins"""
+# 2D hists of resolution quantity Vs pT made for each eta bin, which are then
+# projected for individual pT bins.
+# name : (x quantity, y quantity, nbins y, y min, y max, axis titles)
+# Each has 4 bins per GeV in x, from 0 to the last pT bin edge.
+RES_HISTS = [
+    ("ptDiff_l1_2d", ("pt", "ptDiff", 200, -200, 200,
+                      "E_{T}^{L1} [GeV];E_{T}^{L1} - E_{T}^{Ref} [GeV]")),
+    ("ptDiff_ref_2d", ("ptRef", "ptDiff", 200, -200, 200,
+                       "E_{T}^{Ref} [GeV];E_{T}^{L1} - E_{T}^{Ref} [GeV]")),
+    ("res_l1_2d", ("pt", "resL1", 210, -5, 2,
+                   "E_{T}^{L1} [GeV];(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{L1}")),
+    ("res_refVsl1_2d", ("pt", "resRef", 120, -2, 2,
+                        "E_{T}^{L1} [GeV];(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{Ref}")),
+    ("res_refVsref_2d", ("ptRef", "resRef", 120, -2, 2,
+                         "E_{T}^{Ref} [GeV];(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{Ref}")),
+]
+
+
+def load_pair_columns(inputfile, use_cache=True):
+    """Read the pair quantities needed for the resolution hists from the
+    "valid" TTree into numpy arrays, so the tree only has to be read once.
+
+    Older pairs files don't store ptRef, ptDiff, resL1 or resRef,
+    so any missing are calculated from pt & rsp.
+
+    Returns a dict of quantity name : np.array, with keys eta, pt, ptRef,
+    ptDiff, resL1, resRef.
+    """
+    tree_raw = cu.get_from_file(inputfile, "valid")
+    branches = ["eta", "pt"] + [b for b in ["ptRef", "rsp", "ptDiff", "resL1", "resRef"]
+                                if check_var_stored(tree_raw, b)]
+    print "Reading columns", branches, "from", inputfile.GetName()
+    if use_cache:
+        columns = cu.get_tree_columns_cached(tree_raw, branches)
+    else:
+        columns = cu.get_tree_columns(tree_raw, branches)
+
+    # Ref jet pt - old ones don't store ptRef, so construct from pt/rsp
+    # - or should it be pt * rsp for old style rsp?
+    pt = columns["pt"]
+    if "ptRef" not in columns:
+        columns["ptRef"] = pt / columns["rsp"]
+    ptRef = columns["ptRef"]
+    if "ptDiff" not in columns:
+        columns["ptDiff"] = pt - ptRef
+    if "resL1" not in columns:
+        columns["resL1"] = (pt - ptRef) / pt  # for old pair files
+    if "resRef" not in columns:
+        columns["resRef"] = (pt - ptRef) / ptRef
+    return columns
+
+
+def fill_resolution_hists(columns, eta_bins, pt_maxes):
+    """Make & fill the RES_HISTS 2D hists for several eta bins in one go.
+
+    Each pair is assigned to its eta bin once, then each type of hist is
+    filled for all eta bins at once with np.bincount, rather than doing a
+    TTree::Draw for each hist & eta bin.
+    Equivalent to doing, for each eta bin & hist:
+
+    tree.Draw("y:x>>name(nbins_x, 0, pt_max, ...)",
+              "TMath::Abs(eta) < eta_max && TMath::Abs(eta) > eta_min && pt < pt_max")
+
+    Parameters
+    ----------
+    columns : dict
+        Pair quantities, from load_pair_columns()
+    eta_bins : list[float]
+        Eta bin edges, including the upper edge of the last bin.
+    pt_maxes : list[float]
+        For each eta bin, upper pT limit for pairs & upper edge of the
+        hists x axes (i.e. last pT bin edge).
+
+    Returns
+    -------
+    list[dict]
+        For each eta bin, a dict of hist name : TH2F
+    """
+    eta_edges = np.asarray(eta_bins, dtype=float)
+    n_eta = len(eta_edges) - 1
+    pt_maxes = np.asarray(pt_maxes, dtype=float)
+
+    # Assign each pair to its eta bin, i.e. eta_min < |eta| < eta_max
+    abs_eta = np.abs(columns["eta"])
+    eta_ind = np.searchsorted(eta_edges, abs_eta, side='right') - 1
+    selected = (eta_ind >= 0) & (eta_ind < n_eta)
+    selected[selected] &= abs_eta[selected] > eta_edges[eta_ind[selected]]
+    selected[selected] &= columns["pt"][selected] < pt_maxes[eta_ind[selected]]
+    eta_ind = eta_ind[selected]
+    entries = np.bincount(eta_ind, minlength=n_eta)
+
+    nbins_x = (4 * pt_maxes).astype(int)
+    hists = [{} for _ in range(n_eta)]
+    for name, (x_name, y_name, nbins_y, y_min, y_max, axis_titles) in RES_HISTS:
+        x = columns[x_name][selected]
+        y = columns[y_name][selected]
+
+        # Global bin number in a flat array holding the cells of the hists
+        # for all eta bins, one after another
+        n_cells = (nbins_x + 2) * (nbins_y + 2)
+        offsets = np.concatenate([[0], np.cumsum(n_cells)])
+        xbins = cu.find_bins(x, nbins_x[eta_ind], 0, pt_maxes[eta_ind])
+        ybins = cu.find_bins(y, nbins_y, y_min, y_max)
+        global_bins = offsets[eta_ind] + xbins + (nbins_x[eta_ind] + 2) * ybins
+        counts = np.bincount(global_bins, minlength=offsets[-1])
+
+        # Stats only include entries inside the hist range, as for TH2::Fill
+        in_range = ((xbins > 0) & (xbins <= nbins_x[eta_ind]) &
+                    (ybins > 0) & (ybins <= nbins_y))
+        x_in, y_in, ind_in = x[in_range], y[in_range], eta_ind[in_range]
+        n_in = np.bincount(ind_in, minlength=n_eta)
+        stats = [n_in, n_in] + [np.bincount(ind_in, weights=w, minlength=n_eta)
+                                for w in [x_in, x_in * x_in, y_in, y_in * y_in, x_in * y_in]]
+        stats = np.array(stats, dtype=float)
+
+        for k in range(n_eta):
+            hist = ROOT.TH2F(name, ";" + axis_titles,
+                             int(nbins_x[k]), 0, pt_maxes[k], nbins_y, y_min, y_max)
+            hist.SetDirectory(0)
+            cu.set_hist_from_counts(hist, counts[offsets[k]:offsets[k + 1]], stats[:, k], entries[k])
+            hists[k][name] = hist
+    return hists
+
+
+def plot_resolution(hists, outputfile, ptBins, absetamin, absetamax):
+    """Do various resolution plots for given eta bin, for all pT bins
+
+    hists is a dict of the 2D hists for this eta bin, from fill_resolution_hists()
+    """
 
     print "Doing eta bin: %g - %g" % (absetamin, absetamax)
     print "Doing pt bins:", ptBins
 
-    # Input tree
-    tree_raw = inputfile.Get("valid")
-
     # Output folders
     output_f = outputfile.mkdir('eta_%g_%g' % (absetamin, absetamax))
     output_f_hists = output_f.mkdir("Histograms")
 
-    # Eta cut string
-    eta_cut = " TMath::Abs(eta)<%g && TMath::Abs(eta) > %g " % (absetamax, absetamin)
-    # pt cut string for 2D plots
-    pt_cut_all = "pt < %g" % (ptBins[-1])
-
     title = "%g < |#eta^{L1}| < %g" % (absetamin, absetamax)
 
     # First make 2D plots of pt difference and resolution Vs Et,
     # then we can project them for individual Et bins
     # This is *much* faster than just making all the plots individually
-    diff_min = -200
-    diff_max = 200
-    nbins_diff = 200
-
-    pt_bin_min = ptBins[0]
-    pt_bin_min = 0
-    pt_bin_max = ptBins[-1]
-    nbins_et = 4 * (pt_bin_max - pt_bin_min)
-
-    # Ref jet pt from tree - old ones don't store ptRef, so construct from pt/rsp
-    # - or should it be pt * rsp for old style rsp?
-    ptRef = "ptRef" if check_var_stored(tree_raw, "ptRef") else "(pt/rsp)"
-
-    # 1D plot of ptDifference
-    # tree_raw.Draw("ptDiff>>ptDiff(%d, %g, %g)" % (nbins_diff, diff_min, diff_max), eta_cut + "&&" + pt_cut_all)
-    # ptDiff = ROOT.gROOT.FindObject("ptDiff")
+    for name, (_, _, _, _, _, axis_titles) in RES_HISTS:
+        hists[name].SetTitle("%s;%s" % (title, axis_titles))
 
     # 2d plots of pt difference vs L1 pt
-    var = "ptDiff" if check_var_stored(tree_raw, "ptDiff") else "(pt-%s)" % ptRef
-    tree_raw.Draw("%s:pt>>ptDiff_l1_2d(%d, %g, %g, %d, %g, %g)" % (var, nbins_et, pt_bin_min, pt_bin_max, nbins_diff, diff_min, diff_max), eta_cut + "&&" + pt_cut_all)
-    ptDiff_l1_2d = ROOT.gROOT.FindObject("ptDiff_l1_2d")
-    ptDiff_l1_2d.SetTitle("%s;E_{T}^{L1} [GeV];E_{T}^{L1} - E_{T}^{Ref} [GeV]" % title)
+    ptDiff_l1_2d = hists["ptDiff_l1_2d"]
     output_f_hists.WriteTObject(ptDiff_l1_2d)
 
     # 1D plot of ptDiff
@@ -191,20 +313,11 @@ def plot_resolution(inputfile, outputfile, ptBins, absetamin, absetamax):
     output_f_hists.WriteTObject(ptL1)
 
     # 2d plots of pt difference vs ref pt
-    tree_raw.Draw("%s:%s>>ptDiff_ref_2d(%d, %g, %g, %d, %g, %g)" % (var, ptRef, nbins_et, pt_bin_min, pt_bin_max, nbins_diff, diff_min, diff_max), eta_cut + "&&" + pt_cut_all)
-    ptDiff_ref_2d = ROOT.gROOT.FindObject("ptDiff_ref_2d")
-    ptDiff_ref_2d.SetTitle("%s;E_{T}^{Ref} [GeV];E_{T}^{L1} - E_{T}^{Ref} [GeV]" % title)
+    ptDiff_ref_2d = hists["ptDiff_ref_2d"]
     output_f_hists.WriteTObject(ptDiff_ref_2d)
 
-    res_min = -5
-    res_max = 2
-    nbins_res = 210
-
     # 2D plot of L1-Ref/L1 VS L1
-    var = "resL1" if check_var_stored(tree_raw, "resL1") else "(pt-%s)/pt" % (ptRef)  # for old pair files
-    tree_raw.Draw("%s:pt>>res_l1_2d(%d, %g, %g, %d, %g, %g)" % (var, nbins_et, pt_bin_min, pt_bin_max, nbins_res, res_min, res_max), eta_cut + "&&" + pt_cut_all)
-    res_l1_2d = ROOT.gROOT.FindObject("res_l1_2d")
-    res_l1_2d.SetTitle("%s;E_{T}^{L1} [GeV];(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{L1}" % title)
+    res_l1_2d = hists["res_l1_2d"]
     output_f_hists.WriteTObject(res_l1_2d)
 
     # 1D plot of L1-ref/L1
@@ -214,12 +327,7 @@ def plot_resolution(inputfile, outputfile, ptBins, absetamin, absetamax):
     output_f_hists.WriteTObject(res_l1)
 
     # 2D plot of L1-Ref/Ref VS L1
-    var = "resRef" if check_var_stored(tree_raw, "resRef") else "(pt-%s)/%s" % (ptRef, ptRef)
-    res_min = -2
-    nbins_res = 120
-    tree_raw.Draw("%s:pt>>res_refVsl1_2d(%d, %g, %g, %d, %g, %g)" % (var, nbins_et, pt_bin_min, pt_bin_max, nbins_res, res_min, res_max), eta_cut + "&&" + pt_cut_all)
-    res_refVsl1_2d = ROOT.gROOT.FindObject("res_refVsl1_2d")
-    res_refVsl1_2d.SetTitle("%s;E_{T}^{L1} [GeV];(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{Ref}" % title)
+    res_refVsl1_2d = hists["res_refVsl1_2d"]
     output_f_hists.WriteTObject(res_refVsl1_2d)
 
     # 1D plot of L1-ref/ref
@@ -229,10 +337,7 @@ def plot_resolution(inputfile, outputfile, ptBins, absetamin, absetamax):
     output_f_hists.WriteTObject(res_ref)
 
     # 2D plot of L1-Ref/Ref VS Ref
-    var = "resRef" if check_var_stored(tree_raw, "resRef") else "(pt-%s)/%s" % (ptRef, ptRef)
-    tree_raw.Draw("%s:%s>>res_refVsref_2d(%d, %g, %g, %d, %g, %g)" % (var, ptRef, nbins_et, pt_bin_min, pt_bin_max, nbins_res, res_min, res_max), eta_cut + "&&" + pt_cut_all)
-    res_refVsref_2d = ROOT.gROOT.FindObject("res_refVsref_2d")
-    res_refVsref_2d.SetTitle("%s;E_{T}^{Ref} [GeV];(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{Ref}" % title)
+    res_refVsref_2d = hists["res_refVsref_2d"]
     output_f_hists.WriteTObject(res_refVsref_2d)
 
     # Graphs to hold resolution for all pt bins
@@ -254,6 +359,9 @@ def plot_resolution(inputfile, outputfile, ptBins, absetamin, absetamax):
     # res_graph_refVsl1_diff = ROOT.TGraphErrors() # fit to L1 - ref pT, divide by ref pT, binned in L1 pt
     # res_graph_refVsl1_diff.SetNameTitle("resRefL1_%g_%g_diff" % (absetamin, absetamax), "%s;E_{T}^{Ref} [GeV];#sigma(E_{T}^{L1} - E_{T}^{Ref})/<E_{T}^{Ref}>" % title)
 
+    # Fit the resolution for all pt bins of each 2D hist in one go
+    fits = {name: fit_pt_bins(hists[name], ptBins) for name, _ in RES_HISTS}
+
     # Now go through pt bins, and plot resolution for each, fit with gaussian,
     # and add width to graph
     for i, ptmin in enumerate(ptBins[:-1]):
@@ -268,27 +376,32 @@ def plot_resolution(inputfile, outputfile, ptBins, absetamin, absetamax):
         # Plot difference in L1 pT and Ref pT (in bin of L1 pt)
         plot_bin_fit(ptDiff_l1_2d, ptmin, ptmax,
             "%s;E_{T}^{L1} - E_{T}^{Ref} [GeV];N" % l1_bin_title,
-            "ptDiff_l1_%g_%g" % (ptmin, ptmax), res_graph_l1_diff, output_f_hists, divide=True)
+            "ptDiff_l1_%g_%g" % (ptmin, ptmax), res_graph_l1_diff, output_f_hists,
+            divide=True, fits=fits["ptDiff_l1_2d"], fit_ind=i)
 
         # Plot difference in L1 pT and Ref pT (in bin of ref pt)
         plot_bin_fit(ptDiff_ref_2d, ptmin, ptmax,
             "%s;E_{T}^{L1} - E_{T}^{Ref} [GeV];N" % ref_bin_title,
-            "ptDiff_ref_%g_%g" % (ptmin, ptmax), res_graph_refVsref_diff, output_f_hists, divide=True)
+            "ptDiff_ref_%g_%g" % (ptmin, ptmax), res_graph_refVsref_diff, output_f_hists,
+            divide=True, fits=fits["ptDiff_ref_2d"], fit_ind=i)
 
         # Plot resolution wrt L1 pT & fit
         plot_bin_fit(res_l1_2d, ptmin, ptmax,
             "%s;(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{L1};N" % l1_bin_title,
-            "res_l1_%g_%g" % (ptmin, ptmax), res_graph_l1, output_f_hists)
+            "res_l1_%g_%g" % (ptmin, ptmax), res_graph_l1, output_f_hists,
+            fits=fits["res_l1_2d"], fit_ind=i)
 
         # Plot ref resolution wrt L1 pT & fit
         plot_bin_fit(res_refVsl1_2d, ptmin, ptmax,
             "%s;(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{Ref};N" % l1_bin_title,
-            "res_ref_l1_%g_%g" % (ptmin, ptmax), res_graph_refVsl1, output_f_hists)
+            "res_ref_l1_%g_%g" % (ptmin, ptmax), res_graph_refVsl1, output_f_hists,
+            fits=fits["res_refVsl1_2d"], fit_ind=i)
 
         # Plot ref resolution Vs ref pt
         plot_bin_fit(res_refVsref_2d, ptmin, ptmax,
             "%s;(E_{T}^{L1} - E_{T}^{Ref})/E_{T}^{Ref};N" % ref_bin_title,
-            "res_ref_ref_%g_%g" % (ptmin, ptmax), res_graph_refVsref, output_f_hists)
+            "res_ref_ref_%g_%g" % (ptmin, ptmax), res_graph_refVsref, output_f_hists,
+            fits=fits["res_refVsref_2d"], fit_ind=i)
 
     output_f.WriteTObject(res_graph_l1)
     output_f.WriteTObject(res_graph_l1_diff)
@@ -297,8 +410,29 @@ def plot_resolution(inputfile, outputfile, ptBins, absetamin, absetamax):
     output_f.WriteTObject(res_graph_refVsref_diff)
 
 
+# Resolution hists for worker processes in --jobs mode.
+# Set before the pool is created, so the forked workers inherit them,
+# rather than having them pickled for every task.
+_WORKER_HISTS = None
+
+
+def _plot_resolution_task(task):
+    """Do plot_resolution() for one eta bin in a worker process, for --jobs mode.
+
+    Results are written to an in-memory TDirectory, and its contents returned
+    so that the parent process can write them to the output file.
+    """
+    ind, ptBins, eta_min, eta_max = task
+    mem_file = ROOT.TMemFile("res_eta_%g_%g.root" % (eta_min, eta_max), "RECREATE")
+    plot_resolution(_WORKER_HISTS[ind], mem_file, ptBins, eta_min, eta_max)
+    contents = cu.get_directory_contents(mem_file)
+    mem_file.Close()
+    return contents
+
+
 ########### MAIN ########################
 def main(in_args=sys.argv[1:]):
+    global _WORKER_HISTS
     print in_args
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("input", help="input ROOT filename")
@@ -315,6 +449,11 @@ def main(in_args=sys.argv[1:]):
                         "This overrides --central/--forward. " \
                         "Handy for batch mode. " \
                         "IMPORTANT: MUST PUT AT VERY END")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of worker processes to spread eta bins over.")
+    parser.add_argument("--no-column-cache", action='store_false', dest='column_cache',
+                        help="Don't use or make the cache of pair quantities "
+                        "(<input>.columns/), read the TTree directly instead.")
     args = parser.parse_args(args=in_args)
 
     inputf = ROOT.TFile(args.input, "READ")
@@ -337,9 +476,18 @@ def main(in_args=sys.argv[1:]):
         etaBins = binning.eta_bins_forward
     print "Running over eta bins:", etaBins
 
+    if not args.incl and not args.excl:
+        print "Not doing inclusive or exclusive - you must specify at least one!"
+        return 1
+
+    # Figure out the eta bins (& their pt bins) to do
+    # Each task is (eta bin edges, pt bins for each eta bin)
+    tasks = []
+
     # Do plots for individual eta bins
     if args.excl:
         print "Doing individual eta bins"
+        excl_pt_bins = []
         for i, (eta_min, eta_max) in enumerate(pairwise(etaBins)):
 
             # whether we're doing a central or forward bin (.1 is for rounding err)
@@ -348,19 +496,40 @@ def main(in_args=sys.argv[1:]):
             # setup pt bins, wider ones for forward region
             # ptBins = binning.pt_bins_8 if not forward_bin else binning.pt_bins_8_wide
             ptBins = binning.pt_bins if not forward_bin else binning.pt_bins_wide
-
-            plot_resolution(inputf, outputf, ptBins[4:], eta_min, eta_max)
+            excl_pt_bins.append(ptBins[4:])
+        tasks.append((etaBins, excl_pt_bins))
 
     # Do plots for inclusive eta
     # Skip if doing exlcusive and only 2 bins, or if only 1 bin
     if args.incl and ((not args.excl and len(etaBins) >= 2) or (args.excl and len(etaBins)>2)):
         print "Doing inclusive eta"
         # ptBins = binning.pt_bins if not etaBins[0] > 2.9 else binning.pt_bins_wide
-        plot_resolution(inputf, outputf, binning.pt_bins[4:], etaBins[0], etaBins[-1])
-
-    if not args.incl and not args.excl:
-        print "Not doing inclusive or exclusive - you must specify at least one!"
-        return 1
+        tasks.append(([etaBins[0], etaBins[-1]], [binning.pt_bins[4:]]))
+
+    # Read the tree once, and fill the 2D hists for all eta bins in one go
+    # (exclusive bins can all be done together, since they don't overlap)
+    columns = load_pair_columns(inputf, use_cache=args.column_cache)
+    eta_bin_list, hists = [], []
+    for eta_edges, pt_bins_list in tasks:
+        hists.extend(fill_resolution_hists(columns, eta_edges, [pt[-1] for pt in pt_bins_list]))
+        eta_bin_list.extend([(pt_bins, eta_min, eta_max) for pt_bins, (eta_min, eta_max)
+                             in izip(pt_bins_list, pairwise(eta_edges))])
+    del columns
+
+    # Now project & fit for each eta bin
+    if args.jobs > 1:
+        _WORKER_HISTS = hists
+        pool = multiprocessing.Pool(args.jobs)
+        bin_tasks = [(i, pt_bins, eta_min, eta_max)
+                     for i, (pt_bins, eta_min, eta_max) in enumerate(eta_bin_list)]
+        # write results in eta bin order, as they finish
+        for contents in pool.imap(_plot_resolution_task, bin_tasks):
+            cu.write_directory_contents(outputf, contents)
+        pool.close()
+        pool.join()
+    else:
+        for hist_dict, (pt_bins, eta_min, eta_max) in izip(hists, eta_bin_list):
+            plot_resolution(hist_dict, outputf, pt_bins, eta_min, eta_max)
 
     inputf.Close()
     outputf.Close()
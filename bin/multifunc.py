@@ -1,8 +1,191 @@
 import ROOT
+import re
+import __future__
 from collections import OrderedDict
+from bisect import bisect_right
+import math
 import numpy as np
 
 
+# Table for erf_numpy(): erf(x) on [0, ERF_TABLE_MAX) is split into intervals of
+# ERF_TABLE_WIDTH, and in each one, erf(x) - erf(interval centre) is a polynomial
+# of degree ERF_TABLE_DEGREE in t = x mapped onto [-1, 1].
+# Below ERF_TABLE_WIDTH we use the Taylor series instead, to keep the relative
+# accuracy for tiny x. Above ERF_TABLE_MAX, erf(x) is 1 to double precision.
+ERF_TABLE_WIDTH = 0.0625
+ERF_TABLE_MAX = 6.
+ERF_TABLE_DEGREE = 8
+ERF_SERIES_TERMS = 8
+
+
+def make_erf_table():
+    """Make the table of polynomial coefficients for erf_numpy(), by fitting
+    math.erf at Chebyshev nodes in each interval.
+
+    Returns
+    -------
+    np.array, np.array
+        erf at the interval centres, and polynomial coefficients,
+        of shape (ERF_TABLE_DEGREE + 1, number of intervals) with the
+        highest power first.
+    """
+    n_nodes = 3 * ERF_TABLE_DEGREE
+    nodes = np.cos(np.pi * (np.arange(n_nodes) + 0.5) / n_nodes)
+    centres, coeffs = [], []
+    for lower in np.arange(0., ERF_TABLE_MAX, ERF_TABLE_WIDTH):
+        centres.append(math.erf(lower + ERF_TABLE_WIDTH / 2.))
+        x = lower + (nodes + 1) * ERF_TABLE_WIDTH / 2.
+        cheb = np.polynomial.chebyshev.chebfit(nodes, [math.erf(xi) - centres[-1] for xi in x],
+                                               ERF_TABLE_DEGREE)
+        poly = np.polynomial.chebyshev.cheb2poly(cheb)[::-1]
+        coeffs.append(np.concatenate((np.zeros(ERF_TABLE_DEGREE + 1 - len(poly)), poly)))
+    return np.array(centres), np.ascontiguousarray(np.transpose(coeffs))
+
+
+ERF_TABLE_CENTRES, ERF_TABLE_COEFFS = make_erf_table()
+
+ERF_SERIES_COEFFS = [2. / math.sqrt(math.pi) * (-1)**n / (math.factorial(n) * (2 * n + 1))
+                     for n in range(ERF_SERIES_TERMS)]
+
+
+def erf_numpy(x):
+    """Vectorised erf, for when scipy isn't available.
+
+    Uses a piecewise polynomial (see make_erf_table()), so only needs a
+    handful of array operations. Agrees with math.erf to ~1E-15.
+    """
+    x = np.asarray(x, dtype=float)
+    absx = np.abs(x)
+    result = np.sign(x)
+
+    in_table = absx < ERF_TABLE_MAX
+    x_table = absx[in_table]
+    ind = np.minimum((x_table / ERF_TABLE_WIDTH).astype(int), len(ERF_TABLE_CENTRES) - 1)
+    t = (x_table - ind * ERF_TABLE_WIDTH) * (2. / ERF_TABLE_WIDTH) - 1.
+    acc = ERF_TABLE_COEFFS[0].take(ind)
+    for coeffs in ERF_TABLE_COEFFS[1:]:
+        acc *= t
+        acc += coeffs.take(ind)
+    acc += ERF_TABLE_CENTRES.take(ind)
+    result[in_table] *= acc
+
+    small = absx < ERF_TABLE_WIDTH
+    x_small = x[small]
+    x2 = x_small * x_small
+    acc = np.full_like(x_small, ERF_SERIES_COEFFS[-1])
+    for coeff in ERF_SERIES_COEFFS[-2::-1]:
+        acc *= x2
+        acc += coeff
+    result[small] = acc * x_small
+    return result
+
+
+try:
+    from scipy.special import erf
+except ImportError:
+    erf = erf_numpy
+
+
+# Map ROOT function names onto their numpy equivalents, so TF1 formulae
+# can be evaluated on whole arrays at once
+ROOT_TO_NUMPY_NAMES = [
+    ("TMath::Erf", "erf"),
+    ("TMath::Exp", "exp"),
+    ("TMath::Log10", "log10"),
+    ("TMath::Log", "log"),
+    ("TMath::Power", "pow"),
+    ("TMath::Sqrt", "sqrt"),
+    ("TMath::Abs", "abs"),
+]
+
+NUMPY_NAMESPACE = {
+    "erf": erf,
+    "exp": np.exp,
+    "log10": np.log10,
+    "log": np.log,
+    "pow": np.power,
+    "sqrt": np.sqrt,
+    "abs": np.abs,
+}
+
+
+def translate_formula(formula):
+    """Translate a TF1 formula string into a numpy expression of x & p.
+
+    e.g. "[0]+[1]*TMath::Erf([2]*(log10(x)-[3]))" becomes
+    "p[0]+p[1]*erf(p[2]*(log10(x)-p[3]))"
+
+    Returns None if the formula uses anything we don't know how to translate.
+    """
+    expr = formula
+    for root_name, np_name in ROOT_TO_NUMPY_NAMES:
+        expr = expr.replace(root_name, np_name)
+    # parameters can be [0] or [p0]
+    expr = re.sub(r"\[p?(\d+)\]", r"p[\1]", expr)
+    if re.search(r"[^\w\s\.\+\-\*/\(\),\[\]]", expr):
+        return None
+    # ignore parts of numbers like 1.2e-05
+    names = set(re.findall(r"[A-Za-z_]\w*", re.sub(r"\d\.?\d*[eE][\+\-]?\d+", "", expr)))
+    if not names.issubset(set(NUMPY_NAMESPACE.keys()) | {"x", "p"}):
+        return None
+    return expr
+
+
+# Compiled numpy expressions, keyed by TF1 formula, so we only translate each once
+COMPILED_FORMULAE = {}
+
+
+def compile_formula(formula):
+    """Translate & compile a TF1 formula string, with true division as in ROOT
+    (so e.g. 1/2 is 0.5). Returns None if it can't be translated.
+
+    Results are cached in COMPILED_FORMULAE.
+    """
+    if formula not in COMPILED_FORMULAE:
+        expr = translate_formula(formula)
+        COMPILED_FORMULAE[formula] = None if expr is None else \
+            compile(expr, "<%s>" % formula, "eval", __future__.division.compiler_flag, True)
+    return COMPILED_FORMULAE[formula]
+
+
+def compile_numpy_function(func):
+    """Compile the formula of a TF1 into a function that evaluates it
+    on a numpy array, using the current parameters of func each time.
+
+    Returns None if the formula can't be translated (or func isn't a TF1).
+    """
+    if not hasattr(func, "GetExpFormula"):
+        return None
+    code = compile_formula(str(func.GetExpFormula()))
+    if code is None:
+        return None
+
+    def evaluate(x):
+        namespace = dict(NUMPY_NAMESPACE)
+        namespace["x"] = x
+        namespace["p"] = np.array([func.GetParameter(i) for i in range(func.GetNpar())])
+        with np.errstate(all="ignore"):
+            # + zeros so that constant formulae still give an array
+            return eval(code, {"__builtins__": {}}, namespace) + np.zeros_like(x)
+
+    return evaluate
+
+
+def eval_array(func, x):
+    """Evaluate any TF1-like object over a numpy array of x values.
+
+    Uses MultiFunc.eval_array() or a numpy translation of the TF1 formula
+    where possible, otherwise falls back to calling func.Eval() per value.
+    """
+    x = np.asarray(x, dtype=float)
+    if isinstance(func, MultiFunc):
+        return func.eval_array(x)
+    kernel = compile_numpy_function(func)
+    if kernel is not None:
+        return kernel(x)
+    return np.array([func.Eval(xi) for xi in x], dtype=float)
+
+
 class MultiFunc(object):
     """Class to handle using different TF1s over different ranges.
 
@@ -33,13 +216,75 @@ class MultiFunc(object):
         """
         # Need a OrderedDict to keep ordered by application range
         self.functions_dict = OrderedDict(sorted(functions_dict.items(), key=lambda x: x[0][0]))
+        self._functions = self.functions_dict.values()
+        self._kernels = {}
+
+        # Split the x axis into intervals at all the range limits, and store
+        # which function applies in each one. Where ranges overlap, the first
+        # function (ordered by lower limit) applies, as in Eval().
+        # Intervals not covered by any function get -1.
+        self._boundaries = sorted(set([lim for lims in self.functions_dict.keys() for lim in lims]))
+        self._interval_func_index = []
+        for lower, upper in zip(self._boundaries[:-1], self._boundaries[1:]):
+            matches = [i for i, lim in enumerate(self.functions_dict.keys())
+                       if lim[0] <= lower and upper <= lim[1]]
+            self._interval_func_index.append(matches[0] if matches else -1)
+        self._interval_func_index = np.array(self._interval_func_index, dtype=int)
+
+    def _func_index(self, x):
+        """Return index of the function applicable for x, or -1 if none."""
+        interval = bisect_right(self._boundaries, x) - 1
+        if interval < 0 or interval >= len(self._interval_func_index):
+            return -1
+        return self._interval_func_index[interval]
 
     def Eval(self, x):
         """Emulate TF1.Eval() but will call the correct function,
         depending on which function is applicable for the value of x."""
-        if x >= self.functions_dict.keys()[-1][1] or x < self.functions_dict.keys()[0][0]:
+        ind = self._func_index(x)
+        if ind < 0:
+            raise RuntimeError('x is beyond the limit of your MultiFunc range')
+        return self._functions[ind].Eval(x)
+
+    def eval_array(self, x):
+        """Evaluate the complete function over a numpy array of x values.
+
+        The applicable function for each x is found with one np.searchsorted
+        over the range limits. Each function is then evaluated on all of its
+        x values in one go, using a numpy translation of its formula
+        (falling back to Eval() per value if the formula can't be translated).
+
+        Parameters
+        ----------
+        x : numpy.array
+            Values to evaluate function at
+
+        Returns
+        -------
+        numpy.array
+            Function values, same shape as x
+        """
+        x = np.asarray(x, dtype=float)
+        interval = np.searchsorted(self._boundaries, x, side='right') - 1
+        valid = (interval >= 0) & (interval < len(self._interval_func_index))
+        func_index = np.full(x.shape, -1, dtype=int)
+        func_index[valid] = self._interval_func_index[interval[valid]]
+        if np.any(func_index < 0):
             raise RuntimeError('x is beyond the limit of your MultiFunc range')
-        return [func for lim, func in self.functions_dict.iteritems() if lim[0] <= x < lim[1]][0].Eval(x)
+
+        result = np.empty(x.shape, dtype=float)
+        for ind, func in enumerate(self._functions):
+            mask = func_index == ind
+            if not np.any(mask):
+                continue
+            if ind not in self._kernels:
+                self._kernels[ind] = compile_numpy_function(func)
+            kernel = self._kernels[ind]
+            if kernel is not None:
+                result[mask] = kernel(x[mask])
+            else:
+                result[mask] = [func.Eval(xi) for xi in x[mask]]
+        return result
 
     def Draw(self, draw_args=None, draw_range=None):
         """Draw the complete function.
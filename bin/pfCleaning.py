@@ -61,13 +61,15 @@ def plot_cumulative_energy(tree, cut=None, title='Cumulative Energy Fraction',
         c.SetLogy()
     leg = generate_legend(x1=0.4, x2=0.6)
     stack = ROOT.THStack('hst', '')
-    for i in range(len(fractions)):
-        var = '+'.join(fractions[:i+1])
+    variables = ['+'.join(fractions[:i+1]) for i in range(len(fractions))]
+    columns = cu.get_tree_columns_cached(tree, variables)
+    selected = cu.get_tree_selection_cached(tree, cut)
+    for i, var in enumerate(variables):
         hname = 'h' + ''.join(fractions[:i+1])
         nbins, fmin, fmax = 60, 0, 1.2
-        # h = ROOT.TH1F(hname, '', nbins, fmin, fmax)
-        tree.Draw('%s>>%s(%d, %f, %f)' % (var, hname, nbins, fmin, fmax), cut)
-        h = ROOT.gROOT.FindObject(hname)
+        h = ROOT.TH1F(hname, '', nbins, fmin, fmax)
+        ROOT.SetOwnership(h, False)
+        cu.fill_hist_arrays(h, columns[var][selected])
         h.SetFillColor(binning.eta_bin_colors[i])
         h.SetLineColor(binning.eta_bin_colors[i])
         h.SetFillStyle(1001)
@@ -105,6 +107,8 @@ def plot_energy_Vs_var(pairs_tree, var, var_min=0, var_max=10, var_title=None,
     c = generate_canvas(width=600*ncol, height=600*nrow)
     c.Divide(ncol, nrow)
     hists = []
+    columns = cu.get_tree_columns_cached(pairs_tree, [var] + fractions)
+    selected = cu.get_tree_selection_cached(pairs_tree, cut)
     for i, fraction in enumerate(fractions):
         c.cd(i+1)
         ROOT.gPad.SetTicks(1, 1)
@@ -116,11 +120,11 @@ def plot_energy_Vs_var(pairs_tree, var, var_min=0, var_max=10, var_title=None,
         # nbins_var = (var_max - var_min) / 0.05
         nbins_var = 100
         nbins_frac, fmin, fmax = 200, 0, 1.2
-        pairs_tree.Draw('%s:%s>>%s(%d, %f, %f, %d, %f, %f)' % (fraction, var, hname,
-                                                               nbins_var, var_min, var_max,
-                                                               nbins_frac, fmin, fmax),
-                        cut, 'GOFF' if normX else 'COLZ')
-        h = ROOT.gROOT.FindObject(hname)
+        h = ROOT.TH2F(hname, '', nbins_var, var_min, var_max, nbins_frac, fmin, fmax)
+        ROOT.SetOwnership(h, False)
+        cu.fill_hist_arrays(h, columns[var][selected], columns[fraction][selected])
+        if not normX:
+            h.Draw('COLZ')
         h.SetTitle('%s;%s;%s Energy Fraction' % (title, var_title, sources[i]))
         h.SetTitleOffset(1.2, 'XY')
         if normX:
@@ -153,6 +157,8 @@ def plot_mult_Vs_var(pairs_tree, var, var_min=0, var_max=10, var_title=None,
     c = generate_canvas(width=600*ncol, height=600*nrow)
     c.Divide(ncol, nrow)
     hists = []
+    columns = cu.get_tree_columns_cached(pairs_tree, [var] + multiplicities)
+    selected = cu.get_tree_selection_cached(pairs_tree, cut)
     for i, mult in enumerate(multiplicities):
         c.cd(i+1)
         ROOT.gPad.SetTicks(1, 1)
@@ -164,11 +170,11 @@ def plot_mult_Vs_var(pairs_tree, var, var_min=0, var_max=10, var_title=None,
         # nbins_var = (var_max - var_min) / 0.05
         nbins_var = 100
         nbins_mult, mult_min, mult_max = 20, 0, 20
-        pairs_tree.Draw('%s:%s>>%s(%d, %f, %f, %d, %f, %f)' % (mult, var, hname,
-                                                               nbins_var, var_min, var_max,
-                                                               nbins_mult, mult_min, mult_max),
-                        cut, 'GOFF' if normX else 'COLZ')
-        h = ROOT.gROOT.FindObject(hname)
+        h = ROOT.TH2F(hname, '', nbins_var, var_min, var_max, nbins_mult, mult_min, mult_max)
+        ROOT.SetOwnership(h, False)
+        cu.fill_hist_arrays(h, columns[var][selected], columns[mult][selected])
+        if not normX:
+            h.Draw('COLZ')
         h.SetTitle('%s;%s;%s Multiplicity' % (title, var_title, sources[i]))
         h.SetTitleOffset(1.2, 'XY')
         if normX:
@@ -198,12 +204,16 @@ def plot_l1_pf(pairs_tree,
 
     nbins_pt, pt_min, pt_max = 200, 0, 400
 
+    columns = cu.get_tree_columns_cached(pairs_tree, ['ptRef', 'pt'])
+    pass_cut = cu.get_tree_selection_cached(pairs_tree, cut)
+    pass_cleaning = cu.get_tree_selection_cached(pairs_tree, cleaning_cut)
+
     # With cleaning cut
     hname = 'hpt_ptref_cleaning'
-    pairs_tree.Draw("pt:ptRef>>%s(%d, %f, %f, %d, %f, %f)" % (hname, nbins_pt, pt_min, pt_max, nbins_pt, pt_min, pt_max),
-                    total_cut,
-                    "COLZ")
-    h = ROOT.gROOT.FindObject(hname)
+    h = ROOT.TH2F(hname, '', nbins_pt, pt_min, pt_max, nbins_pt, pt_min, pt_max)
+    selected = pass_cut & pass_cleaning
+    cu.fill_hist_arrays(h, columns['ptRef'][selected], columns['pt'][selected])
+    h.Draw("COLZ")
     h.SetTitle('%s;p_{T}^{PF} [GeV];p_{T}^{L1} [GeV]' % total_cut)
     h.SetTitleOffset(1.2, 'XY')
     draw_diag_rsp(pt_max)
@@ -213,10 +223,10 @@ def plot_l1_pf(pairs_tree,
         # Inverse of cleaning cut
         inv_cut = '(%s) && !(%s)' % (cut, cleaning_cut)
         hname = 'hpt_ptref_cleaning_diff'
-        pairs_tree.Draw("pt:ptRef>>%s(%d, %f, %f, %d, %f, %f)" % (hname, nbins_pt, pt_min, pt_max, nbins_pt, pt_min, pt_max),
-                        inv_cut,
-                        "COLZ")
-        h = ROOT.gROOT.FindObject(hname)
+        h = ROOT.TH2F(hname, '', nbins_pt, pt_min, pt_max, nbins_pt, pt_min, pt_max)
+        selected = pass_cut & ~pass_cleaning
+        cu.fill_hist_arrays(h, columns['ptRef'][selected], columns['pt'][selected])
+        h.Draw("COLZ")
         h.SetTitle('%s;p_{T}^{PF} [GeV];p_{T}^{L1} [GeV]' % inv_cut)
         h.SetTitleOffset(1.2, 'XY')
         draw_diag_rsp(pt_max)
@@ -274,12 +284,16 @@ def plot_rsp_pt(pairs_tree,
     nbins_pt = 200
     nbins_rsp, rsp_min, rsp_max = 100, 0, 5
 
+    columns = cu.get_tree_columns_cached(pairs_tree, [pt_var, 'rsp'])
+    pass_cut = cu.get_tree_selection_cached(pairs_tree, cut)
+    pass_cleaning = cu.get_tree_selection_cached(pairs_tree, cleaning_cut)
+
     # With cleaning cut
     hname = 'hrsp_pt'
-    pairs_tree.Draw("rsp:%s>>%s(%d, %f, %f, %d, %f, %f)" % (pt_var, hname, nbins_pt, pt_min, pt_max, nbins_rsp, rsp_min, rsp_max),
-                    total_cut,
-                    "COLZ")
-    h = ROOT.gROOT.FindObject(hname)
+    h = ROOT.TH2F(hname, '', nbins_pt, pt_min, pt_max, nbins_rsp, rsp_min, rsp_max)
+    selected = pass_cut & pass_cleaning
+    cu.fill_hist_arrays(h, columns[pt_var][selected], columns['rsp'][selected])
+    h.Draw("COLZ")
     h.SetTitle('%s;%s;response (p_{T}^{L1} / p_{T}^{PF})' % (total_cut, pt_title))
     h.SetTitleOffset(1.2, 'XY')
     if normX:
@@ -292,10 +306,10 @@ def plot_rsp_pt(pairs_tree,
         # Inverse of cleaning cut
         inv_cut = '(%s) && !(%s)' % (cut, cleaning_cut)
         hname = 'hrsp_pt_diff'
-        pairs_tree.Draw("rsp:%s>>%s(%d, %f, %f, %d, %f, %f)" % (pt_var, hname, nbins_pt, pt_min, pt_max, nbins_rsp, rsp_min, rsp_max),
-                        inv_cut,
-                        "COLZ")
-        h = ROOT.gROOT.FindObject(hname)
+        h = ROOT.TH2F(hname, '', nbins_pt, pt_min, pt_max, nbins_rsp, rsp_min, rsp_max)
+        selected = pass_cut & ~pass_cleaning
+        cu.fill_hist_arrays(h, columns[pt_var][selected], columns['rsp'][selected])
+        h.Draw("COLZ")
         h.SetTitle('%s;%s;response (p_{T}^{L1} / p_{T}^{PF})' % (total_cut, pt_title))
         h.SetTitleOffset(1.2, 'XY')
         if normX:
@@ -19,7 +19,8 @@ from matplotlib.figure import Figure
 import os
 from math import *
 import numpy as np
-import random
+import threading
+import Queue
 import ROOT
 import common_utils as cu
 import sys
@@ -113,11 +114,14 @@ def draw_reference_graph(axes, x, y, err_x, err_y):
 
 
 def plot_fit_func(axes, et, params):
-    """Plot the fit function on an Axes object"""
-    axes.plot(et, pf_func(et, params), lw=2, color='red', label='PF function')
-    axes.plot(et, pf_1(et, params), lw=1, color='blue', label='p0')
-    axes.plot(et, pf_2(et, params), lw=1, color='green', label='p1/((log(et))^2 + p2)')
-    axes.plot(et, pf_3(et, params), lw=1, color='orange', label='p3 * exp[-p4 * (log(et)-p5)^2]')
+    """Plot the fit function on an Axes object.
+
+    Returns the lines for the function & its components, in the same order as FIT_LINE_FUNCS.
+    """
+    lines = [axes.plot(et, pf_func(et, params), lw=2, color='red', label='PF function')[0],
+             axes.plot(et, pf_1(et, params), lw=1, color='blue', label='p0')[0],
+             axes.plot(et, pf_2(et, params), lw=1, color='green', label='p1/((log(et))^2 + p2)')[0],
+             axes.plot(et, pf_3(et, params), lw=1, color='orange', label='p3 * exp[-p4 * (log(et)-p5)^2]')[0]]
     axes.axis([et_min, et_max, y_min, y_max])
     axes.set_xlabel("ET")
     axes.set_ylabel("Correction Factor")
@@ -125,6 +129,10 @@ def plot_fit_func(axes, et, params):
     axes.grid(b=True, which='both')
     axes.legend(fontsize=10, loc=0)
     axes.set_title("p0 + (p1 / ((log10(et))^2 + p2)) + p3 * exp(-p4 * (np.log10(et) - p5)^2)", fontsize=12, y=1.04)
+    return lines
+
+
+FIT_LINE_FUNCS = [pf_func, pf_1, pf_2, pf_3]
 
 
 fig = Figure(figsize=(7, 7))
@@ -133,7 +141,7 @@ axes = fig.add_subplot(111)
 y_min, y_max = 0, 2.5
 
 draw_reference_graph(axes, graph_x, graph_y, graph_errx, graph_erry)
-plot_fit_func(axes, et, params)
+fit_lines = plot_fit_func(axes, et, params)
 
 #############
 # Setup frames
@@ -188,7 +196,7 @@ def update_plot(event):
         params[i] = slider.get() * float(box.get())
     # this retains whatever the current axes limits are,
     # incase the user zoomed/transposed
-    global y_min, y_max, et_min, et_max
+    global y_min, y_max, et_min, et_max, fit_lines
     # global y_max
     # global et_min
     # global et_max
@@ -196,8 +204,11 @@ def update_plot(event):
     et_min, et_max = axes.get_xlim()
     axes.clear()
     draw_reference_graph(axes, graph_x, graph_y, graph_errx, graph_erry)
-    plot_fit_func(axes, et, params)
-    canvas.draw()
+    fit_lines = plot_fit_func(axes, et, params)
+    if fit_state['thread']:
+        save_fit_background()
+    else:
+        canvas.draw()
 
 
 def validate_float(contents):
@@ -343,82 +354,248 @@ label_end.pack(side=Tk.LEFT)
 box_end.pack(side=Tk.LEFT)
 
 
-def calc_penalty(params, min_x, max_x):
+def calc_penalty(params, graph, min_x, max_x):
     """Calculates a penalty that is proportional to the 'distance' between
     the graph and the function. Based on chi2, but with a sign to indicate
-    on average whether the new function is above or below the graph. """
-    pen = 0
-    sign = 0
-    counter = 0
-    for i, (x_pt, y_pt, yerr) in enumerate(zip(graph_x, graph_y, graph_erry)):
-        if min_x < x_pt < max_x:
-            counter += 1
-            y_new = pf_func(x_pt, params)
-            pen += pow(y_new - y_pt, 2)/pow(yerr, 2)
-            sign += (y_new - y_pt)/abs(y_new - y_pt)
-    sign = sign/abs(sign)
-    return sign * np.sqrt(pen) / counter
-
-
-def generate_new_params(prev_params):
-    new_params = prev_params[:]
-    for i, p in enumerate(new_params):
-        if random.random() > 0.5:
-            new_params[i] += (random.random()/1. * p)
-        else:
-            new_params[i] -= (random.random()/1. * p)
-    return new_params
+    on average whether the new function is above or below the graph.
+
+    graph is a tuple of np.arrays (x, y, y errors).
+    Raises ValueError if there are no graph points with min_x < x < max_x.
+    """
+    x, y, yerr = graph
+    mask = (min_x < x) & (x < max_x)
+    if not mask.any():
+        raise ValueError("No graph points with %g < ET < %g" % (min_x, max_x))
+    diff = pf_func(x[mask], params) - y[mask]
+    pen = np.sum(np.power(diff / yerr[mask], 2))
+    sign = np.sum(np.sign(diff))
+    sign = -1 if sign < 0 else 1
+    return sign * np.sqrt(pen) / np.count_nonzero(mask)
 
 
 def sensibility_check(params):
     """Check no poles nor goes negative"""
     y = pf_func(et, params)
-    pair_diff = np.array([abs(y-x) for x,y in zip(y[:-1], y[1:])])
-    return np.min(y) > 0 and np.max(y) < 5# and np.max(pair_diff) < 2
+    return np.min(y) > 0 and np.max(y) < 5
+
+
+class StopFit(Exception):
+    """Raised to stop the fit early (e.g. user pressed Stop)"""
+    pass
+
+
+def nelder_mead_fit(start_params, penalty, finish_condition, progress,
+                    max_iter=20000, tolerance=1E-10, max_restarts=50):
+    """Minimise abs(penalty) with the Nelder-Mead simplex method,
+    treating non-sensible params as infinitely bad.
+
+    The simplex often collapses before reaching the minimum, so once it
+    has converged we restart from the best point, until a restart no longer
+    improves things by more than 0.1%.
+
+    Parameters
+    ----------
+    start_params : list[float]
+        Starting parameters
+    penalty : function
+        Function of the params, as calc_penalty
+    finish_condition : float
+        Stop once abs(penalty) is below this.
+    progress : function
+        Called with (params, penalty) every time the best params improve.
+    max_iter : int, optional
+        Max number of iterations per restart.
+    tolerance : float, optional
+        The simplex has converged when the relative spread in abs(penalty)
+        over it is below this.
+    max_restarts : int, optional
+        Max number of restarts.
+
+    Returns
+    -------
+    list[float], float, bool
+        Best params, their penalty, and whether abs(penalty) < finish_condition
+    """
+    def objective(p):
+        if not sensibility_check(p):
+            return np.inf
+        return abs(penalty(p))
+
+    best_params = np.array(start_params, dtype=float)
+    best = objective(best_params)
+
+    for restart in xrange(max_restarts + 1):
+        if best < finish_condition:
+            break
+        restart_best = best
+
+        # starting simplex steps each param by 5% of its value, since they have very different scales
+        simplex = [best_params]
+        for i in range(len(best_params)):
+            point = best_params.copy()
+            point[i] = point[i] * 1.05 if point[i] != 0 else 0.00025
+            simplex.append(point)
+        simplex = np.array(simplex)
+        values = np.array([objective(p) for p in simplex])
+
+        for _ in xrange(max_iter):
+            order = np.argsort(values)
+            simplex, values = simplex[order], values[order]
+            if values[0] < best:
+                best_params, best = simplex[0].copy(), values[0]
+                progress(list(best_params), penalty(best_params))
+            if (best < finish_condition or not np.isfinite(values[0])
+                    or abs(values[-1] - values[0]) <= tolerance * abs(values[0])):
+                break
+
+            centroid = simplex[:-1].mean(axis=0)
+            reflected = centroid + (centroid - simplex[-1])
+            f_reflected = objective(reflected)
+            if f_reflected < values[0]:
+                expanded = centroid + 2 * (centroid - simplex[-1])
+                f_expanded = objective(expanded)
+                if f_expanded < f_reflected:
+                    simplex[-1], values[-1] = expanded, f_expanded
+                else:
+                    simplex[-1], values[-1] = reflected, f_reflected
+            elif f_reflected < values[-2]:
+                simplex[-1], values[-1] = reflected, f_reflected
+            else:
+                # contract, towards the better of the worst & reflected points
+                if f_reflected < values[-1]:
+                    contracted = centroid + 0.5 * (reflected - centroid)
+                else:
+                    contracted = centroid + 0.5 * (simplex[-1] - centroid)
+                f_contracted = objective(contracted)
+                if f_contracted < min(f_reflected, values[-1]):
+                    simplex[-1], values[-1] = contracted, f_contracted
+                else:
+                    # shrink everything towards the best point
+                    simplex[1:] = simplex[0] + 0.5 * (simplex[1:] - simplex[0])
+                    values[1:] = [objective(p) for p in simplex[1:]]
+
+        if not np.isfinite(best) or best > 0.999 * restart_best:
+            break
+
+    best_penalty = penalty(best_params)
+    return list(best_params), best_penalty, abs(best_penalty) < finish_condition
+
+
+# Fitting is done in a background thread, so the GUI doesn't freeze.
+# It sends progress back through fit_queue, as (params, penalty, finished, converged),
+# which the GUI polls every FIT_POLL_MS. Only the latest params get drawn.
+FIT_POLL_MS = 100
+fit_queue = Queue.Queue()
+fit_stop = threading.Event()
+fit_state = {'thread': None, 'background': None}
+
+
+def fit_worker(start_params, graph, min_x, max_x, finish_condition):
+    """Run the fit, putting progress into fit_queue. Must not touch any Tk objects."""
+    def penalty(p):
+        if fit_stop.is_set():
+            raise StopFit()
+        return calc_penalty(p, graph, min_x, max_x)
+
+    # best so far, in case we get stopped
+    best = {'params': start_params, 'penalty': calc_penalty(start_params, graph, min_x, max_x)}
+
+    def progress(p, pen):
+        best['params'], best['penalty'] = p, pen
+        fit_queue.put((p[:], pen, False, False))
+
+    try:
+        new_params, new_penalty, converged = nelder_mead_fit(start_params, penalty, finish_condition, progress)
+    except StopFit:
+        new_params, new_penalty, converged = best['params'], best['penalty'], False
+    fit_queue.put((new_params, new_penalty, True, converged))
+
+
+def save_fit_background():
+    """Draw the plot without the fit lines, and save it, so we can just redraw the lines on top"""
+    for line in fit_lines:
+        line.set_animated(True)
+    canvas.draw()
+    fit_state['background'] = canvas.copy_from_bbox(axes.bbox)
+
+
+def draw_fit_lines(new_params):
+    """Redraw just the fit lines with new_params, by blitting over the saved background"""
+    for line, func in zip(fit_lines, FIT_LINE_FUNCS):
+        line.set_ydata(func(et, new_params))
+    canvas.restore_region(fit_state['background'])
+    for line in fit_lines:
+        axes.draw_artist(line)
+    canvas.blit(axes.bbox)
+
+
+def poll_fit():
+    """Take latest progress from the fit thread, and update the plot & labels"""
+    latest = None
+    while True:
+        try:
+            latest = fit_queue.get_nowait()
+        except Queue.Empty:
+            break
+
+    if latest is None:
+        root.after(FIT_POLL_MS, poll_fit)
+        return
+
+    new_params, new_penalty, finished, converged = latest
+    if not finished:
+        label_curr.config(text="Current chi2: %.3f" % abs(new_penalty))
+        draw_fit_lines(new_params)
+        root.after(FIT_POLL_MS, poll_fit)
+        return
+
+    # fit is over: put everything back to normal
+    for line in fit_lines:
+        line.set_animated(False)
+    fit_state['thread'] = None
+    fit_button.config(text='Fit')
+
+    print 'new params:', new_params
+    print 'new penalty:', new_penalty
+    label_curr.config(text="Current chi2: %.3f" % abs(new_penalty))
+    for slider, box, param in zip(sliders, multiplier_boxes, new_params):
+        set_slider_box_values(slider, box, param)
+    update_plot(None)
+    if fit_stop.is_set():
+        print "Fitting stopped"
+    elif converged:
+        print "Finished fitting"
+        tkMessageBox.showinfo("Done", "Finished fitting\nFinal penalty: %f" % abs(new_penalty))
+    else:
+        print "Got stuck, please try again"
+        tkMessageBox.showwarning("Fit stalled", "Fitter got stuck, please try again")
 
 
 def approx_fit():
-    """Do some Markov Chain type fitting to get a very rough approximation"""
+    """Start fitting in the background, or stop it if it is already running"""
+    if fit_state['thread']:
+        fit_stop.set()
+        return
 
-    old_params = params[:]
     min_x = float(box_min.get())
     max_x = float(box_max.get())
     finish_condition = abs(float(box_end.get()))
-    old_penalty = calc_penalty(old_params, min_x, max_x)
-    found_fit = abs(old_penalty) < finish_condition
-    stuck_counter = 0
-
-    while not found_fit:
-        if stuck_counter % 10000 == 0 and stuck_counter > 0:
-            print "May be getting stuck...", stuck_counter
-
-        new_params = generate_new_params(old_params)
-        new_penalty = calc_penalty(new_params, min_x, max_x)
-        if abs(new_penalty) < abs(old_penalty) and sensibility_check(new_params):
-            print "Move"
-            print 'old params:', old_params
-            print 'new params:', new_params
-            print 'old penalty:', old_penalty
-            print 'new penalty:', new_penalty
-            old_params, old_penalty = new_params[:], new_penalty
-            for slider, box, param in zip(sliders, multiplier_boxes, new_params):
-                set_slider_box_values(slider, box, param)
-            stuck_counter = 0
-            update_plot(None)
-        else:
-            stuck_counter += 1
-
-        # finishing condition
-        if abs(new_penalty) < finish_condition:
-            print "Finished fitting"
-            tkMessageBox.showinfo("Done", "Finished fitting\nFinal penalty: %f" % abs(new_penalty))
-            found_fit = True
-
-        if stuck_counter == 100000:
-            print "Got stuck, please try again"
-            tkMessageBox.showwarning("Fit stalled", "Fitter got stuck, please try again")
-            stuck_counter = 0
-            break
+    graph = (np.array(graph_x, dtype=float), np.array(graph_y, dtype=float),
+             np.array(graph_erry, dtype=float))
+    try:
+        calc_penalty(params, graph, min_x, max_x)
+    except ValueError as e:
+        tkMessageBox.showwarning("Bad fit range", str(e))
+        return
+
+    save_fit_background()
+    fit_stop.clear()
+    fit_state['thread'] = threading.Thread(target=fit_worker,
+                                           args=(params[:], graph, min_x, max_x, finish_condition))
+    fit_state['thread'].daemon = True
+    fit_state['thread'].start()
+    fit_button.config(text='Stop')
+    root.after(FIT_POLL_MS, poll_fit)
 
 
 fit_button = Tk.Button(fit_frame, text='Fit', command=approx_fit)
@@ -4,6 +4,7 @@ Short script to quick make response histograms, binned by eta.
 """
 
 import ROOT
+import numpy as np
 import binning
 import common_utils as cu
 
@@ -18,6 +19,10 @@ ROOT.TH1.SetDefaultSumw2(True)
 def make_plot_eta_binned(input_filename, output_filename, title=''):
     f = cu.open_root_file(input_filename)
     tree = cu.get_from_file(f, 'valid')
+    columns = cu.get_tree_columns_cached(tree, ["rsp", "eta", "numPUVertices"])
+    abs_eta = np.abs(columns["eta"])
+    pu = columns["numPUVertices"]
+    pu_cut = (pu < 25) & (pu > 15)
 
     hists = []
 
@@ -26,7 +31,8 @@ def make_plot_eta_binned(input_filename, output_filename, title=''):
     for i, (eta_min, eta_max) in enumerate(binning.pairwise(eta_bins)):
         hname = "h_%g_%g" % (eta_min, eta_max)
         h = ROOT.TH1D(hname, title + " PU15 - 25;response;p.d.f", 30, 0, 3)
-        tree.Draw("rsp>>%s" % hname, "%g < TMath::Abs(eta) && TMath::Abs(eta) < %g && numPUVertices<25 && numPUVertices >15" % (eta_min, eta_max))
+        selected = pu_cut & (abs_eta > eta_min) & (abs_eta < eta_max)
+        cu.fill_hist_arrays(h, columns["rsp"][selected])
         h.SetLineColor(binning.eta_bin_colors[i])
         h.SetLineWidth(2)
         h.Scale(1. / h.Integral())
@@ -19,8 +19,15 @@ import os
 import sys
 import numpy as np
 import argparse
+import multiprocessing
+import time
+import json
+import hashlib
+import inspect
+from collections import namedtuple
 import binning
 from binning import pairwise
+from multifunc import eval_array
 import common_utils as cu
 from math import sqrt, log
 
@@ -120,32 +127,29 @@ def generate_eta_graph_name(absetamin, absetamax):
     return "l1corr_eta_%g_%g" % (absetamin, absetamax)
 
 
-def get_hist_bin_contents(hist):
-    return np.array([hist.GetBinContent(i) for i in range(1, hist.GetNbinsX() + 1)])
+def do_gauss_response_hist_fit(hrsp, fits=None, fit_ind=0):
+    """Fit Gaussian function to response histogram, within mean +- 1 RMS.
 
+    The fit is done with common_utils.fit_gaussian_slices(). To fit many
+    response hists at once, call that on all of their bin contents first, and
+    pass the result in as fits, with fit_ind the index of this hist.
 
-def do_gauss_response_hist_fit(hrsp):
-    """Fit Gaussian function to response histogram."""
+    The fitted function is added to the hist, as if it had been done with
+    hrsp.Fit("gaus"). If the fit fails, the raw mean is used instead.
+    """
     # but only if we have a sensible number of entries
     fitStatus = -1
     mean = -999
     err = -999
     if hrsp.GetEntries() >= 3:
-        # Try the fit mutliple times, beacuse it can converge on the 2nd or 3rd
-        # iteration but not on the 1st...
-        fit_counter = 3
-        while fitStatus != 0 and fit_counter > 0:
-            fitStatus = int(hrsp.Fit("gaus", "QER", "",
-                                     hrsp.GetMean() - 1. * hrsp.GetRMS(),
-                                     hrsp.GetMean() + 1. * hrsp.GetRMS()))
-            # fitStatus = int(hrsp.Fit("burr", "QER", "", 0, 2))
-            fit_counter -= 1
-            if fitStatus == 0:
-                mean = hrsp.GetFunction("gaus").GetParameter(1)
-                err = hrsp.GetFunction("gaus").GetParError(1)
-                # mean = hrsp.GetFunction("burr").GetMaximumX()
-                # err = hrsp.GetMeanError()
-                break
+        if fits is None:
+            fits = cu.fit_gaussian_slices(cu.get_hist_contents(hrsp), cu.get_hist_edges(hrsp))
+            fit_ind = 0
+        fitStatus = int(fits['status'][fit_ind])
+        if fitStatus == 0:
+            mean = fits['mean'][fit_ind]
+            err = fits['mean_err'][fit_ind]
+            cu.make_gaussian_fit_function(fits, fit_ind, hist=hrsp)
 
     # check if we have a bad fit - either fit status != 0, or
     # fit mean is not close to raw mean. in either case use raw mean
@@ -253,9 +257,32 @@ def do_burr_response_hist_fit(hrsp, setup_fn):
     return mode, err
 
 
+def load_pair_columns(inputfile, use_cache=True):
+    """Read the pair quantities needed for calibration from the "valid" TTree
+    into numpy arrays, so the tree only has to be read once.
+
+    inputfile: TFile. Must contain TTree named "valid", full of pair quantities.
+
+    use_cache: bool. If True, use (and make) a column cache next to the
+    input file, so later runs don't have to read the tree at all.
+    See common_utils.get_tree_columns_cached()
+
+    Returns a dict of branch name : np.array. numPUVertices is only included
+    if it exists in the tree.
+    """
+    tree_raw = cu.get_from_file(inputfile, "valid")
+    branches = ["pt", "ptRef", "eta", "rsp"]
+    if hasattr(tree_raw, "numPUVertices"):
+        branches.append("numPUVertices")
+    print "Reading columns", branches, "from", inputfile.GetName()
+    if use_cache:
+        return cu.get_tree_columns_cached(tree_raw, branches)
+    return cu.get_tree_columns(tree_raw, branches)
+
+
 def make_correction_curves(inputfile, outputfile, ptBins_in, absetamin, absetamax,
                            fitfcn, do_genjet_plots, do_correction_fit,
-                           pu_min, pu_max, do_burr):
+                           pu_min, pu_max, do_burr, columns=None):
     """
     Do all the relevant hists and fitting, for one eta bin.
 
@@ -291,60 +318,70 @@ def make_correction_curves(inputfile, outputfile, ptBins_in, absetamin, absetama
 
     do_burr: bool. If True, use Burr fn to fit response histograms.
     The default is to use a Gaussian.
+
+    columns: dict, optional. Pair quantities from load_pair_columns(). If None,
+    they are read from inputfile. Pass them in when doing several eta bins,
+    so the tree is only read once.
     """
 
     print "Doing PU range: %g - %g" % (pu_min, pu_max)
     print "Running over pT bins:", ptBins_in
 
-    # Input tree
-    tree_raw = cu.get_from_file(inputfile, "valid")
+    if columns is None:
+        columns = load_pair_columns(inputfile)
 
     # Output folders
     output_f = outputfile.mkdir('eta_%g_%g' % (absetamin, absetamax))
     output_f_hists = output_f.mkdir("Histograms")
 
-    # Eta cut string
-    eta_cut = ROOT.TCut("TMath::Abs(eta)<%g && TMath::Abs(eta) > %g" % (absetamax, absetamin))
+    # Eta cut
+    eta_cut = "TMath::Abs(eta)<%g && TMath::Abs(eta) > %g" % (absetamax, absetamin)
+    abs_eta = np.abs(columns["eta"])
+    total_mask = (abs_eta < absetamax) & (abs_eta > absetamin)
 
-    # PU cut string
-    if hasattr(tree_raw, "numPUVertices"):
-        pu_cut = ROOT.TCut("numPUVertices >= %g && numPUVertices <= %g" % (pu_min, pu_max))
+    # PU cut
+    if "numPUVertices" in columns:
+        pu_cut = "numPUVertices >= %g && numPUVertices <= %g" % (pu_min, pu_max)
+        total_mask &= (columns["numPUVertices"] >= pu_min) & (columns["numPUVertices"] <= pu_max)
     else:
-        pu_cut = ROOT.TCut("")
+        pu_cut = ""
 
     # Avoid L1 saturated jets cut (from 2017 any l1 jet with a saturated tower is auto given pt=1024GeV)
-    avoidSaturation_cut = ROOT.TCut("pt < 1023.1")
+    avoidSaturation_cut = "pt < 1023.1"
+    total_mask &= columns["pt"] < 1023.1
 
     # Total cut
-    total_cut = ROOT.TCut(eta_cut)
-    total_cut += pu_cut  # need to use += and not && cos TCut all fubar
-    total_cut += avoidSaturation_cut
+    total_cut = " && ".join(["(%s)" % c for c in [eta_cut, pu_cut, avoidSaturation_cut] if c])
     print total_cut
 
-    # Draw response (pT^L1/pT^Gen) for all pt bins
-    tree_raw.Draw("rsp>>hrsp_eta_%g_%g(50,0,2)" % (absetamin, absetamax), total_cut, "goff")
-    hrsp_eta = ROOT.gROOT.FindObject("hrsp_eta_%g_%g" % (absetamin, absetamax))
-    hrsp_eta.SetTitle(";response (p_{T}^{L1}/p_{T}^{Ref});")
+    pt = columns["pt"][total_mask]
+    ptRef = columns["ptRef"][total_mask]
+    rsp = columns["rsp"][total_mask]
+
+    # Response (pT^L1/pT^Gen) for all pt bins
+    hrsp_eta = ROOT.TH1F("hrsp_eta_%g_%g" % (absetamin, absetamax),
+                         ";response (p_{T}^{L1}/p_{T}^{Ref});", 50, 0, 2)
+    cu.fill_hist_arrays(hrsp_eta, rsp)
     output_f_hists.WriteTObject(hrsp_eta)
 
     nb, pt_min, pt_max = 2048, 0, 1024
 
-    # Draw rsp (pT^L1/pT^Gen) Vs GenJet pT
-    tree_raw.Draw("rsp:ptRef>>h2d_rsp_gen(%d,%g,%g,150,0,5)" % (nb, pt_min, pt_max), total_cut, "goff")
-    h2d_rsp_gen = ROOT.gROOT.FindObject("h2d_rsp_gen")
-    h2d_rsp_gen.SetTitle(";p_{T}^{Ref} [GeV];response (p_{T}^{L1}/p_{T}^{Ref})")
+    # rsp (pT^L1/pT^Gen) Vs GenJet pT
+    h2d_rsp_gen = ROOT.TH2F("h2d_rsp_gen", ";p_{T}^{Ref} [GeV];response (p_{T}^{L1}/p_{T}^{Ref})",
+                            nb, pt_min, pt_max, 150, 0, 5)
+    cu.fill_hist_arrays(h2d_rsp_gen, ptRef, rsp)
     output_f_hists.WriteTObject(h2d_rsp_gen)
 
-    # Draw rsp (pT^L1/pT^Gen) Vs L1 pT
-    tree_raw.Draw("rsp:pt>>h2d_rsp_l1(%d,%g,%g,150,0,5)" % (nb, pt_min, pt_max), total_cut, "goff")
-    h2d_rsp_l1 = ROOT.gROOT.FindObject("h2d_rsp_l1")
-    h2d_rsp_l1.SetTitle(";p_{T}^{L1} [GeV];response (p_{T}^{L1}/p_{T}^{Ref})")
+    # rsp (pT^L1/pT^Gen) Vs L1 pT
+    h2d_rsp_l1 = ROOT.TH2F("h2d_rsp_l1", ";p_{T}^{L1} [GeV];response (p_{T}^{L1}/p_{T}^{Ref})",
+                           nb, pt_min, pt_max, 150, 0, 5)
+    cu.fill_hist_arrays(h2d_rsp_l1, pt, rsp)
     output_f_hists.WriteTObject(h2d_rsp_l1)
 
-    # draw pT^L1 Vs pT^Gen
-    tree_raw.Draw("pt:ptRef>>h2d_gen_l1(%d,%g,%g,%d,%g,%g)" % (nb, pt_min, pt_max, nb, pt_min, pt_max), total_cut, "goff")
-    h2d_gen_l1 = ROOT.gROOT.FindObject("h2d_gen_l1")
-    h2d_gen_l1.SetTitle(";p_{T}^{Ref} [GeV];p_{T}^{L1} [GeV]")
+    # pT^L1 Vs pT^Gen
+    h2d_gen_l1 = ROOT.TH2F("h2d_gen_l1", ";p_{T}^{Ref} [GeV];p_{T}^{L1} [GeV]",
+                           nb, pt_min, pt_max, nb, pt_min, pt_max)
+    cu.fill_hist_arrays(h2d_gen_l1, ptRef, pt)
     output_f_hists.WriteTObject(h2d_gen_l1)
 
     # Go through and find histogram bin edges that are closest to the input pt
@@ -360,6 +397,51 @@ def make_correction_curves(inputfile, outputfile, ptBins_in, absetamin, absetama
         ptBins.append(xlow)
     ptBins.append(xup)  # only need this last one
 
+    # Assign each pair to its pT^Gen bin, i.e. ptBins[i] < ptRef < ptBins[i+1],
+    # then sort pairs by bin so each bin is a contiguous slice.
+    # The L1 pT hists for all pT^Gen bins are then filled with one bincount.
+    n_pt_bins = len(ptBins) - 1
+    pt_bin_ind = np.searchsorted(ptBins, ptRef, side='left') - 1
+    ptBins_arr = np.array(ptBins)
+    in_pt_bin = ((pt_bin_ind >= 0) & (pt_bin_ind < n_pt_bins))
+    in_pt_bin[in_pt_bin] &= ptRef[in_pt_bin] < ptBins_arr[pt_bin_ind[in_pt_bin] + 1]
+    order = np.argsort(pt_bin_ind[in_pt_bin], kind='mergesort')
+    pt_bin_ind = pt_bin_ind[in_pt_bin][order]
+    pt_binned = pt[in_pt_bin][order]
+    ptRef_binned = ptRef[in_pt_bin][order]
+    slice_edges = np.searchsorted(pt_bin_ind, np.arange(n_pt_bins + 1), side='left')
+
+    hpt_nbins, hpt_min, hpt_max = 4000, 0, 2000
+    hpt_cells = hpt_nbins + 2
+    hpt_bins = cu.find_bins(pt_binned, hpt_nbins, hpt_min, hpt_max)
+    hpt_counts = np.bincount(pt_bin_ind * hpt_cells + hpt_bins,
+                             minlength=n_pt_bins * hpt_cells).reshape(n_pt_bins, hpt_cells)
+    hpt_in_range = (hpt_bins > 0) & (hpt_bins <= hpt_nbins)
+    hpt_sumw = np.bincount(pt_bin_ind[hpt_in_range], minlength=n_pt_bins)
+    hpt_sumwx = np.bincount(pt_bin_ind[hpt_in_range], weights=pt_binned[hpt_in_range],
+                            minlength=n_pt_bins)
+    hpt_sumwx2 = np.bincount(pt_bin_ind[hpt_in_range], weights=pt_binned[hpt_in_range]**2,
+                             minlength=n_pt_bins)
+
+    # Response hists for all pT^Gen bins, as one array of (pT^Gen bin, response bin) counts,
+    # so the Gaussian fits can be done all at once.
+    # Each pT^Gen bin covers h2d_rsp_gen x bins bin_indices[i][0] to bin_indices[i][1],
+    # the same as the ProjectionY below.
+    if not do_burr:
+        rsp_ax = h2d_rsp_gen.GetYaxis()
+        rsp_cells = rsp_ax.GetNbins() + 2
+        slice_of_xbin = np.full(nb + 2, -1, dtype=int)
+        for i, (bin1, bin2) in enumerate(bin_indices):
+            slice_of_xbin[bin1:bin2 + 1] = i
+        rsp_slice = slice_of_xbin[cu.find_bins(ptRef, nb, pt_min, pt_max)]
+        rsp_bins = cu.find_bins(rsp, rsp_ax.GetNbins(), rsp_ax.GetXmin(), rsp_ax.GetXmax())
+        in_slice = rsp_slice >= 0
+        rsp_counts = np.bincount(rsp_slice[in_slice] * rsp_cells + rsp_bins[in_slice],
+                                 minlength=n_pt_bins * rsp_cells).reshape(n_pt_bins, rsp_cells)
+        rsp_fits = cu.fit_gaussian_slices(rsp_counts[:, 1:-1],
+                                          np.linspace(rsp_ax.GetXmin(), rsp_ax.GetXmax(),
+                                                      rsp_ax.GetNbins() + 1))
+
     gr = ROOT.TGraphErrors()  # 1/<rsp> VS ptL1
     gr_gen = ROOT.TGraphErrors()  # 1/<rsp> VS ptGen
     grc = 0
@@ -374,10 +456,6 @@ def make_correction_curves(inputfile, outputfile, ptBins_in, absetamin, absetama
 
         bin1 = bin_indices[i][0]
         bin2 = bin_indices[i][1]
-        # h2d_calib.GetXaxis().FindBin(ptR)
-        # h2d_calib.GetXaxis().FindBin(ptBins[i+1])-1
-        # print "Binning mis-matches", ptR, ptBins[i+1],
-        # h2d_calib.GetXaxis().GetBinLowEdge(bin1),h2d_calib.GetXaxis().GetBinLowEdge(bin2+1)
 
         xlow = ptR
         xhigh = ptBins[i + 1]
@@ -386,18 +464,16 @@ def make_correction_curves(inputfile, outputfile, ptBins_in, absetamin, absetama
         hrsp = h2d_rsp_gen.ProjectionY("Rsp_genpt_%g_%g" % (xlow, xhigh), bin1, bin2)
 
         # cut on ref jet pt
-        pt_cut = ROOT.TCut("ptRef < %g && ptRef > %g " % (xhigh, xlow))
-        total_cut = ROOT.TCut(eta_cut)
-        total_cut += pu_cut
-        total_cut += avoidSaturation_cut
-        total_cut += pt_cut
-        print total_cut
+        pt_cut = "ptRef < %g && ptRef > %g " % (xhigh, xlow)
+        this_cut = "%s && (%s)" % (total_cut, pt_cut)
+        print this_cut
 
         # Plots of pT L1 for given pT Gen bin
-        tree_raw.Draw("pt>>hpt(4000, 0, 2000)", total_cut, "goff")
-        hpt = ROOT.gROOT.FindObject("hpt")
-        hpt.SetName("L1_pt_genpt_%g_%g" % (xlow, xhigh))
-        # hpt = h2d_gen_l1.ProjectionX("L1_pt_genpt_%g_%g" % (xlow, xhigh))
+        hpt = ROOT.TH1F("L1_pt_genpt_%g_%g" % (xlow, xhigh), "pt {%s}" % this_cut,
+                        hpt_nbins, hpt_min, hpt_max)
+        cu.set_hist_from_counts(hpt, hpt_counts[i],
+                                [hpt_sumw[i], hpt_sumw[i], hpt_sumwx[i], hpt_sumwx2[i]],
+                                slice_edges[i + 1] - slice_edges[i])
 
         if hrsp.GetEntries() <= 0 or hpt.GetEntries() <= 0:
             print "Skipping as 0 entries"
@@ -407,9 +483,9 @@ def make_correction_curves(inputfile, outputfile, ptBins_in, absetamin, absetama
 
         # Plots of pT Gen for given pT Gen bin
         if do_genjet_plots:
-            tree_raw.Draw("ptRef>>hpt_gen(200)", total_cut, "goff")
-            hpt_gen = ROOT.gROOT.FindObject("hpt_gen")
-            hpt_gen.SetName("gen_pt_genpt_%g_%g" % (xlow, xhigh))
+            hpt_gen = cu.make_auto_range_hist("gen_pt_genpt_%g_%g" % (xlow, xhigh),
+                                              "ptRef {%s}" % this_cut, 200,
+                                              ptRef_binned[slice_edges[i]:slice_edges[i + 1]])
             output_f_hists.WriteTObject(hpt_gen)
 
         # Fit to resposne hist to get mean response & error on mean
@@ -419,7 +495,7 @@ def make_correction_curves(inputfile, outputfile, ptBins_in, absetamin, absetama
             setup_fn = setup_burr3 if absetamin < 2 else setup_burr3_higherEta
             mean, err = do_burr_response_hist_fit(hrsp, setup_fn)
         else:
-            mean, err = do_gauss_response_hist_fit(hrsp)
+            mean, err = do_gauss_response_hist_fit(hrsp, rsp_fits, i)
 
         output_f_hists.WriteTObject(hrsp)
 
@@ -468,6 +544,86 @@ def make_correction_curves(inputfile, outputfile, ptBins_in, absetamin, absetama
     return fit_params
 
 
+# Hand-tuned fit ranges for troublesome eta bins (the "JOE_HACK"s), keyed by
+# lower eta bin edge. These override the automatic fit range in setup_fit().
+# max_ind/min_ind: indices of the graph points at the ends of the fit range,
+# fit_min: lower pT limit of the fit.
+# To tune another bin, add it here rather than in setup_fit(), e.g. we used to have
+# 2.5: dict(max_ind=80, fit_min=40.0, min_ind=0),
+FIT_RANGE_OVERRIDES = {
+    3.489: dict(max_ind=17, fit_min=40.0, min_ind=0),
+    4.191: dict(max_ind=16, fit_min=40.0, min_ind=0),
+}
+
+# Number of points to smooth the response gradient over when looking for the
+# turnover in setup_fit(). These are tried in order until a turnover is found.
+SMOOTHING_WINDOWS = range(5, 12)
+
+
+def moving_average(arr, n):
+    """Returns a np.array of moving-averages of array arr, where each
+    point in the returned array is the average of the consecutive n points
+    in the original array.
+
+    By definition, this will return an array of length len(arr) + 1 - n
+
+    This is done as one mean over a (read-only) strided view of all the
+    windows, which gives exactly the same values as taking np.mean() of
+    each window separately (unlike a convolution or cumulative sum,
+    which add up the values in a different order).
+    """
+    arr = np.asarray(arr, dtype=float)
+    if len(arr) < n:
+        return np.array([])
+    windows = np.lib.stride_tricks.as_strided(arr, shape=(len(arr) - n + 1, n),
+                                              strides=(arr.strides[0], arr.strides[0]),
+                                              writeable=False)
+    return windows.mean(axis=1)
+
+
+def calc_crossing(arr):
+    """Calculate value at which value the array crosses 0.
+
+    Looks at points in groups of 4, and finds the smallest group
+    where the first 2 points < 0, and the next 2 points > 0.
+    (The last group only has 3 points.)
+
+    This ignores values which peak above 0 for 1 point.
+
+    Returns the array (index, value) of the point closest to 0,
+    or (None, None) if there is no crossing.
+    """
+    arr = np.asarray(arr, dtype=float)
+    if len(arr) < 3:
+        return None, None
+    neg, pos = arr < 0, arr > 0
+    # crossing[j] is for the group starting at index j
+    crossing = neg[:-2] & neg[1:-1] & pos[2:] & np.append(pos[3:], True)
+    if not crossing.any():
+        return None, None
+    start = np.argmax(crossing)
+    group = np.concatenate((-1 * arr[start: start + 2], arr[start + 2: start + 4]))
+    return start + np.argmin(group), np.min(group)
+
+
+def find_turnover(xarr, grad, windows):
+    """Find where the smoothed gradient grad crosses 0 (i.e. the turnover).
+
+    The crossing is found for every smoothing window size in windows at once,
+    and the first one with a crossing is used.
+
+    Returns (window size, smoothed x values, index of crossing in the smoothed
+    arrays, smoothed gradient at crossing). If no window size gives a crossing,
+    returns the last window size & its smoothed x values, and None for the rest.
+    """
+    results = [(n, moving_average(xarr, n), calc_crossing(moving_average(grad, n)))
+               for n in windows]
+    for n, x_ave, (intercept_ind, intercept) in results:
+        if intercept_ind or intercept:
+            break
+    return n, x_ave, intercept_ind, intercept
+
+
 def setup_fit(graph, function, absetamin, absetamax, outputfile):
     """Setup for fitting (auto-calculate sensible range).
 
@@ -508,43 +664,10 @@ def setup_fit(graph, function, absetamin, absetamax, outputfile):
     # taking the gradient may not be enough (and give multiple points where
     # the gradient changes). To counter this, we smooth the gradient by
     # averaging over several points
-    def moving_average(arr, n):
-        """Returns a np.array of moving-averages of array arr, where each
-        point in the rerurned array is the average of the consecutive n points
-        in the original array.
-
-        By definition, this will return an array of length len(arr) + 1 - n
-        """
-        return np.array([np.mean(arr[i:i+n]) for i in range(0, len(arr) - n + 1)])
-
-    def calc_crossing(arr):
-        """Calculate value at which value the array crosses 0.
-
-        Looks at points in groups of 4, and finds the smallest group
-        where the first 2 points < 0, and the next 2 points > 0.
-
-        This ignores values which peak above 0 for 1 point.
-
-        Returns the array (index, value) of the point closest to 0.
-        """
-        for i in range(2, len(arr)):
-            group = np.concatenate((-1 * arr[i-2: i], arr[i: i+2]))
-            if np.all(group > 0):
-                return i - 2 + list(group).index(np.min(group)), np.min(group)
-        return None, None
-
     grad = np.gradient(yarr, 1)
-    n_sample = 5
-    intercept_ind, intercept = None, None
-    # keep incrementing the smooting value until we get a clean intercept
-    while not intercept_ind and not intercept:
-        x_ave = moving_average(xarr, n_sample)
-        grad_ave = moving_average(grad, n_sample)
-        intercept_ind, intercept = calc_crossing(grad_ave)
-        n_sample += 1
-        # quit if we've got stuck
-        if n_sample == 12:
-            break
+    # keep incrementing the smoothing value until we get a clean intercept
+    # (results for all smoothing values are calculated in one go, and we take the first)
+    n_sample, x_ave, intercept_ind, intercept = find_turnover(xarr, grad, SMOOTHING_WINDOWS)
 
     if intercept and intercept_ind:
         print 'Found minima'
@@ -558,44 +681,17 @@ def setup_fit(graph, function, absetamin, absetamax, outputfile):
         max_ind = list(yarr).index(min(yarr))
         fit_max = xarr[max_ind]
 
-    #############
-    # JOE_HACKs #
-    # 1. to fix the maximum pt for all fits (high pt saturation issue)
-    # helps ease things into the right solution space
-    # if fit_max > 650.0:
-    #     print "*** WARNING: about to apply a JOE_HACK ***"
-    #     print "*** lowers the upper limit of the fits to 650GeV ***"
-    #     fit_max = 650.0
-    # 2. to change the auto settings for a troublesome eta bin 
-    #if absetamin == 2.5:
-    #    print "*** WARNING: about to apply a JOE_HACK ***"
-    #    print "*** messing with fit limits for 2.500<|eta|<2.964 ***"
-    #    max_ind = 80
-    #    fit_max = xarr[max_ind]
-    #    print max_ind
-    #    print fit_max
-    #    fit_min = 40.0
-    #    min_ind = 0
-    if absetamin == 3.489:
+    # Hand-tuned settings for troublesome eta bins
+    if absetamin in FIT_RANGE_OVERRIDES:
+        override = FIT_RANGE_OVERRIDES[absetamin]
         print "* WARNING: about to apply a JOE_HACK *"
-        print "* messing with fit limits for 3.489<|eta|<4.191 *"
-        max_ind = 17
+        print "* messing with fit limits for %g<|eta|<%g *" % (absetamin, absetamax)
+        max_ind = override['max_ind']
         fit_max = xarr[max_ind]
         print max_ind
         print fit_max
-        fit_min = 40.0
-        min_ind = 0
-    if absetamin == 4.191:
-        print "* WARNING: about to apply a JOE_HACK *"
-        print "* messing with fit limits for 4.191<|eta|<5.191 *"
-        max_ind = 16
-        fit_max = xarr[max_ind]
-        print max_ind
-        print fit_max
-        fit_min = 40.0
-        min_ind = 0
-    ###############
-    ###############
+        fit_min = override['fit_min']
+        min_ind = override['min_ind']
 
     if fit_min > fit_max:
         raise RuntimeError('fit_min > fit_max! (%f > %f)' % (fit_min, fit_max))
@@ -633,6 +729,11 @@ def fit_correction(graph, function, fit_min=-1, fit_max=-1):
 
     We stop when the upper bound of the fit approaches the original lower bound.
 
+    Each fit starts from the parameters left by the previous attempt, so the
+    windows have to be tried in order. To keep each attempt cheap, fits that
+    converge are checked with check_sensible_function, which evaluates the
+    function over its whole grid in one go.
+
     Returns graph (with fitted function) and parameters of successful fit if
     successful (otherwise an empty list).
     """
@@ -655,6 +756,10 @@ def fit_correction(graph, function, fit_min=-1, fit_max=-1):
     fit_min_ind, fit_max_ind = orig_fit_min_ind, orig_fit_max_ind
     print 'Starting with fit range:', orig_fit_min, orig_fit_max
 
+    mode = "QR"
+    if str(function.GetExpFormula()).startswith("pol"):
+        mode += "F"
+
     while fit_max_ind - orig_fit_min_ind >= 5:
         fit_min_ind = orig_fit_min_ind
         while fit_min_ind + 5 < fit_max_ind:
@@ -662,16 +767,15 @@ def fit_correction(graph, function, fit_min=-1, fit_max=-1):
             fit_max = xarr[fit_max_ind]
             function.SetRange(fit_min, fit_max)
 
-            mode = "QR"
-            if str(function.GetExpFormula()).startswith("pol"):
-                mode += "F"
             fit_result = int(graph.Fit(function.GetName(), mode, "", fit_min, fit_max))
             if fit_result != 0:
                 fit_min_ind += 1
                 continue
 
-            # sanity check - sometimes will have status = 0 even though rubbish,
-            if not check_sensible_function(function):
+            # sanity check - sometimes will have status = 0 even though rubbish
+            sensible = check_sensible_function(function)
+            if not sensible:
+                print "Fit not sensible for fit min", fit_min, "to max", fit_max, ":", sensible
                 fit_result = -1
 
             if fit_result == 0:
@@ -705,15 +809,58 @@ def closest_element(arr, value):
     return ind, arr[ind]
 
 
-def check_sensible_function(function, lim=[3, 1000], spacing=0.05):
+class SensibleCheck(namedtuple("SensibleCheck", "sensible bad_x min_x min_y max_x max_y")):
+    """Result of check_sensible_function. Evaluates as True/False if the
+    function is/isn't sensible, and also says where it isn't:
+
+    bad_x: x of the first grid point outside the allowed range
+    (e.g. the location of a pole), None if sensible.
+    min_x, min_y, max_x, max_y: location & value of the function min & max
+    over the grid.
+    """
+    __slots__ = ()
+
+    def __nonzero__(self):
+        return self.sensible
+
+    def __str__(self):
+        if self.sensible:
+            return "sensible: min %g at x = %g, max %g at x = %g" % (self.min_y, self.min_x, self.max_y, self.max_x)
+        return ("not sensible from x = %g: min %g at x = %g, max %g at x = %g"
+                % (self.bad_x, self.min_y, self.min_x, self.max_y, self.max_x))
+
+
+# x values to check functions over, keyed by (lim, spacing), so we only make them once
+SENSIBLE_GRIDS = {}
+
+
+def check_sensible_function(function, lim=[3, 1000], spacing=0.05, ylim=[0.5, 10]):
     """Check if function is sensible. i.e. no large jumps or poles
 
+    The function is evaluated over the whole grid in one go, using a numpy
+    translation of its formula where possible (see multifunc.eval_array).
+
     lim is a tuple or list of the lower and upper bounds to check over
+
+    ylim is a tuple or list of the lower and upper allowed function values
+
+    Returns a SensibleCheck, which is True if the function is sensible.
     """
-    for x in np.linspace(lim[0], lim[1], ((lim[1] - lim[0]) / spacing) + 1):
-        if function.Eval(x) > 10 or function.Eval(x) < 0.5:
-            return False
-    return True
+    key = (tuple(lim), spacing)
+    if key not in SENSIBLE_GRIDS:
+        SENSIBLE_GRIDS[key] = np.linspace(lim[0], lim[1], ((lim[1] - lim[0]) / spacing) + 1)
+    x = SENSIBLE_GRIDS[key]
+    y = eval_array(function, x)
+
+    with np.errstate(invalid='ignore'):
+        bad = (y > ylim[1]) | (y < ylim[0])
+    bad_x = x[np.argmax(bad)] if bad.any() else None
+
+    if np.isnan(y).all():
+        min_ind, max_ind = 0, 0
+    else:
+        min_ind, max_ind = np.nanargmin(y), np.nanargmax(y)
+    return SensibleCheck(bad_x is None, bad_x, x[min_ind], y[min_ind], x[max_ind], y[max_ind])
 
 
 def redo_correction_fit(inputfile, outputfile, absetamin, absetamax, fitfcn):
@@ -733,14 +880,414 @@ def redo_correction_fit(inputfile, outputfile, absetamin, absetamax, fitfcn):
     gr = cu.get_from_file(inputfile, generate_eta_graph_name(absetamin, absetamax))
     outputfile.WriteTObject(gr, gr.GetName(), 'Overwrite')  # the original graph
 
-    # Setup fitting (calculate sensible range, make sub-graph), then do fit!
-    sub_graph, this_fit = setup_fit(gr, fitfcn, absetamin, absetamax, outputfile)
+    return fit_graph_and_save(gr, outputfile, absetamin, absetamax, fitfcn)
+
+
+def fit_graph_and_save(graph, outputfile, absetamin, absetamax, fitfcn):
+    """Setup fitting (calculate sensible range, make sub-graph), then do fit
+    on the correction graph for one eta bin, and save the results.
+
+    Returns parameters of successful fit (otherwise an empty list).
+    """
+    sub_graph, this_fit = setup_fit(graph, fitfcn, absetamin, absetamax, outputfile)
     fit_graph, fit_params = fit_correction(sub_graph, this_fit)
     outputfile.WriteTObject(this_fit, this_fit.GetName(), 'Overwrite')  # function by itself
     outputfile.WriteTObject(fit_graph, fit_graph.GetName(), 'Overwrite')  # has the function stored in it as well
     return fit_params
 
 
+def get_eta_bin_settings(eta_min, eta_max, args):
+    """Return the pT bins & default fit function parameters for an eta bin."""
+    # whether we're doing a central or forward bin (.01 is for rounding err)
+    forward_bin = eta_max > 3.01
+
+    # setup pt bins, wider ones for forward region
+    # ptBins = binning.pt_bins if not forward_bin else binning.pt_bins_wide
+    ptBins = binning.pt_bins_stage2 if not forward_bin else binning.pt_bins_stage2_hf
+
+    # Load fit function & starting params - important as wrong starting params
+    # can cause fit failures
+    default_params = []
+    if args.stage2:
+        default_params = STAGE2_DEFAULT_PARAMS_SELECT # this is selected around line 90
+    elif args.stage1:
+        default_params = STAGE1_DEFAULT_PARAMS
+    elif args.gct:
+        default_params = GCT_DEFAULT_PARAMS
+    return ptBins, default_params
+
+
+def generate_pu_output_filename(output_filename, pu_min, pu_max):
+    """Generate output filename for a PU bin, for the --PUbins option.
+
+    Uses the same _PU<min>to<max> convention as the HTCondor submission.
+    """
+    stem, ext = os.path.splitext(output_filename)
+    return "%s_PU%gto%g%s" % (stem, pu_min, pu_max, ext)
+
+
+#
+# Incremental running: a manifest in the output file stores a hash of the
+# inputs for each eta bin, so a later run can copy over the results for any
+# bins whose inputs haven't changed, instead of redoing them.
+#
+MANIFEST_NAME = "calib_manifest"
+MANIFEST_VERSION = 1
+
+
+def calc_hash(*items):
+    """Hash items (numbers, strings, lists/tuples/dicts of them) to a hex string."""
+    return hashlib.sha1(repr(items)).hexdigest()
+
+
+def get_code_hash(*functions):
+    """Hash the source code of functions (or whole modules),
+    so that changing them changes the hash."""
+    return calc_hash(*[inspect.getsource(f) for f in functions])
+
+
+def get_manifest_key(absetamin, absetamax):
+    return "eta_%g_%g" % (absetamin, absetamax)
+
+
+def get_curve_hash(input_fingerprint, absetamin, absetamax, pu_min, pu_max, pt_bins, do_burr,
+                   do_genjet_plots):
+    """Hash everything that goes into making the response curve for an eta bin:
+    input file, cuts, pt binning, options & code."""
+    return calc_hash(input_fingerprint, absetamin, absetamax, pu_min, pu_max, list(pt_bins),
+                     do_burr, do_genjet_plots,
+                     get_code_hash(make_correction_curves, do_gauss_response_hist_fit,
+                                   do_burr_response_hist_fit, load_pair_columns,
+                                   cu))  # for the column reading, hist filling & fitting helpers
+
+
+def get_graph_hash(graph):
+    """Hash the points of a response graph, for --redo-correction-fit."""
+    return calc_hash(graph.GetName(), cu.get_xy(graph), cu.get_exey(graph))
+
+
+def get_fit_hash(curve_hash, fitfcn, params, absetamin):
+    """Hash everything that goes into the correction function fit for an eta bin:
+    the response curve, fit function, starting params, fit range settings & code."""
+    return calc_hash(curve_hash, str(fitfcn.GetExpFormula()), list(params),
+                     FIT_RANGE_OVERRIDES.get(absetamin),
+                     get_code_hash(setup_fit, moving_average, calc_crossing, find_turnover,
+                                   fit_correction, check_sensible_function, fit_graph_and_save,
+                                   cu, inspect.getmodule(eval_array)))
+
+
+def read_manifest(tfile):
+    """Read the manifest from a previous output file.
+
+    Returns dict of {eta bin key: dict(curve_hash, fit_hash, fit_params)},
+    which is empty if there is no (usable) manifest.
+    """
+    if not tfile or not cu.exists_in_file(tfile, MANIFEST_NAME):
+        return {}
+    manifest = json.loads(tfile.Get(MANIFEST_NAME).GetString().Data())
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest['bins']
+
+
+def write_manifest(tfile, bins):
+    """Write the manifest of eta bin hashes & fit results to the output file."""
+    manifest = json.dumps(dict(version=MANIFEST_VERSION, bins=bins), indent=1, sort_keys=True)
+    tfile.WriteTObject(ROOT.TObjString(manifest), MANIFEST_NAME, 'Overwrite')
+
+
+def copy_bin_results(previous_file, output_file, absetamin, absetamax, fitfcn,
+                     curves=True, fit=True):
+    """Copy the saved curves and/or fit for an eta bin from a previous output file."""
+    if previous_file is output_file:
+        return
+    graph_name = generate_eta_graph_name(absetamin, absetamax)
+    names = []
+    if curves:
+        bin_dir_name = 'eta_%g_%g' % (absetamin, absetamax)
+        bin_dir = previous_file.GetDirectory(bin_dir_name)
+        if bin_dir:
+            contents = [(bin_dir_name, None, None)]
+            contents.extend(cu.get_directory_contents(bin_dir, bin_dir_name))
+            cu.write_directory_contents(output_file, contents)
+        names.extend([graph_name, 'gencorr_eta_%g_%g' % (absetamin, absetamax)])
+    if fit:
+        names.extend([fitfcn.GetName() + 'eta_%g_%g' % (absetamin, absetamax),
+                      graph_name + "_fit"])
+    for name in names:
+        if cu.exists_in_file(previous_file, name):
+            output_file.WriteTObject(previous_file.Get(name), name, 'Overwrite')
+
+
+def curves_changed(args, eta_bins, pu_bins, increments, do_genjet_plots):
+    """Check if any response curves need (re)making, i.e. their inputs have
+    changed since the last run."""
+    for (pu_min, pu_max), increment in zip(pu_bins, increments):
+        for eta_min, eta_max in pairwise(eta_bins):
+            ptBins = get_eta_bin_settings(eta_min, eta_max, args)[0]
+            curve_hash = get_curve_hash(increment['input_fingerprint'], eta_min, eta_max,
+                                        pu_min, pu_max, ptBins, args.burr, do_genjet_plots)
+            previous = increment['previous'].get(get_manifest_key(eta_min, eta_max), {})
+            if previous.get('curve_hash') != curve_hash:
+                return True
+    return False
+
+
+def run_bins_serial(args, input_file, output_file, eta_bins, pu_min, pu_max,
+                    do_genjet_plots, do_correction_fit, columns, increment):
+    """Run over eta bins one after another, for one PU bin.
+
+    increment is a dict with the manifest of the previous output file
+    ('previous'), the file itself ('previous_file'), and the input file
+    fingerprint ('input_fingerprint'). Eta bins with unchanged inputs are
+    copied from the previous file. The manifest entries for this run are
+    added to increment['bins'].
+    """
+    # Store last set of fit params if the user is doing --inherit-param
+    previous_fit_params = []
+
+    # Do plots & fitting to get calib consts
+    for i, (eta_min, eta_max) in enumerate(pairwise(eta_bins)):
+        print "Doing eta bin: %g - %g" % (eta_min, eta_max)
+
+        ptBins, default_params = get_eta_bin_settings(eta_min, eta_max, args)
+
+        # Ignore the genric fit defaults and use the last fit params instead
+        if args.inherit_params and previous_fit_params != []:
+            print "Inheriting params from last fit"
+            default_params = previous_fit_params[:]
+
+        fitfunc = central_fit_select # this is selected around line 90
+        set_fit_params(fitfunc, default_params)
+
+        # Figure out if this bin has changed since the last run
+        if args.redo_correction_fit:
+            curve_hash = get_graph_hash(cu.get_from_file(input_file,
+                                                         generate_eta_graph_name(eta_min, eta_max)))
+        else:
+            curve_hash = get_curve_hash(increment['input_fingerprint'], eta_min, eta_max,
+                                        pu_min, pu_max, ptBins, args.burr, do_genjet_plots)
+        fit_hash = get_fit_hash(curve_hash, fitfunc, default_params, eta_min) if do_correction_fit else None
+        previous = increment['previous'].get(get_manifest_key(eta_min, eta_max), {})
+        curve_clean = previous.get('curve_hash') == curve_hash
+        fit_clean = curve_clean and previous.get('fit_hash') == fit_hash
+
+        # Actually do the graph making and/or fitting!
+        if fit_clean:
+            print "Inputs unchanged, copying previous results"
+            copy_bin_results(increment['previous_file'], output_file, eta_min, eta_max, fitfunc)
+            fit_params = previous['fit_params']
+        elif args.redo_correction_fit:
+            fit_params = redo_correction_fit(input_file, output_file, eta_min, eta_max, fitfunc)
+        elif curve_clean:
+            print "Curve inputs unchanged, copying previous curves"
+            copy_bin_results(increment['previous_file'], output_file, eta_min, eta_max, fitfunc,
+                             fit=False)
+            fit_params = []
+            if do_correction_fit:
+                gr = cu.get_from_file(output_file, generate_eta_graph_name(eta_min, eta_max))
+                fit_params = fit_graph_and_save(gr, output_file, eta_min, eta_max, fitfunc)
+        else:
+            fit_params = make_correction_curves(input_file, output_file, ptBins, eta_min, eta_max,
+                                                fitfunc, do_genjet_plots, do_correction_fit,
+                                                pu_min, pu_max, args.burr,
+                                                columns=columns)
+        increment['bins'][get_manifest_key(eta_min, eta_max)] = dict(curve_hash=curve_hash,
+                                                                     fit_hash=fit_hash,
+                                                                     fit_params=fit_params)
+        # Save successful fit params
+        if fit_params != []:
+            previous_fit_params = fit_params[:]
+
+
+# Pair quantities for worker processes in --jobs mode.
+# Set before the pool is created, so the forked workers inherit them,
+# rather than having them pickled for every task.
+_WORKER_COLUMNS = None
+
+
+def _run_bin_task(task):
+    """Do one task in a worker process, for --jobs mode.
+
+    A task either makes the correction curve for one eta & PU bin (and
+    optionally fits it), or, if task['graph'] is set, just fits that graph.
+    Results are written to an in-memory TDirectory, and its contents returned
+    so that the parent process can merge them into the output file.
+
+    Returns (fit params, list of directory contents).
+    """
+    pu_min, pu_max = task['pu_bin']
+    eta_min, eta_max = task['eta_bin']
+    mem_file = ROOT.TMemFile("calib_PU%gto%g_eta_%g_%g.root" % (pu_min, pu_max, eta_min, eta_max),
+                             "RECREATE")
+    fitfunc = central_fit_select # this is selected around line 90
+    set_fit_params(fitfunc, task['params'])
+    if task['graph'] is None:
+        fit_params = make_correction_curves(None, mem_file, task['pt_bins'], eta_min, eta_max,
+                                            fitfunc, task['do_genjet_plots'],
+                                            task['do_correction_fit'], pu_min, pu_max,
+                                            task['do_burr'], columns=_WORKER_COLUMNS)
+    else:
+        fit_params = fit_graph_and_save(task['graph'], mem_file, eta_min, eta_max, fitfunc)
+    contents = cu.get_directory_contents(mem_file)
+    mem_file.Close()
+    return fit_params, contents
+
+
+def run_bins_parallel(args, input_file, output_files, eta_bins, pu_bins,
+                      do_genjet_plots, do_correction_fit, columns, increments):
+    """Run over all eta & PU bins with a pool of args.jobs worker processes.
+
+    Each eta & PU bin is a task for a worker, which writes its results to an
+    in-memory TDirectory. The parent process merges these into the output
+    file for that PU bin as they finish.
+
+    With --inherit-params, the correction fit for an eta bin must start from
+    the last successful fit in the same PU bin. So the curves for all bins are
+    made in parallel without fitting, and the fit for an eta bin is only
+    scheduled once its curve and the fit for the previous eta bin are done.
+    Each PU bin is an independent chain of fits.
+    With --redo-correction-fit, the existing graphs are read from the input
+    file, and only fit tasks are run.
+
+    increments is a list of dicts, one per PU bin, as for run_bins_serial().
+    Curves & fits whose inputs are unchanged are copied from the previous
+    output file instead of being submitted.
+    """
+    global _WORKER_COLUMNS
+    _WORKER_COLUMNS = columns
+    pool = multiprocessing.Pool(args.jobs)
+
+    eta_bin_list = list(pairwise(eta_bins))
+    chained = args.inherit_params
+    separate_fits = args.redo_correction_fit or (chained and do_correction_fit)
+
+    graphs = {}  # (pu index, eta index) : graph ready for fitting
+    next_fit = [0] * len(pu_bins)  # index of next eta bin to fit, per PU bin
+    fit_running = [False] * len(pu_bins)
+    previous_fit_params = [[] for _ in pu_bins]
+    pending = []  # (pu index, eta index, is fit task, async result)
+
+    def submit(pu_ind, eta_ind, params, graph=None):
+        eta_min, eta_max = eta_bin_list[eta_ind]
+        ptBins, _ = get_eta_bin_settings(eta_min, eta_max, args)
+        task = dict(pu_bin=pu_bins[pu_ind], eta_bin=(eta_min, eta_max), pt_bins=ptBins,
+                    params=params, graph=graph, do_genjet_plots=do_genjet_plots,
+                    do_correction_fit=do_correction_fit and not separate_fits,
+                    do_burr=args.burr)
+        print "Submitting %s task for PU bin %g - %g, eta bin %g - %g" % \
+            ("fit" if graph else "curve", pu_bins[pu_ind][0], pu_bins[pu_ind][1], eta_min, eta_max)
+        pending.append((pu_ind, eta_ind, graph is not None,
+                        pool.apply_async(_run_bin_task, (task,))))
+
+    def get_entries(pu_ind, eta_ind):
+        """Get the (previous, current) manifest entries for a bin."""
+        key = get_manifest_key(*eta_bin_list[eta_ind])
+        return increments[pu_ind]['previous'].get(key, {}), increments[pu_ind]['bins'][key]
+
+    def start_fit(pu_ind, eta_ind, params):
+        """Submit a fit task, or copy the previous fit if its inputs are unchanged.
+        Returns True if a task was submitted."""
+        eta_min, eta_max = eta_bin_list[eta_ind]
+        graph = graphs.pop((pu_ind, eta_ind))
+        previous, entry = get_entries(pu_ind, eta_ind)
+        entry['fit_hash'] = get_fit_hash(entry['curve_hash'], central_fit_select, params, eta_min)
+        if (previous.get('curve_hash') == entry['curve_hash'] and
+                previous.get('fit_hash') == entry['fit_hash']):
+            print "Fit inputs unchanged for PU bin %g - %g, eta bin %g - %g, copying previous fit" % \
+                (pu_bins[pu_ind][0], pu_bins[pu_ind][1], eta_min, eta_max)
+            copy_bin_results(increments[pu_ind]['previous_file'], output_files[pu_ind],
+                             eta_min, eta_max, central_fit_select, curves=False)
+            entry['fit_params'] = previous['fit_params']
+            return False
+        submit(pu_ind, eta_ind, params, graph)
+        return True
+
+    def schedule_fits():
+        for pu_ind in range(len(pu_bins)):
+            if chained:
+                # keep going until we have to wait for a fit task
+                while (not fit_running[pu_ind] and next_fit[pu_ind] < len(eta_bin_list) and
+                       (pu_ind, next_fit[pu_ind]) in graphs):
+                    eta_ind = next_fit[pu_ind]
+                    eta_min, eta_max = eta_bin_list[eta_ind]
+                    params = get_eta_bin_settings(eta_min, eta_max, args)[1]
+                    if previous_fit_params[pu_ind] != []:
+                        print "Inheriting params from last fit"
+                        params = previous_fit_params[pu_ind][:]
+                    fit_running[pu_ind] = start_fit(pu_ind, eta_ind, params)
+                    if not fit_running[pu_ind]:
+                        fit_params = get_entries(pu_ind, eta_ind)[1]['fit_params']
+                        if fit_params != []:
+                            previous_fit_params[pu_ind] = fit_params[:]
+                    next_fit[pu_ind] += 1
+            else:
+                for (graph_pu_ind, eta_ind) in sorted(graphs.keys()):
+                    if graph_pu_ind != pu_ind:
+                        continue
+                    eta_min, eta_max = eta_bin_list[eta_ind]
+                    params = get_eta_bin_settings(eta_min, eta_max, args)[1]
+                    start_fit(pu_ind, eta_ind, params)
+
+    # Submit the initial tasks, copying over any curves whose inputs are unchanged
+    for pu_ind, (pu_min, pu_max) in enumerate(pu_bins):
+        increment = increments[pu_ind]
+        for eta_ind, (eta_min, eta_max) in enumerate(eta_bin_list):
+            ptBins, params = get_eta_bin_settings(eta_min, eta_max, args)
+            graph_name = generate_eta_graph_name(eta_min, eta_max)
+            entry = dict(fit_hash=None, fit_params=[])
+            increment['bins'][get_manifest_key(eta_min, eta_max)] = entry
+            if args.redo_correction_fit:
+                gr = cu.get_from_file(input_file, graph_name)
+                output_files[pu_ind].WriteTObject(gr, gr.GetName(), 'Overwrite')  # the original graph
+                graphs[(pu_ind, eta_ind)] = gr
+                entry['curve_hash'] = get_graph_hash(gr)
+                continue
+            entry['curve_hash'] = get_curve_hash(increment['input_fingerprint'], eta_min, eta_max,
+                                                 pu_min, pu_max, ptBins, args.burr,
+                                                 do_genjet_plots)
+            previous = get_entries(pu_ind, eta_ind)[0]
+            if previous.get('curve_hash') == entry['curve_hash']:
+                print "Curve inputs unchanged for PU bin %g - %g, eta bin %g - %g, " \
+                    "copying previous curves" % (pu_min, pu_max, eta_min, eta_max)
+                copy_bin_results(increment['previous_file'], output_files[pu_ind],
+                                 eta_min, eta_max, central_fit_select, fit=False)
+                if do_correction_fit:
+                    graphs[(pu_ind, eta_ind)] = cu.get_from_file(output_files[pu_ind], graph_name)
+            else:
+                if do_correction_fit and not separate_fits:
+                    entry['fit_hash'] = get_fit_hash(entry['curve_hash'], central_fit_select,
+                                                     params, eta_min)
+                submit(pu_ind, eta_ind, params)
+    schedule_fits()
+
+    # Collect results as they finish, merge them into the output file,
+    # and schedule any fits that can now run
+    while pending:
+        finished = [p for p in pending if p[3].ready()]
+        if not finished:
+            time.sleep(0.1)
+            continue
+        for pu_ind, eta_ind, is_fit, result in finished:
+            pending.remove((pu_ind, eta_ind, is_fit, result))
+            fit_params, contents = result.get()
+            cu.write_directory_contents(output_files[pu_ind], contents)
+            get_entries(pu_ind, eta_ind)[1]['fit_params'] = fit_params
+            if is_fit:
+                fit_running[pu_ind] = False
+                if fit_params != []:
+                    previous_fit_params[pu_ind] = fit_params[:]
+            elif separate_fits:
+                eta_min, eta_max = eta_bin_list[eta_ind]
+                graph_name = generate_eta_graph_name(eta_min, eta_max)
+                graphs[(pu_ind, eta_ind)] = next(obj for path, name, obj in contents
+                                                 if path == "" and name == graph_name)
+        schedule_fits()
+
+    pool.close()
+    pool.join()
+
+
 def main(in_args=sys.argv[1:]):
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("input", help="input ROOT filename")
@@ -774,6 +1321,22 @@ def main(in_args=sys.argv[1:]):
                         help="Maximum number of PU vertices (refers to *actual* "
                         "number of PU vertices in the event, not the centre "
                         "of of the Poisson distribution)")
+    parser.add_argument("--PUbins", action='store_true',
+                        help="Run over all PU bins in binning.pu_bins, instead of "
+                        "--PUmin/--PUmax. Each PU bin goes in its own output file, "
+                        "with _PU<min>to<max> appended to the output filename.")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of worker processes to spread eta (and PU) bins "
+                        "over. Each bin is done in a separate process, and the results "
+                        "merged into the output file(s).")
+    parser.add_argument("--no-column-cache", action='store_false', dest='column_cache',
+                        help="Don't use or make the cache of pair quantities "
+                        "(<input>.columns/), read the TTree directly instead.")
+    parser.add_argument("--incremental", action='store_true',
+                        help="Only redo eta bins whose inputs (input file, binning, "
+                        "options, fit settings) have changed since the last run that "
+                        "made the output file. Results for other bins are copied from "
+                        "the existing output file.")
     parser.add_argument("--etaInd", nargs="+",
                         help="list of eta bin INDICES to run over - "
                         "if unspecified will do all. "
@@ -807,16 +1370,46 @@ def main(in_args=sys.argv[1:]):
     if args.burr:
         print 'Using Burr Type3 for response hist fits'
 
+    if args.PUbins and args.redo_correction_fit:
+        raise RuntimeError("Can't use --PUbins with --redo-correction-fit")
+
+    # Figure out which PU bins the user wants to run over, and their output files
+    pu_bins = [(args.PUmin, args.PUmax)]
+    output_filenames = [args.output]
+    if args.PUbins:
+        pu_bins = [tuple(pu) for pu in binning.pu_bins]
+        output_filenames = [generate_pu_output_filename(args.output, *pu) for pu in pu_bins]
+    print "Running over PU bins:", pu_bins
+
     # Open input & output files, check
     print "IN:", args.input
-    print "OUT:", args.output
+    print "OUT:", output_filenames
+    # Write each output to a temporary file, which is only moved over the real
+    # output file once everything is done. That way a failed run never leaves a
+    # half-written output file, nor destroys the results of the last good run.
+    # With --incremental, unchanged results are copied from that last good
+    # output file (only complete files have a manifest, see read_manifest()).
+    previous_files = [None] * len(output_filenames)
+    tmp_filenames = ["%s.%d.tmp" % (f, os.getpid()) for f in output_filenames]
     if (args.redo_correction_fit and
         os.path.realpath(args.input) == os.path.realpath(args.output)):
         input_file = cu.open_root_file(args.input, "UPDATE")
-        output_file = input_file
+        output_files = [input_file]
+        if args.incremental:
+            previous_files = [input_file]
     else:
+        if args.incremental:
+            previous_files = [cu.open_root_file(f, "READ") if os.path.isfile(f) else None
+                              for f in output_filenames]
         input_file = cu.open_root_file(args.input, "READ")
-        output_file = cu.open_root_file(args.output, "RECREATE")
+        output_files = [cu.open_root_file(f, "RECREATE") for f in tmp_filenames]
+
+    input_fingerprint = None
+    if not args.redo_correction_fit:
+        input_fingerprint = cu.get_file_fingerprint(args.input)
+    increments = [dict(previous_file=prev, previous=read_manifest(prev), bins={},
+                       input_fingerprint=input_fingerprint)
+                  for prev in previous_files]
 
     # Figure out which eta bins the user wants to run over
     etaBins = binning.eta_bins
@@ -829,51 +1422,34 @@ def main(in_args=sys.argv[1:]):
         etaBins = [eta for eta in etaBins if eta > 2.9]
     print "Running over eta bins:", etaBins
 
-    # Store last set of fit params if the user is doing --inherit-param
-    previous_fit_params = []
-
-    # Do plots & fitting to get calib consts
-    for i, (eta_min, eta_max) in enumerate(pairwise(etaBins)):
-        print "Doing eta bin: %g - %g" % (eta_min, eta_max)
-
-        # whether we're doing a central or forward bin (.01 is for rounding err)
-        forward_bin = eta_max > 3.01
-
-        # setup pt bins, wider ones for forward region
-        # ptBins = binning.pt_bins if not forward_bin else binning.pt_bins_wide
-        ptBins = binning.pt_bins_stage2 if not forward_bin else binning.pt_bins_stage2_hf
-
-        # Load fit function & starting params - important as wrong starting params
-        # can cause fit failures
-        default_params = []
-        if args.stage2:
-            default_params =STAGE2_DEFAULT_PARAMS_SELECT # this is selected around line 90
-        elif args.stage1:
-            default_params = STAGE1_DEFAULT_PARAMS
-        elif args.gct:
-            default_params = GCT_DEFAULT_PARAMS
-
-        # Ignore the genric fit defaults and use the last fit params instead
-        if args.inherit_params and previous_fit_params != []:
-            print "Inheriting params from last fit"
-            default_params = previous_fit_params[:]
-
-        fitfunc = central_fit_select # this is selected around line 90
-        set_fit_params(fitfunc, default_params)
-
-        # Actually do the graph making and/or fitting!
-        if args.redo_correction_fit:
-            fit_params = redo_correction_fit(input_file, output_file, eta_min, eta_max, fitfunc)
-        else:
-            fit_params = make_correction_curves(input_file, output_file, ptBins, eta_min, eta_max,
-                                                fitfunc, do_genjet_plots, do_correction_fit,
-                                                args.PUmin, args.PUmax, args.burr)
-        # Save successful fit params
-        if fit_params != []:
-            previous_fit_params = fit_params[:]
+    # Read the pair quantities once, rather than once per eta bin
+    # (and not at all if no curves need remaking)
+    columns = None
+    if (not args.redo_correction_fit and
+            curves_changed(args, etaBins, pu_bins, increments, do_genjet_plots)):
+        columns = load_pair_columns(input_file, use_cache=args.column_cache)
 
+    if args.jobs > 1:
+        run_bins_parallel(args, input_file, output_files, etaBins, pu_bins,
+                          do_genjet_plots, do_correction_fit, columns, increments)
+    else:
+        for (pu_min, pu_max), output_file, increment in zip(pu_bins, output_files, increments):
+            run_bins_serial(args, input_file, output_file, etaBins, pu_min, pu_max,
+                            do_genjet_plots, do_correction_fit, columns, increment)
+
+    # Store the manifest, so the next --incremental run knows what's changed
+    for output_file, increment in zip(output_files, increments):
+        write_manifest(output_file, increment['bins'])
+
+    for previous_file in previous_files:
+        if previous_file and previous_file is not input_file:
+            previous_file.Close()
+    for output_file, tmp_filename, output_filename in zip(output_files, tmp_filenames,
+                                                          output_filenames):
+        if output_file is not input_file:
+            output_file.Close()
+            os.rename(tmp_filename, output_filename)
     input_file.Close()
-    output_file.Close()
     return 0
 
 
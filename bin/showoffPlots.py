@@ -19,6 +19,7 @@ $ python /users/jt15104/CMSSW_8_0_9/src/L1Trigger/L1JetEnergyCorrections/bin/sho
 
 
 import ROOT
+import numpy as np
 import sys
 import binning
 from binning import pairwise
@@ -28,9 +29,9 @@ import common_utils as cu
 from array import array
 import os
 from runCalibration import generate_eta_graph_name
-from subprocess import check_output
 from shutil import make_archive
-from distutils.spawn import find_executable
+import multiprocessing
+import math
 
 
 ROOT.PyConfig.IgnoreCommandLineOptions = True
@@ -110,11 +111,31 @@ def generate_legend(x1=0.34, y1=0.7, x2=0.88, y2=0.88):
 # PLOTS USING OUTPUT FROM RunMatcher
 #############################################
 
+
+def select_pairs(tree, cut="1", eta_min=None, eta_max=None):
+    """Mask of pairs passing cut, and eta_min < |eta(L1)| < eta_max if set.
+
+    The cut & eta are read via the column cache, so repeated plots
+    (or reruns) don't have to read the tree again.
+    """
+    selected = cu.get_tree_selection_cached(tree, cut)
+    if eta_min is not None and eta_max is not None:
+        abs_eta = np.abs(cu.get_tree_columns_cached(tree, ["eta"])["eta"])
+        selected &= (abs_eta > eta_min) & (abs_eta < eta_max)
+    return selected
+
+
+def get_pairs_column(tree, branch, selected):
+    """Values of branch for the selected pairs, from the column cache."""
+    return cu.get_tree_columns_cached(tree, [branch])[branch][selected]
+
+
 def plot_dR(tree, oDir, cut="1", eta_min=0, eta_max=5, oFormat="pdf"):
     """Plot deltaR(L1 - RefJet)"""
     c = generate_canvas()
-    tree.Draw("dr>>h_dr(40,0,0.8)", cut + "&& TMath::Abs(eta)>%g && TMath::Abs(eta)<%g" % (eta_min, eta_max), "HISTE")
-    h_dr = ROOT.gROOT.FindObject("h_dr")
+    h_dr = ROOT.TH1F("h_dr", "", 40, 0, 0.8)
+    cu.fill_hist_arrays(h_dr, get_pairs_column(tree, "dr", select_pairs(tree, cut, eta_min, eta_max)))
+    h_dr.Draw("HISTE")
     h_dr.SetTitle(cut + "&& TMath::Abs(eta)>%g && TMath::Abs(eta)<%g;%s;N" % (eta_min, eta_max, dr_str))
     c.SaveAs("%s/dr_%g_%g.%s" % (oDir, eta_min, eta_max, oFormat))
 
@@ -122,8 +143,9 @@ def plot_dR(tree, oDir, cut="1", eta_min=0, eta_max=5, oFormat="pdf"):
 def plot_pt_l1(tree, oDir, cut="1", eta_min=0, eta_max=5, oFormat="pdf"):
     """Plot pT(L1)"""
     c = generate_canvas()
-    tree.Draw("pt>>h_pt(63,0,252)", cut + "&& TMath::Abs(eta)>%g && TMath::Abs(eta)<%g" % (eta_min, eta_max), "HISTE")
-    h_pt = ROOT.gROOT.FindObject("h_pt")
+    h_pt = ROOT.TH1F("h_pt", "", 63, 0, 252)
+    cu.fill_hist_arrays(h_pt, get_pairs_column(tree, "pt", select_pairs(tree, cut, eta_min, eta_max)))
+    h_pt.Draw("HISTE")
     h_pt.SetTitle(cut + "&& TMath::Abs(eta)>%g && TMath::Abs(eta)<%g;%s;N" % (eta_min, eta_max, pt_l1_str))
     c.SaveAs("%s/pt_l1_%g_%g.%s" % (oDir, eta_min, eta_max, oFormat))
 
@@ -133,15 +155,17 @@ def plot_eta_l1(tree, oDir, cut="1", oFormat="pdf"):
     c = generate_canvas()
     h_eta = ROOT.TH1D("h_eta", "%s;%s;N" % (cut, eta_l1_str),
                       len(binning.eta_bins_all) - 1, array('d', binning.eta_bins_all))
-    tree.Draw("eta>>h_eta", cut, "HISTE")
+    cu.fill_hist_arrays(h_eta, get_pairs_column(tree, "eta", select_pairs(tree, cut)))
+    h_eta.Draw("HISTE")
     c.SaveAs("%s/eta_l1.%s" % (oDir, oFormat))
 
 
 def plot_pt_ref(tree, oDir, cut="1", eta_min=0, eta_max=5, oFormat="pdf"):
     """Plot pT(Reference)"""
     c = generate_canvas()
-    tree.Draw("ptRef>>h_pt(63,0,252)", cut + "&& TMath::Abs(eta)>%g && TMath::Abs(eta)<%g" % (eta_min, eta_max), "HISTE")
-    h_pt = ROOT.gROOT.FindObject("h_pt")
+    h_pt = ROOT.TH1F("h_pt", "", 63, 0, 252)
+    cu.fill_hist_arrays(h_pt, get_pairs_column(tree, "ptRef", select_pairs(tree, cut, eta_min, eta_max)))
+    h_pt.Draw("HISTE")
     h_pt.SetTitle(cut + "&& TMath::Abs(eta)>%g && TMath::Abs(eta)<%g;%s;N" % (eta_min, eta_max, pt_ref_str))
     c.SaveAs("%s/pt_ref_%g_%g.%s" % (oDir, eta_min, eta_max, oFormat))
 
@@ -151,7 +175,8 @@ def plot_eta_ref(tree, oDir, cut="1", oFormat="pdf"):
     c = generate_canvas()
     h_eta = ROOT.TH1D("h_eta", "%s;%s;N" % (cut, eta_ref_str),
                       len(binning.eta_bins_all) - 1, array('d', binning.eta_bins_all))
-    tree.Draw("etaRef>>h_eta", cut, "HISTE")
+    cu.fill_hist_arrays(h_eta, get_pairs_column(tree, "etaRef", select_pairs(tree, cut)))
+    h_eta.Draw("HISTE")
     c.SaveAs("%s/eta_ref.%s" % (oDir, oFormat))
 
 
@@ -161,8 +186,9 @@ def plot_pt_both(tree, oDir, cut="1", eta_min=0, eta_max=5, oFormat="pdf"):
     total_cut = cut + " && TMath::Abs(eta) > %g && TMath::Abs(eta) < %g" % (eta_min, eta_max)
     h_pt_l1 = ROOT.TH1D("h_pt_l1", "%s;%s;N" % (total_cut, pt_str), 63, 0, 252)
     h_pt_ref = ROOT.TH1D("h_pt_ref", "%s;%s;N" % (total_cut, pt_str), 63, 0, 252)
-    tree.Draw("pt>>h_pt_l1", cut + " && TMath::Abs(eta) > %g && TMath::Abs(eta) < %g" % (eta_min, eta_max), "HISTE")
-    tree.Draw("ptRef>>h_pt_ref", cut + " && TMath::Abs(eta) > %g && TMath::Abs(eta) < %g" % (eta_min, eta_max), "HISTE")
+    selected = select_pairs(tree, cut, eta_min, eta_max)
+    cu.fill_hist_arrays(h_pt_l1, get_pairs_column(tree, "pt", selected))
+    cu.fill_hist_arrays(h_pt_ref, get_pairs_column(tree, "ptRef", selected))
     h_pt_ref.SetLineColor(ROOT.kRed)
     stack = ROOT.THStack("st", "")
     stack.Add(h_pt_l1)
@@ -186,8 +212,9 @@ def plot_eta_both(tree, oDir, cut="1", oFormat="pdf"):
                          len(binning.eta_bins_all) - 1, array('d', binning.eta_bins_all))
     h_eta_ref = ROOT.TH1D("h_eta_ref", "%s;%s;N" % (cut, eta_str),
                           len(binning.eta_bins_all) - 1, array('d', binning.eta_bins_all))
-    tree.Draw("eta>>h_eta_l1", cut, "HISTE")
-    tree.Draw("etaRef>>h_eta_ref", cut, "HISTE")
+    selected = select_pairs(tree, cut)
+    cu.fill_hist_arrays(h_eta_l1, get_pairs_column(tree, "eta", selected))
+    cu.fill_hist_arrays(h_eta_ref, get_pairs_column(tree, "etaRef", selected))
     h_eta_ref.SetLineColor(ROOT.kRed)
     h_eta_l1.Draw("HISTE")
     h_eta_ref.Draw("HISTE SAME")
@@ -213,8 +240,7 @@ def plot_pt_diff(res_file, eta_min, eta_max, pt_min, pt_max, oDir, oFormat="pdf"
     func = h_diff.GetListOfFunctions().At(0)
     func.SetLineWidth(1)
     h_diff.SetTitle("%g < %s < %g, %g < p_{T}^{%s} < %g;%s;N" % (eta_min, eta_l1_str, eta_max, pt_min, ref_str, pt_max, pt_diff_str))
-    if not os.path.exists("%s/eta_%g_%g" % (oDir, eta_min, eta_max)):
-        os.makedirs("%s/eta_%g_%g" % (oDir, eta_min, eta_max))
+    cu.check_dir_exists_create("%s/eta_%g_%g" % (oDir, eta_min, eta_max))
     c.SaveAs("%s/eta_%g_%g/pt_diff_eta_%g_%g_%g_%g.%s" % (oDir, eta_min, eta_max, eta_min, eta_max, pt_min, pt_max, oFormat))
 
 
@@ -343,7 +369,7 @@ def plot_rsp_eta_bin_pt(calib_file, eta_min, eta_max, pt_var, pt_min, pt_max, oD
     if func:
         func.Draw("SAME")
     output_filename = "%s/h_rsp_%g_%g_%s_%g_%g.%s" % (oDir, eta_min, eta_max, pt_var, pt_min, pt_max, oFormat)
-    c.SaveAs(output_filename)
+    save_frame(c, output_filename)
     return output_filename
 
 
@@ -485,6 +511,7 @@ def plot_rsp_Vs_pt_candle_violin(check_file, eta_min, eta_max, ptVar, oDir, oFor
     gr.Draw("LP")
     c.SaveAs("%s/h2d_rsp_%s_%g_%g_violin.%s" % (oDir, 'l1' if ptVar == 'l1' else 'ref', eta_min, eta_max, oFormat))
 
+
 def plot_rsp_eta_inclusive_graph(check_file, eta_min, eta_max, pt_var, oDir, oFormat="pdf"):
     """Plot a graph of response vs L1 eta."""
     grname = "eta_%g_%g/gr_rsp_%s_eta_%g_%g" % (eta_min, eta_max, pt_var, eta_min, eta_max)
@@ -579,8 +606,7 @@ def plot_rsp_pt_hists(check_file, eta_min, eta_max, pt_bins, pt_var, oDir, oForm
     """Plot component hists of response vs pt graph, for given eta bin"""
 
     sub_dir = "eta_%g_%g" % (eta_min, eta_max)
-    if not os.path.isdir("%s/%s" % (oDir, sub_dir)):
-        os.mkdir("%s/%s" % (oDir, sub_dir))
+    cu.check_dir_exists_create("%s/%s" % (oDir, sub_dir))
 
     c = generate_canvas(plot_title)
     filenames = []
@@ -592,7 +618,7 @@ def plot_rsp_pt_hists(check_file, eta_min, eta_max, pt_bins, pt_var, oDir, oForm
             hist.SetTitle("%s;%s;N" % (plot_title, rsp_str))
             hist.Draw()
             filename = "%s/%s/rsp_%s_%g_%g.%s" % (oDir, sub_dir, pt_var, pt_min, pt_max, oFormat)
-            c.SaveAs(filename)
+            save_frame(c, filename)
             filenames.append(filename)
         except Exception:
             print '! No histogram %s exists' % hname
@@ -755,8 +781,7 @@ def plot_correction_graph(calib_file, eta_min, eta_max, oDir, oFormat='pdf'):
 def plot_rsp_eta_pt_bin(calib_file, eta_min, eta_max, pt_min, pt_max, oDir, oFormat="pdf"):
     """Plot the response in one pt, eta bin"""
     sub_dir = "eta_%g_%g" % (eta_min, eta_max)
-    if not os.path.isdir("%s/%s" % (oDir, sub_dir)):
-        os.mkdir("%s/%s" % (oDir, sub_dir))
+    cu.check_dir_exists_create("%s/%s" % (oDir, sub_dir))
     hname = "eta_%g_%g/Histograms/Rsp_genpt_%g_%g" % (eta_min, eta_max, pt_min, pt_max)
     # ignore histogram not found errors... naughty naughty
     try:
@@ -768,7 +793,7 @@ def plot_rsp_eta_pt_bin(calib_file, eta_min, eta_max, pt_min, pt_max, oDir, oFor
             func.Draw("SAME")
         h_rsp.SetTitle("%s;%s;" % (hname, rsp_str))
         filepath = "%s/%s/h_rsp_%g_%g_%g_%g.%s" % (oDir, sub_dir, eta_min, eta_max, pt_min, pt_max, oFormat)
-        c.SaveAs(filepath)
+        save_frame(c, filepath)
         return filepath
     except Exception:
         print "! No histogram %s exists" % hname
@@ -777,8 +802,7 @@ def plot_rsp_eta_pt_bin(calib_file, eta_min, eta_max, pt_min, pt_max, oDir, oFor
 def plot_pt_bin(calib_file, eta_min, eta_max, pt_min, pt_max, oDir, oFormat="pdf"):
     """Plot the L1 pt in a given ref jet pt bin, for a given eta bin"""
     sub_dir = "eta_%g_%g" % (eta_min, eta_max)
-    if not os.path.isdir("%s/%s" % (oDir, sub_dir)):
-        os.mkdir("%s/%s" % (oDir, sub_dir))
+    cu.check_dir_exists_create("%s/%s" % (oDir, sub_dir))
     hname = "eta_%g_%g/Histograms/L1_pt_genpt_%g_%g" % (eta_min, eta_max, pt_min, pt_max)
     # ignore histogram not found errors... naughty naughty
     try:
@@ -786,7 +810,7 @@ def plot_pt_bin(calib_file, eta_min, eta_max, pt_min, pt_max, oDir, oFormat="pdf
         c = generate_canvas()
         h_pt.Draw("HISTE")
         filepath = "%s/%s/L1_pt_%g_%g_%g_%g.%s" % (oDir, sub_dir, eta_min, eta_max, pt_min, pt_max, oFormat)
-        c.SaveAs(filepath)
+        save_frame(c, filepath)
         return filepath
     except Exception:
         print "! No histogram %s exists" % hname
@@ -804,42 +828,259 @@ def write_filelist(plot_filenames, list_file):
         print 'Warning: nothing to write to txt file'
 
 
-def make_gif(input_file_list, output_gif_filename, convert_exe):
-    """Make an animated GIF from a list of images.
-    Requires Imagemagick to be installed.
+class AnimatedGif(object):
+    """Stream canvases into an animated GIF as they are drawn, using ROOT's
+    own GIF writer, so no external tools (e.g. ImageMagick) are needed.
+
+    Only the most recent frame is held in memory: it is written when the next
+    frame arrives, or with the looping flag when the animation is closed.
+
+    Parameters
+    ----------
+    filename : str
+        Filepath of GIF. Any existing file is removed, since ROOT appends.
+    delay : int, optional
+        Delay between frames, in units of 10 ms.
+    """
+
+    def __init__(self, filename, delay=50):
+        self.filename = filename
+        self.delay = delay
+        self.n_frames = 0
+        self._pending = None
+        if os.path.isfile(filename):
+            os.remove(filename)
+
+    def add_frame(self, canvas):
+        """Add the current contents of canvas as the next frame."""
+        img = ROOT.TImage.Create()
+        img.FromPad(canvas)
+        self._write_pending("+")
+        self._pending = img
+
+    def close(self):
+        """Write the last frame, and make the animation loop forever."""
+        self._write_pending("++")
+
+    def _write_pending(self, append_opt):
+        if self._pending is None:
+            return
+        self._pending.WriteImage("%s%s%d" % (self.filename, append_opt, self.delay))
+        self._pending = None
+        self.n_frames += 1
+
 
-    Does a preliminary check to ensure that the input filelist is not empty,
-    otherwise convert will error.
+# The animation that canvases saved with save_frame() are added to, if any.
+_ANIMATION = None
 
-    Note that we cd to the directory with the input file list, as all image
-    files are assumed to be relative to its location.
+
+def save_frame(canvas, filename):
+    """Save canvas to file, and add it to the current animation (if there is one)."""
+    canvas.SaveAs(filename)
+    if _ANIMATION is not None:
+        _ANIMATION.add_frame(canvas)
+
+
+def plot_frames(plot_obj, frame_tasks, gif_filename=None, delay=50):
+    """Run a sequence of plot tasks in order, e.g. all the pt bins for one eta bin.
+
+    Can be used as a plot task itself, so a whole sequence runs in one worker
+    process. If gif_filename is set, every plot saved with save_frame() is
+    also streamed straight into an animated GIF, without re-reading it from disk.
 
     Parameters
     ----------
-    input_file_list : str
-        Filepath of txt file with locations of images to be made into GIF
-    output_gif_filename : str
-        Filepath of GIF
+    plot_obj : TFile or TObject
+        Object to pass to the plot functions.
+    frame_tasks : list[tuple]
+        Plot tasks, made with plot_task().
+    gif_filename : str, optional
+        Filepath of animated GIF to make.
+    delay : int, optional
+        Delay between GIF frames, in units of 10 ms.
+
+    Returns
+    -------
+    list
+        Result of each plot function.
     """
-    print 'Making GIF', output_gif_filename, 'from', input_file_list
-    input_file_list = os.path.abspath(input_file_list)
+    global _ANIMATION
+    if gif_filename:
+        _ANIMATION = AnimatedGif(gif_filename, delay)
+    try:
+        results = [func(plot_obj, *args, **kwargs) for func, args, kwargs in frame_tasks]
+    finally:
+        if _ANIMATION is not None:
+            _ANIMATION.close()
+            print 'Made GIF %s with %d frames' % (gif_filename, _ANIMATION.n_frames)
+            _ANIMATION = None
+    return results
 
-    if not os.path.isfile(input_file_list):
-        print 'Skipping GIF making as %s does not exist' % input_file_list
-        return
 
-    if os.stat(input_file_list).st_size == 0:
-        print 'Skipping GIF making as %s is empty' % input_file_list
+def _read_gif_blocks(filename):
+    """Split a GIF file into its global colour table and its frames.
+
+    Each frame is (graphic control extension, image descriptor, local
+    colour table, image data), all as raw bytes.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if data[:3] != 'GIF':
+        raise IOError("%s is not a GIF file" % filename)
+
+    def skip_sub_blocks(pos):
+        while ord(data[pos]) != 0:
+            pos += ord(data[pos]) + 1
+        return pos + 1
+
+    screen = data[6:13]
+    pos = 13
+    gct = ''
+    if ord(screen[4]) & 0x80:
+        gct_len = 3 * 2 ** ((ord(screen[4]) & 0x07) + 1)
+        gct = data[pos:pos + gct_len]
+        pos += gct_len
+
+    frames = []
+    control = ''
+    while pos < len(data) and data[pos] != ';':
+        if data[pos] == '!':
+            end = skip_sub_blocks(pos + 2)
+            # only keep the graphic control extension, i.e. frame delay/disposal
+            if data[pos + 1] == '\xf9':
+                control = data[pos:end]
+            pos = end
+        elif data[pos] == ',':
+            descriptor = data[pos:pos + 10]
+            pos += 10
+            lct = ''
+            if ord(descriptor[9]) & 0x80:
+                lct_len = 3 * 2 ** ((ord(descriptor[9]) & 0x07) + 1)
+                lct = data[pos:pos + lct_len]
+                pos += lct_len
+            end = skip_sub_blocks(pos + 1)  # +1 for LZW minimum code size
+            frames.append((control, descriptor, lct, data[pos:end]))
+            control = ''
+            pos = end
+        else:
+            raise IOError("Bad block in GIF file %s at byte %d" % (filename, pos))
+    return data[:13], gct, frames
+
+
+def concatenate_gifs(input_gifs, output_gif):
+    """Join several animated GIFs into one looping animation.
+
+    The encoded frames are copied over as-is, so no images are decoded or
+    re-encoded. Frames that relied on their file's global colour table get
+    it as a local colour table instead. Missing input files are skipped.
+
+    Parameters
+    ----------
+    input_gifs : list[str]
+        Filepaths of GIFs to join, in order.
+    output_gif : str
+        Filepath of joined GIF.
+    """
+    input_gifs = [g for g in input_gifs if os.path.isfile(g)]
+    if not input_gifs:
+        print 'Skipping GIF making as there are no GIFs to join for %s' % output_gif
         return
 
-    output_gif_filename = os.path.abspath(output_gif_filename)
-    cwd = os.getcwd()
-    # we have to chdir since list file only has bare filenames
-    os.chdir(os.path.dirname(input_file_list))
-    cmd = "%s -dispose Background -delay 50 -loop 0 @%s %s" % (convert_exe, os.path.relpath(input_file_list), os.path.relpath(output_gif_filename))
-    print cmd
-    check_output(cmd.split())
-    os.chdir(cwd)
+    header, out_gct = None, None
+    body = []
+    for gif in input_gifs:
+        this_header, gct, frames = _read_gif_blocks(gif)
+        if header is None:
+            header, out_gct = this_header, gct
+        for control, descriptor, lct, image in frames:
+            if not lct and gct != out_gct:
+                gct_size = int(math.log(len(gct) / 3, 2)) - 1
+                descriptor = descriptor[:9] + chr((ord(descriptor[9]) & 0x78) | 0x80 | gct_size)
+                lct = gct
+            body.extend([control, descriptor, lct, image])
+
+    # NETSCAPE2.0 application extension, with 0 = loop forever
+    loop_ext = '!\xff\x0bNETSCAPE2.0\x03\x01\x00\x00\x00'
+    with open(output_gif, 'wb') as f:
+        # animation extensions need GIF89a
+        f.write('GIF89a' + header[6:] + out_gct + loop_ext + ''.join(body) + ';')
+    print 'Made GIF %s from %d GIFs' % (output_gif, len(input_gifs))
+
+
+##################
+# Plot tasks
+##################
+# Each plot is a task: (plot function, args, kwargs), where the function's
+# first argument is the object being plotted from - either the input file,
+# or an object inside it (e.g. the pairs tree). All the tasks for one input
+# file are run together, so with --jobs each worker process opens the file
+# once, rather than once per plot.
+
+# Input (filename, object name) for worker processes in --jobs mode.
+# Set before the pool is created, so the forked workers inherit it.
+# Each worker opens the file on its first task, and keeps it open for the rest.
+_WORKER_SOURCE = None
+_WORKER_FILE = None
+_WORKER_OBJ = None
+
+
+def plot_task(func, *args, **kwargs):
+    """Make a plot task, i.e. func(<plot object>, *args, **kwargs)"""
+    return (func, args, kwargs)
+
+
+def get_plot_object(input_file, obj_name=None):
+    """Get the object to pass to plot functions: the file itself, or obj_name in it."""
+    return cu.get_from_file(input_file, obj_name) if obj_name else input_file
+
+
+def _run_plot_task(task):
+    """Run one plot task in a worker process, returning the plot function's result."""
+    global _WORKER_FILE, _WORKER_OBJ
+    if _WORKER_FILE is None:
+        ROOT.gROOT.SetBatch(True)
+        filename, obj_name = _WORKER_SOURCE
+        _WORKER_FILE = cu.open_root_file(filename)
+        _WORKER_OBJ = get_plot_object(_WORKER_FILE, obj_name)
+    func, args, kwargs = task
+    return func(_WORKER_OBJ, *args, **kwargs)
+
+
+def run_plot_tasks(filename, tasks, jobs=1, obj_name=None):
+    """Run plot tasks that all use the same input file.
+
+    Parameters
+    ----------
+    filename : str
+        Input ROOT filename.
+    tasks : list[tuple]
+        Plot tasks, made with plot_task().
+    jobs : int, optional
+        Number of worker processes. If 1, run in this process.
+    obj_name : str, optional
+        Name of object in the file to pass to the plot functions.
+        If None, the file itself is passed.
+
+    Returns
+    -------
+    list
+        Result of each plot function, in the same order as tasks, so any
+        filename lists made from them are the same whatever the number of jobs.
+    """
+    global _WORKER_SOURCE
+    if jobs > 1 and len(tasks) > 1:
+        _WORKER_SOURCE = (filename, obj_name)
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.map(_run_plot_task, tasks, chunksize=1)
+        pool.close()
+        pool.join()
+        return results
+
+    input_file = cu.open_root_file(filename)
+    obj = get_plot_object(input_file, obj_name)
+    results = [func(obj, *args, **kwargs) for func, args, kwargs in tasks]
+    input_file.Close()
+    return results
 
 
 def main(in_args=sys.argv[1:]):
@@ -877,8 +1118,9 @@ def main(in_args=sys.argv[1:]):
     parser.add_argument("--gifs",
                         help="Make GIFs (only applicable if --detail is also used)",
                         action='store_true')
-    parser.add_argument("--gifexe",
-                        help='Convert executable to use. Default is result of `which convert`')
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of worker processes to draw plots with. "
+                             "Each worker opens the input file once.")
     args = parser.parse_args(args=in_args)
 
     print args
@@ -892,14 +1134,6 @@ def main(in_args=sys.argv[1:]):
         else:
             print "To use the --gifs flag, you also need --detail"
 
-    if not args.gifexe:
-        args.gifexe = find_executable('convert')
-        if not args.gifexe:
-            print 'Cannot find convert exe, not making gifs'
-            args.gif = False
-        else:
-            print 'Using %s to make GIFs' % args.gifexe
-
     # customise titles
     # note the use of global keyword
     if args.title:
@@ -931,109 +1165,129 @@ def main(in_args=sys.argv[1:]):
     # Choose eta
     ptBins = binning.pt_bins_stage2
 
+    def gif_filename(list_file):
+        """Animated GIF to make alongside a plot list file, if --gifs"""
+        return list_file.replace('.txt', '.gif') if args.gifs else None
+
     # Do plots with output from RunMatcher
     # ------------------------------------------------------------------------
     if args.pairs:
-        pairs_file = cu.open_root_file(args.pairs)
-        pairs_tree = cu.get_from_file(pairs_file, "valid")
+        pairs_tasks = []
 
         # eta binned
         for emin, emax in pairwise(binning.eta_bins):
-            plot_dR(pairs_tree, eta_min=emin, eta_max=emax, cut="1", oDir=args.oDir)
-            plot_pt_both(pairs_tree, eta_min=emin, eta_max=emax, cut="1", oDir=args.oDir)
+            pairs_tasks.append(plot_task(plot_dR, eta_min=emin, eta_max=emax, cut="1",
+                                         oDir=args.oDir))
+            pairs_tasks.append(plot_task(plot_pt_both, eta_min=emin, eta_max=emax, cut="1",
+                                         oDir=args.oDir))
 
-        # plot_dR(pairs_tree, eta_min=0, eta_max=5, cut="1", oDir=args.oDir)  # all eta
-        # plot_pt_both(pairs_tree, eta_min=0, eta_max=5, cut="1", oDir=args.oDir)  # all eta
-        plot_eta_both(pairs_tree, oDir=args.oDir)  # all eta
+        # pairs_tasks.append(plot_task(plot_dR, eta_min=0, eta_max=5, cut="1",
+        #                              oDir=args.oDir))  # all eta
+        # pairs_tasks.append(plot_task(plot_pt_both, eta_min=0, eta_max=5, cut="1",
+        #                              oDir=args.oDir))  # all eta
+        pairs_tasks.append(plot_task(plot_eta_both, oDir=args.oDir))  # all eta
 
-        plot_dR(pairs_tree, eta_min=0, eta_max=3, cut="1", oDir=args.oDir)  # central
-        plot_pt_both(pairs_tree, eta_min=0, eta_max=3, cut="1", oDir=args.oDir)  # central
+        pairs_tasks.append(plot_task(plot_dR, eta_min=0, eta_max=3, cut="1",
+                                     oDir=args.oDir))  # central
+        pairs_tasks.append(plot_task(plot_pt_both, eta_min=0, eta_max=3, cut="1",
+                                     oDir=args.oDir))  # central
 
-        plot_dR(pairs_tree, eta_min=3, eta_max=5, cut="1", oDir=args.oDir)  # forward
-        plot_pt_both(pairs_tree, eta_min=3, eta_max=5, cut="1", oDir=args.oDir)  # forward
+        pairs_tasks.append(plot_task(plot_dR, eta_min=3, eta_max=5, cut="1",
+                                     oDir=args.oDir))  # forward
+        pairs_tasks.append(plot_task(plot_pt_both, eta_min=3, eta_max=5, cut="1",
+                                     oDir=args.oDir))  # forward
 
-        pairs_file.Close()
+        run_plot_tasks(args.pairs, pairs_tasks, args.jobs, obj_name="valid")
 
     # Do plots with output from makeResolutionPlots.py
     # ------------------------------------------------------------------------
     if args.res:
-        res_file = cu.open_root_file(args.res)
+        res_tasks = []
         # pt_min = binning.pt_bins[10]
         # pt_max = binning.pt_bins[11]
         # for the first 4 bins - troublesome
 
         # exclusive eta graphs
         # for emin, emax in izip(binning.eta_bins[:-1], binning.eta_bins[1:]):
-            # plot_res_all_pt([res_file], emin, emax, args.oDir, args.format)
-            # for pt_min, pt_max in izip(binning.pt_bins[4:-1], binning.pt_bins[5:]):
-            #     plot_pt_diff(res_file, emin, emax, pt_min, pt_max, args.oDir, args.format)
-            # plot_res_pt_bin(res_file, eta_min, eta_max, pt_min, pt_max, args.oDir, args.format)
+        #     res_tasks.append(plot_task(plot_res_all_pt, emin, emax, args.oDir, args.format))
+        #     for pt_min, pt_max in izip(binning.pt_bins[4:-1], binning.pt_bins[5:]):
+        #         res_tasks.append(plot_task(plot_pt_diff, emin, emax, pt_min, pt_max, args.oDir,
+        #                                    args.format))
+        #     res_tasks.append(plot_task(plot_res_pt_bin, eta_min, eta_max, pt_min, pt_max,
+        #                                args.oDir, args.format))
 
         # inclusive eta graphs
         for (eta_min, eta_max) in [[0, 3], [3, 5]]:
-            plot_res_all_pt(res_file, eta_min, eta_max, args.oDir, args.format)
-            plot_ptDiff_Vs_pt(res_file, eta_min, eta_max, args.oDir, args.format)
+            res_tasks.append(plot_task(plot_res_all_pt, eta_min, eta_max, args.oDir, args.format))
+            res_tasks.append(plot_task(plot_ptDiff_Vs_pt, eta_min, eta_max, args.oDir, args.format))
 
-        # plot_eta_pt_rsp_2d(res_file, binning.eta_bins, binning.pt_bins[4:], args.oDir, args.format)
+        # res_tasks.append(plot_task(plot_eta_pt_rsp_2d, binning.eta_bins, binning.pt_bins[4:],
+        #                            args.oDir, args.format))
 
         # components of these:
         for pt_min, pt_max in izip(binning.pt_bins[4:-1], binning.pt_bins[5:]):
-            plot_pt_diff(res_file, 0, 3, pt_min, pt_max, args.oDir, args.format)
-            # plot_pt_diff(res_file, 0, 5, pt_min, pt_max, args.oDir, args.format)
-            # plot_pt_diff(res_file, 3, 5, pt_min, pt_max, args.oDir, args.format)
+            res_tasks.append(plot_task(plot_pt_diff, 0, 3, pt_min, pt_max, args.oDir, args.format))
+            # res_tasks.append(plot_task(plot_pt_diff, 0, 5, pt_min, pt_max, args.oDir,
+            #                            args.format))
+            # res_tasks.append(plot_task(plot_pt_diff, 3, 5, pt_min, pt_max, args.oDir,
+            #                            args.format))
 
-        res_file.Close()
+        run_plot_tasks(args.res, res_tasks, args.jobs)
 
     # Do plots with output from checkCalibration.py
     # ------------------------------------------------------------------------
     if args.checkcal:
 
         etaBins = binning.eta_bins
-        check_file = cu.open_root_file(args.checkcal)
+        check_tasks = []
 
         # ptBinsWide = list(np.arange(10, 250, 8))
 
+        # Sequences of plots that get a list file (and a GIF) are run as one
+        # task with plot_frames(). To write the lists, we need the filenames
+        # returned by those tasks, so store the index of those tasks here
+        detail_list_tasks = []  # (pt list file, task index, ptRef list file, task index)
+        eta_list_tasks = []  # (pt list file, task index, ptRef list file, task index)
+
         # indiviudal eta bins
         for eta_min, eta_max in pairwise(etaBins):
             for (normX, logZ) in product([True, False], [True, False]):
-                plot_l1_Vs_ref(check_file, eta_min, eta_max, logZ, args.oDir, 'png')
-                plot_rsp_Vs_l1(check_file, eta_min, eta_max, normX, logZ, args.oDir, 'png')
-                plot_rsp_Vs_ref(check_file, eta_min, eta_max, normX, logZ, args.oDir, 'png')
-                plot_rsp_Vs_pt_candle_violin(check_file, eta_min, eta_max, "l1", args.oDir, 'png')
-                plot_rsp_Vs_pt_candle_violin(check_file, eta_min, eta_max, "gen", args.oDir, 'png')
+                check_tasks.append(plot_task(plot_l1_Vs_ref, eta_min, eta_max, logZ, args.oDir,
+                                             'png'))
+                check_tasks.append(plot_task(plot_rsp_Vs_l1, eta_min, eta_max, normX, logZ,
+                                             args.oDir, 'png'))
+                check_tasks.append(plot_task(plot_rsp_Vs_ref, eta_min, eta_max, normX, logZ,
+                                             args.oDir, 'png'))
+                check_tasks.append(plot_task(plot_rsp_Vs_pt_candle_violin, eta_min, eta_max, "l1",
+                                             args.oDir, 'png'))
+                check_tasks.append(plot_task(plot_rsp_Vs_pt_candle_violin, eta_min, eta_max, "gen",
+                                             args.oDir, 'png'))
 
             if args.detail:
                 list_dir = os.path.join(args.oDir, 'eta_%g_%g' % (eta_min, eta_max))
                 cu.check_dir_exists_create(list_dir)
 
                 # print individual histograms, and make a list suitable for imagemagick to turn into a GIF
-                pt_plot_filenames = plot_rsp_pt_hists(check_file, eta_min, eta_max, ptBins, "pt", args.oDir, 'png')
-                pt_plot_filenames_file = os.path.join(list_dir, 'list_pt.txt')
-                write_filelist(pt_plot_filenames, pt_plot_filenames_file)
-
-                # print individual histograms, and make a list suitable for imagemagick to turn into a GIF
-                ptRef_plot_filenames = plot_rsp_pt_hists(check_file, eta_min, eta_max, ptBins, "ptRef", args.oDir, 'png')
-                ptRef_plot_filenames_file = os.path.join(list_dir, 'list_ptRef.txt')
-                write_filelist(ptRef_plot_filenames, ptRef_plot_filenames_file)
-
-                # make dem GIFs
-                if args.gifs:
-                    for inf in [pt_plot_filenames_file, ptRef_plot_filenames_file]:
-                        make_gif(inf, inf.replace('.txt', '.gif'), args.gifexe)
-                else:
-                    print "To make animated gif from PNGs using a plot list:"
-                    print "convert -dispose Background -delay 50 -loop 0 @%s " \
-                        "%s" % (pt_plot_filenames_file,
-                                os.path.basename(pt_plot_filenames_file).replace(".txt", ".gif"))
+                pt_list_file = os.path.join(list_dir, 'list_pt.txt')
+                ptRef_list_file = os.path.join(list_dir, 'list_ptRef.txt')
+                detail_list_tasks.append((pt_list_file, len(check_tasks), ptRef_list_file,
+                                          len(check_tasks) + 1))
+                check_tasks.append(plot_task(plot_frames,
+                                             [plot_task(plot_rsp_pt_hists, eta_min, eta_max, ptBins,
+                                                        "pt", args.oDir, 'png')],
+                                             gif_filename(pt_list_file)))
+                check_tasks.append(plot_task(plot_frames,
+                                             [plot_task(plot_rsp_pt_hists, eta_min, eta_max, ptBins,
+                                                        "ptRef", args.oDir, 'png')],
+                                             gif_filename(ptRef_list_file)))
 
         # Graph of response vs pt, but in bins of eta
         x_range = [0, 150]  # for zoomed-in low pt
         x_range = None
-        plot_rsp_pt_binned_graph(check_file, etaBins, "pt", args.oDir, args.format, x_range=x_range)
-        plot_rsp_pt_binned_graph(check_file, etaBins, "ptRef", args.oDir, args.format, x_range=x_range)
-
-        all_rsp_pt_plot_filenames = []
-        all_rsp_ptRef_plot_filenames = []
+        check_tasks.append(plot_task(plot_rsp_pt_binned_graph, etaBins, "pt", args.oDir,
+                                     args.format, x_range=x_range))
+        check_tasks.append(plot_task(plot_rsp_pt_binned_graph, etaBins, "ptRef", args.oDir,
+                                     args.format, x_range=x_range))
 
         # Loop over central/forward eta, do 2D plots, and graphs, and component hists
         # ALSO EDITED THE MIN AND MAX ETAS HERE
@@ -1041,68 +1295,97 @@ def main(in_args=sys.argv[1:]):
             print eta_min, eta_max
 
             for (normX, logZ) in product([True, False], [True, False]):
-                plot_l1_Vs_ref(check_file, eta_min, eta_max, logZ, args.oDir, 'png')
-                plot_rsp_Vs_l1(check_file, eta_min, eta_max, normX, logZ, args.oDir, 'png')
-                plot_rsp_Vs_ref(check_file, eta_min, eta_max, normX, logZ, args.oDir, 'png')
+                check_tasks.append(plot_task(plot_l1_Vs_ref, eta_min, eta_max, logZ, args.oDir,
+                                             'png'))
+                check_tasks.append(plot_task(plot_rsp_Vs_l1, eta_min, eta_max, normX, logZ,
+                                             args.oDir, 'png'))
+                check_tasks.append(plot_task(plot_rsp_Vs_ref, eta_min, eta_max, normX, logZ,
+                                             args.oDir, 'png'))
 
             if args.detail:
-                plot_rsp_pt_hists(check_file, eta_min, eta_max, ptBins, "pt", args.oDir, 'png')
-                plot_rsp_pt_hists(check_file, eta_min, eta_max, ptBins, "ptRef", args.oDir, 'png')
+                check_tasks.append(plot_task(plot_rsp_pt_hists, eta_min, eta_max, ptBins, "pt",
+                                             args.oDir, 'png'))
+                check_tasks.append(plot_task(plot_rsp_pt_hists, eta_min, eta_max, ptBins, "ptRef",
+                                             args.oDir, 'png'))
 
             # graphs
-            plot_rsp_eta_inclusive_graph(check_file, eta_min, eta_max, 'pt', args.oDir, args.format)
-            plot_rsp_eta_inclusive_graph(check_file, eta_min, eta_max, 'ptRef', args.oDir, args.format)
-            plot_rsp_eta_exclusive_graph(check_file, eta_min, eta_max, binning.check_pt_bins, 'pt', args.oDir, args.format)
-            plot_rsp_eta_exclusive_graph(check_file, eta_min, eta_max, binning.check_pt_bins, 'ptRef', args.oDir, args.format)
-
-            plot_rsp_pt_graph(check_file, eta_min, eta_max, args.oDir, args.format)
-            plot_rsp_ptRef_graph(check_file, eta_min, eta_max, args.oDir, args.format)
+            check_tasks.append(plot_task(plot_rsp_eta_inclusive_graph, eta_min, eta_max, 'pt',
+                                         args.oDir, args.format))
+            check_tasks.append(plot_task(plot_rsp_eta_inclusive_graph, eta_min, eta_max, 'ptRef',
+                                         args.oDir, args.format))
+            check_tasks.append(plot_task(plot_rsp_eta_exclusive_graph, eta_min, eta_max,
+                                         binning.check_pt_bins, 'pt', args.oDir, args.format))
+            check_tasks.append(plot_task(plot_rsp_eta_exclusive_graph, eta_min, eta_max,
+                                         binning.check_pt_bins, 'ptRef', args.oDir, args.format))
+
+            check_tasks.append(plot_task(plot_rsp_pt_graph, eta_min, eta_max, args.oDir,
+                                         args.format))
+            check_tasks.append(plot_task(plot_rsp_ptRef_graph, eta_min, eta_max, args.oDir,
+                                         args.format))
 
             for etamin, etamax in pairwise(etaBins):
                 if etamin < eta_min or etamax > eta_max:
                     continue
                 print etamin, etamax
-                this_rsp_pt_plot_filenames = []
-                this_rsp_ptRef_plot_filenames = []
                 # component hists/fits for the eta graphs, binned by pt
-                for pt_min, pt_max in binning.check_pt_bins:
-                    pt_filename = plot_rsp_eta_bin_pt(check_file, etamin, etamax, 'pt', pt_min, pt_max, args.oDir, 'png')
-                    if pt_filename:
-                        this_rsp_pt_plot_filenames.append(pt_filename)
-                    ptRef_filename = plot_rsp_eta_bin_pt(check_file, etamin, etamax, 'ptRef', pt_min, pt_max, args.oDir, 'png')
-                    if ptRef_filename:
-                        this_rsp_ptRef_plot_filenames.append(ptRef_filename)
-
                 pt_list_file = os.path.join(args.oDir, 'list_pt_eta_%g_%g.txt' % (etamin, etamax))
-                write_filelist(this_rsp_pt_plot_filenames, pt_list_file)
-                if args.gifs:
-                    make_gif(pt_list_file, pt_list_file.replace('.txt', '.gif'), args.gifexe)
+                ptRef_list_file = os.path.join(args.oDir,
+                                               'list_ptRef_eta_%g_%g.txt' % (etamin, etamax))
+                eta_list_tasks.append((pt_list_file, len(check_tasks), ptRef_list_file,
+                                       len(check_tasks) + 1))
+                check_tasks.append(plot_task(plot_frames,
+                                             [plot_task(plot_rsp_eta_bin_pt, etamin, etamax, 'pt',
+                                                        pt_min, pt_max, args.oDir, 'png')
+                                              for pt_min, pt_max in binning.check_pt_bins],
+                                             gif_filename(pt_list_file)))
+                check_tasks.append(plot_task(plot_frames,
+                                             [plot_task(plot_rsp_eta_bin_pt, etamin, etamax,
+                                                        'ptRef', pt_min, pt_max, args.oDir, 'png')
+                                              for pt_min, pt_max in binning.check_pt_bins],
+                                             gif_filename(ptRef_list_file)))
+
+        check_results = run_plot_tasks(args.checkcal, check_tasks, args.jobs)
+
+        for pt_list_file, pt_ind, ptRef_list_file, ptRef_ind in detail_list_tasks:
+            write_filelist(check_results[pt_ind][0], pt_list_file)
+            write_filelist(check_results[ptRef_ind][0], ptRef_list_file)
+            if not args.gifs:
+                print "To make animated gif from PNGs using a plot list:"
+                print "convert -dispose Background -delay 50 -loop 0 @%s " \
+                    "%s" % (pt_list_file, os.path.basename(pt_list_file).replace(".txt", ".gif"))
+
+        all_rsp_pt_plot_filenames = []
+        all_rsp_ptRef_plot_filenames = []
 
-                ptRef_list_file = os.path.join(args.oDir, 'list_ptRef_eta_%g_%g.txt' % (etamin, etamax))
-                write_filelist(this_rsp_ptRef_plot_filenames, ptRef_list_file)
-                if args.gifs:
-                    make_gif(ptRef_list_file, ptRef_list_file.replace('.txt', '.gif'), args.gifexe)
+        for pt_list_file, pt_ind, ptRef_list_file, ptRef_ind in eta_list_tasks:
+            this_rsp_pt_plot_filenames = filter(None, check_results[pt_ind])
+            write_filelist(this_rsp_pt_plot_filenames, pt_list_file)
+            this_rsp_ptRef_plot_filenames = filter(None, check_results[ptRef_ind])
+            write_filelist(this_rsp_ptRef_plot_filenames, ptRef_list_file)
 
-                all_rsp_pt_plot_filenames.extend(this_rsp_pt_plot_filenames)
-                all_rsp_ptRef_plot_filenames.extend(this_rsp_ptRef_plot_filenames)
+            all_rsp_pt_plot_filenames.extend(this_rsp_pt_plot_filenames)
+            all_rsp_ptRef_plot_filenames.extend(this_rsp_ptRef_plot_filenames)
 
+        # these are the eta bin GIFs joined together, so no need to redraw anything
         pt_list_file = os.path.join(args.oDir, 'list_pt_eta_%g_%g.txt' % (etaBins[0], etaBins[-1]))
         write_filelist(all_rsp_pt_plot_filenames, pt_list_file)
         if args.gifs:
-            make_gif(pt_list_file, pt_list_file.replace('.txt', '.gif'), args.gifexe)
+            concatenate_gifs([gif_filename(t[0]) for t in eta_list_tasks],
+                             gif_filename(pt_list_file))
 
         ptRef_list_file = os.path.join(args.oDir, 'list_ptRef_eta_%g_%g.txt' % (etaBins[0], etaBins[-1]))
         write_filelist(all_rsp_ptRef_plot_filenames, ptRef_list_file)
         if args.gifs:
-            make_gif(ptRef_list_file, ptRef_list_file.replace('.txt', '.gif'), args.gifexe)
-
-        check_file.Close()
+            concatenate_gifs([gif_filename(t[2]) for t in eta_list_tasks],
+                             gif_filename(ptRef_list_file))
 
     # Do plots with output from runCalibration.py
     # ------------------------------------------------------------------------
     if args.calib:
 
-        calib_file = cu.open_root_file(args.calib)
+        calib_tasks = []
+        # (eta min, eta max, rsp list file, task index, pt list file, task index)
+        detail_list_tasks = []
 
         for eta_min, eta_max in pairwise(binning.eta_bins):
 
@@ -1110,8 +1393,10 @@ def main(in_args=sys.argv[1:]):
 
             # 2D correlation heat maps
             for (normX, logZ) in product([True, False], [True, False]):
-                plot_rsp_Vs_ref(calib_file, eta_min, eta_max, normX, logZ, args.oDir, 'png')
-                plot_rsp_Vs_l1(calib_file, eta_min, eta_max, normX, logZ, args.oDir, 'png')
+                calib_tasks.append(plot_task(plot_rsp_Vs_ref, eta_min, eta_max, normX, logZ,
+                                             args.oDir, 'png'))
+                calib_tasks.append(plot_task(plot_rsp_Vs_l1, eta_min, eta_max, normX, logZ,
+                                             args.oDir, 'png'))
 
             # individual fit histograms for each pt bin
             if args.detail:
@@ -1122,36 +1407,36 @@ def main(in_args=sys.argv[1:]):
                 if eta_min > 2.9:
                     ptBins = binning.pt_bins_stage2_hf
 
-                rsp_plot_filenames = []
-                pt_plot_filenames = []
-
-                for pt_min, pt_max in pairwise(ptBins):
-                    rsp_name = plot_rsp_eta_pt_bin(calib_file, eta_min, eta_max, pt_min, pt_max, args.oDir, 'png')
-                    rsp_plot_filenames.append(rsp_name)
-                    pt_name = plot_pt_bin(calib_file, eta_min, eta_max, pt_min, pt_max, args.oDir, 'png')
-                    pt_plot_filenames.append(pt_name)
-
-                # print individual histograms, and make a list suitable for imagemagick to turn into a GIF
-                rsp_plot_filenames_file = os.path.join(list_dir, 'list_rsp.txt')
-                write_filelist(rsp_plot_filenames, rsp_plot_filenames_file)
-
-                # print individual histograms, and make a list suitable for imagemagick to turn into a GIF
-                pt_plot_filenames_file = os.path.join(list_dir, 'list_pt.txt')
-                write_filelist(pt_plot_filenames, pt_plot_filenames_file)
-
-                # make dem gifs
-                if args.gifs:
-                    for inf in [pt_plot_filenames_file, rsp_plot_filenames_file]:
-                        make_gif(inf, inf.replace('.txt', '.gif'), args.gifexe)
-                else:
-                    print "To make animated gif from PNGs using a plot list:"
-                    print "convert -dispose Background -delay 50 -loop 0 @%s "\
-                        "pt_eta_%g_%g.gif" % (pt_plot_filenames_file, eta_min, eta_max)
+                # print individual histograms, and make a list suitable for imagemagick
+                # to turn into a GIF
+                rsp_list_file = os.path.join(list_dir, 'list_rsp.txt')
+                pt_list_file = os.path.join(list_dir, 'list_pt.txt')
+                detail_list_tasks.append((eta_min, eta_max, rsp_list_file, len(calib_tasks),
+                                          pt_list_file, len(calib_tasks) + 1))
+                calib_tasks.append(plot_task(plot_frames,
+                                             [plot_task(plot_rsp_eta_pt_bin, eta_min, eta_max,
+                                                        pt_min, pt_max, args.oDir, 'png')
+                                              for pt_min, pt_max in pairwise(ptBins)],
+                                             gif_filename(rsp_list_file)))
+                calib_tasks.append(plot_task(plot_frames,
+                                             [plot_task(plot_pt_bin, eta_min, eta_max, pt_min,
+                                                        pt_max, args.oDir, 'png')
+                                              for pt_min, pt_max in pairwise(ptBins)],
+                                             gif_filename(pt_list_file)))
 
             # the correction curve graph
-            plot_correction_graph(calib_file, eta_min, eta_max, args.oDir, args.format)
-
-        calib_file.Close()
+            calib_tasks.append(plot_task(plot_correction_graph, eta_min, eta_max, args.oDir,
+                                         args.format))
+
+        calib_results = run_plot_tasks(args.calib, calib_tasks, args.jobs)
+
+        for eta_min, eta_max, rsp_list_file, rsp_ind, pt_list_file, pt_ind in detail_list_tasks:
+            write_filelist(calib_results[rsp_ind], rsp_list_file)
+            write_filelist(calib_results[pt_ind], pt_list_file)
+            if not args.gifs:
+                print "To make animated gif from PNGs using a plot list:"
+                print "convert -dispose Background -delay 50 -loop 0 @%s "\
+                    "pt_eta_%g_%g.gif" % (pt_list_file, eta_min, eta_max)
 
     if args.zip:
         print 'Zipping up files'
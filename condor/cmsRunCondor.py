@@ -17,7 +17,6 @@ Robin Aggleton 2015, in a rush
 import os
 import re
 import sys
-import json
 import math
 import logging
 import tarfile
@@ -25,6 +24,7 @@ import argparse
 import subprocess
 from time import strftime
 from itertools import izip_longest
+import L1Trigger.L1JetEnergyCorrections.das_cache as das_cache
 
 
 logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
@@ -141,6 +141,8 @@ def setup_sandbox(sandbox_filename, sandbox_dest_dir, config_filename, input_fil
 def get_list_of_files_from_das(dataset, num_files):
     """Create list of num_files filenames for dataset using DAS.
 
+    Uses the on-disk DAS cache, so repeated submissions don't have to wait on DAS.
+
     Parameters
     ----------
     dataset : str
@@ -159,28 +161,14 @@ def get_list_of_files_from_das(dataset, num_files):
         If DAS fails to find dataset
 
     """
-    # TODO: use das_client API
-    log.info("Querying DAS for dataset info, please be patient...")
-    cmds = ['das_client.py',
-            '--query',
-            'summary dataset=%s' % dataset,
-            '--format=json']
-    output_summary = subprocess.check_output(cmds, stderr=subprocess.STDOUT)
-    log.debug(output_summary)
-    summary = json.loads(output_summary)
-
-    # check to make sure dataset is valid
-    if summary['status'] == 'fail':
-        log.error('Error querying dataset with das_client:')
-        log.error(summary['reason'])
-        raise RuntimeError('Error querying dataset with das_client')
+    # DAS results are cached, see das_cache
+    num_dataset_files = das_cache.get_number_files(dataset)
 
     # get required number of files
     # can either have:
     # < 0 : all files
     # 0 - 1 : use that fraction of the dataset
     # >= 1 : use that number of files
-    num_dataset_files = int(summary['data'][0]['summary'][0]['nfiles'])
     if num_files < 0:
         num_files = num_dataset_files
     elif num_files < 1:
@@ -191,15 +179,7 @@ def get_list_of_files_from_das(dataset, num_files):
                     num_dataset_files)
 
     # Make a list of input files for each job to avoid doing it on worker node
-    log.info("Querying DAS for filenames, please be patient...")
-    cmds = ['das_client.py',
-            '--query',
-            'file dataset=%s' % dataset,
-            '--limit=%d' % num_files]
-    output_files = subprocess.check_output(cmds, stderr=subprocess.STDOUT)
-
-    list_of_files = ['"{0}"'.format(line) for line in output_files.splitlines()
-                     if line.lower().startswith("/store")]
+    list_of_files = ['"{0}"'.format(f) for f in das_cache.get_files(dataset, num_files)]
     return list_of_files
 
 
@@ -324,8 +304,14 @@ def cmsRunCondor(in_args=sys.argv[1:]):
                         'You do not need to specify --filesPerJob, --totalFiles, or --dataset. '
                         'You should recompile with `scram b clean; scram b USER_CXXFLAGS="-g"`',
                         action='store_true')
+    parser.add_argument('--dasOffline',
+                        help='Get dataset info from this DAS snapshot JSON file, '
+                        'instead of querying DAS. See das_cache.py.')
     args = parser.parse_args(args=in_args)
 
+    if args.dasOffline:
+        das_cache.set_offline(args.dasOffline)
+
     if args.verbose:
         log.setLevel(logging.DEBUG)
 
@@ -15,6 +15,12 @@ so you can check it over BEFORE running it.
 Also writes a simple shell script (crab_get_hadd_all.sh) to run all
 the crab_get_hadd_*.sh in one go.
 
+Alternatively, use --run to do it all directly, with several datasets at once:
+crab status & getoutput run in a pool of threads (--jobs), and each dataset is
+hadded in a pool of processes (--haddJobs) as soon as its files are retrieved.
+Job IDs already retrieved are recorded in a manifest file in each crab
+directory, so they are not retrieved again if it is re-run.
+
 Must be run in L1JetEnergyCorrections/crab directory.
 
 For various options (such as only get a fraction of jobs), use --help/-h
@@ -26,6 +32,10 @@ import subprocess
 from glob import glob
 import os
 import stat
+import json
+import threading
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 from CRABAPI.RawCommand import crabCommand
 import sys
 from time import strftime
@@ -33,6 +43,202 @@ from time import strftime
 
 env_shebang = '#!/bin/bash -e'
 
+# Records job IDs whose output has been retrieved, in each crab dir
+MANIFEST_NAME = 'get_hadd_manifest.json'
+
+# Number of times to try crab getoutput for missing files
+GETOUTPUT_TRIES = 11
+
+# The CRAB API isn't thread-safe, so only do one crabCommand at a time
+CRAB_LOCK = threading.Lock()
+
+
+def select_job_ids(res_status, completed, fraction, strict):
+    """Get IDs of finished jobs to retrieve, from crab status.
+
+    Parameters
+    ----------
+    res_status : dict
+        Output from crabCommand('status').
+    completed : bool
+        Need all jobs to have finished.
+    fraction : float
+        Fraction of jobs that must have finished (if not completed).
+    strict : bool
+        Only get exactly that fraction of jobs, and no more.
+
+    Returns
+    -------
+    list[str], int, int
+        Finished job IDs to get, total number of jobs, number of jobs needed.
+    """
+    n_jobs = len(res_status['jobs'])
+    job_ids = []
+    if completed:
+        n_jobs_to_get = n_jobs
+    else:
+        n_jobs_to_get = int(round(fraction * n_jobs))
+
+    # Get the requisite number of jobs (or more), making sure they completed
+    for i in range(1, n_jobs + 1):
+        if res_status['jobs'][str(i)]['State'] == 'finished':
+            job_ids.append(str(i))
+        if strict and (len(job_ids) == n_jobs_to_get):
+            break
+    return job_ids, n_jobs, n_jobs_to_get
+
+
+def get_result_file(crab_dir, job_id):
+    """Get output file for a job in the crab results dir, or None if it isn't there."""
+    files = glob(os.path.join(crab_dir, 'results', '*_%s.root' % job_id))
+    return files[0] if files else None
+
+
+def load_manifest(crab_dir):
+    """Get set of job IDs already retrieved that still have their output file."""
+    manifest = os.path.join(crab_dir, MANIFEST_NAME)
+    if not os.path.isfile(manifest):
+        return set()
+    with open(manifest) as f:
+        job_ids = json.load(f)
+    return set(j for j in job_ids if get_result_file(crab_dir, j))
+
+
+def save_manifest(crab_dir, job_ids):
+    """Save job IDs retrieved. Written to a temp file first, so it's never half-written."""
+    manifest = os.path.join(crab_dir, MANIFEST_NAME)
+    with open(manifest + '.tmp', 'w') as f:
+        json.dump(sorted(job_ids, key=int), f)
+    os.rename(manifest + '.tmp', manifest)
+
+
+def retrieve_dataset(task):
+    """Get status of one crab task, and get the output of its finished jobs.
+
+    Designed to run in a thread.
+
+    Parameters
+    ----------
+    task : tuple
+        (dataset name, crab dir, output path, completed, fraction, strict)
+
+    Returns
+    -------
+    str, str, list[str], str
+        Dataset name, output path, output files to hadd (None if failed),
+        and summary message.
+    """
+    name, crab_dir, output_path, completed, fraction, strict = task
+    try:
+        with CRAB_LOCK:
+            res_status = crabCommand('status', crab_dir)
+        if res_status['status'] in ['UNKNOWN']:
+            return name, output_path, None, "Unknown status - skipping"
+
+        job_ids, n_jobs, n_jobs_to_get = select_job_ids(res_status, completed, fraction, strict)
+        if len(job_ids) < n_jobs_to_get:
+            msg = "Not enough jobs finished! - skipping. Need %d jobs, only found %d"
+            return name, output_path, None, msg % (n_jobs_to_get, len(job_ids))
+
+        # Only get files not already retrieved.
+        # If there are any missing, try again several times
+        retrieved = load_manifest(crab_dir)
+        for _ in range(GETOUTPUT_TRIES):
+            to_get = [j for j in job_ids if j not in retrieved]
+            if not to_get:
+                break
+            print "Getting %d files %s from %s" % (len(to_get), to_get, crab_dir)
+            # wish I could use the CRAB API here but doesn't like --jobids option
+            if subprocess.call(['crab', 'getoutput', '--jobids', ','.join(to_get), crab_dir]) == 0:
+                retrieved.update(j for j in to_get if get_result_file(crab_dir, j))
+                save_manifest(crab_dir, retrieved)
+
+        missing = [j for j in job_ids if j not in retrieved]
+        if missing:
+            msg = "Could not get all files. Please check! Missing %s" % missing
+            return name, output_path, None, msg
+        files = [get_result_file(crab_dir, j) for j in job_ids]
+        msg = "%d / %d  ( = %3.1f %% )" % (len(job_ids), n_jobs, 100. * len(job_ids) / n_jobs)
+        return name, output_path, files, msg
+    except Exception as err:
+        return name, output_path, None, "Failed: %s" % err
+
+
+def hadd_dataset(crab_dir, output_path, files):
+    """hadd output files for one dataset, then remove them.
+
+    Designed to run in a separate process.
+    Output is made as a temp file, then renamed, so a failed hadd never
+    leaves a file at output_path (which would make it skip the dataset).
+
+    Returns
+    -------
+    int
+        hadd return code.
+    """
+    tmp_path = output_path.replace('.root', '_tmp.root')
+    ret = subprocess.call(['hadd', '-f', tmp_path] + files)
+    if ret != 0:
+        return ret
+    os.rename(tmp_path, output_path)
+    for f in files:
+        os.remove(f)
+    os.remove(os.path.join(crab_dir, MANIFEST_NAME))
+    return ret
+
+
+def run_get_hadd(tasks, n_jobs, n_hadd_jobs):
+    """Retrieve & hadd output for all datasets, several at once.
+
+    Each dataset is hadded as soon as its files have been retrieved,
+    while other datasets are still being retrieved.
+
+    Parameters
+    ----------
+    tasks : list[tuple]
+        Task for each dataset, see retrieve_dataset().
+    n_jobs : int
+        Number of datasets to retrieve at once.
+    n_hadd_jobs : int
+        Number of hadds to run at once.
+
+    Returns
+    -------
+    dict
+        Summary message for each dataset.
+    """
+    summary = {}
+    if not tasks:
+        return summary
+    # make process pool first, so its processes don't fork from a threaded process
+    hadd_pool = Pool(min(n_hadd_jobs, len(tasks)))
+    thread_pool = ThreadPool(min(n_jobs, len(tasks)))
+    crab_dirs = {t[0]: t[1] for t in tasks}
+    hadd_results = {}
+    for name, output_path, files, msg in thread_pool.imap_unordered(retrieve_dataset, tasks):
+        print ' ++++ Retrieved %s: %s' % (name, msg)
+        summary[name] = msg
+        if files is None:
+            continue
+        print "Will make output file %s" % output_path
+        hadd_args = (crab_dirs[name], output_path, files)
+        hadd_results[name] = hadd_pool.apply_async(hadd_dataset, hadd_args)
+    thread_pool.close()
+    thread_pool.join()
+    hadd_pool.close()
+    # one failed dataset shouldn't stop us collecting the others
+    for name, result in hadd_results.iteritems():
+        try:
+            ret = result.get()
+        except Exception as err:
+            summary[name] += ' - hadd FAILED: %s' % err
+            continue
+        if ret != 0:
+            summary[name] += ' - hadd FAILED'
+    hadd_pool.join()
+    return summary
+
+
 def get_hadd(in_args=sys.argv[1:]):
     """
     Loops through crab working area, and for each dataset outputs commands to
@@ -42,15 +248,21 @@ def get_hadd(in_args=sys.argv[1:]):
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("crab_dir", help='Working area')
     parser.add_argument("--completed", action='store_true',
-        help="Only make command file if all jobs have finished successfully")
+                        help="Only make command file if all jobs have finished successfully")
     parser.add_argument("--fraction", type=float, default=0.9,
-        help="Specify fraction of jobs that must have finished successfully. " \
-             "--completed overrides this option. Note that if a larger " \
-             "fraction of jobs have finished successfully, " \
-             "they will also be retrieved (to avoid this, use --strict).")
+                        help="Specify fraction of jobs that must have finished successfully. "
+                             "--completed overrides this option. Note that if a larger "
+                             "fraction of jobs have finished successfully, "
+                             "they will also be retrieved (to avoid this, use --strict).")
     parser.add_argument("--strict", action='store_true',
-        help="If using --fraction, this ensures that exactly that fraction " \
-             "of jobs are retrieved.")
+                        help="If using --fraction, this ensures that exactly that fraction "
+                             "of jobs are retrieved.")
+    parser.add_argument("--run", action='store_true',
+                        help="Retrieve & hadd the output now, rather than writing shell scripts.")
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="With --run, number of datasets to retrieve at once.")
+    parser.add_argument("--haddJobs", type=int, default=2,
+                        help="With --run, number of hadds to run at once.")
     args = parser.parse_args(args=in_args)
 
     crab_area = args.crab_dir.rstrip('/')  # important!
@@ -59,6 +271,8 @@ def get_hadd(in_args=sys.argv[1:]):
 
     summary = {}
 
+    tasks = []  # for --run
+
     # Loop over each dataset
     for f in os.listdir(crab_area):
 
@@ -94,22 +308,14 @@ def get_hadd(in_args=sys.argv[1:]):
         completed = args.completed
         fraction = args.fraction
         strict = args.strict
+        if args.run:
+            tasks.append((f, crab_dir, output_path, completed, fraction, strict))
+            continue
+
         res_status = crabCommand('status', crab_dir)
         if res_status['status'] in ['UNKNOWN']:
             continue
-        n_jobs = len(res_status['jobs'])
-        job_ids = []
-        if completed:
-            n_jobs_to_get = n_jobs
-        else:
-            n_jobs_to_get = int(round(fraction*n_jobs))
-
-        # Get the requisite number of jobs (or more), making sure they completed
-        for i in range(1, n_jobs+1):
-            if res_status['jobs'][str(i)]['State'] == 'finished':
-                job_ids.append(str(i))
-            if strict and (len(job_ids) == n_jobs_to_get):
-                break
+        job_ids, n_jobs, n_jobs_to_get = select_job_ids(res_status, completed, fraction, strict)
 
         if len(job_ids) < n_jobs_to_get:
             print " ---- Not enough jobs finished! - skipping"
@@ -171,6 +377,14 @@ def get_hadd(in_args=sys.argv[1:]):
         os.chmod(cmd_filename, st.st_mode | stat.S_IEXEC)
         print "Commands written to %s" % cmd_filename
 
+    if args.run:
+        summary = run_get_hadd(tasks, args.jobs, args.haddJobs)
+        print ""
+        print "SUMMARY"
+        for k, v in summary.iteritems():
+            print "%s : %s" % (k, v)
+        return
+
     # Now write a simple script to run all the produced scripts
     all_filename = 'crab_get_hadd_all_%s.sh' % strftime("%H%M%S")
     with open(all_filename, 'w') as f_all:
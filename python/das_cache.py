@@ -0,0 +1,265 @@
+"""
+On-disk cache of DAS queries about datasets (summary, list of files, sites),
+so we don't wait on das_client for the same dataset every time we (re)submit.
+
+Results are stored in a JSON file, keyed by dataset name then query (plus any
+extra das_client args that change the result, see get_query_key), and are
+re-queried once older than the TTL.
+Set these with environment variables:
+
+L1JEC_DAS_CACHE: cache filename (default: ~/.l1jec_das_cache.json)
+L1JEC_DAS_CACHE_TTL: TTL in seconds (default: 1 day). 0 to always query DAS.
+
+Offline mode: set L1JEC_DAS_OFFLINE to a snapshot JSON file (same format as
+the cache, e.g. made with `python das_cache.py --snapshot snap.json DATASET ...`),
+or call set_offline(). All queries are then answered from the snapshot,
+ignoring the TTL, and das_client is never called.
+
+Usage:
+
+from L1Trigger.L1JetEnergyCorrections.das_cache import get_number_files, get_files
+n_files = get_number_files(dataset)
+files = get_files(dataset, num_files=10)
+"""
+
+
+import os
+import sys
+import json
+import time
+import tempfile
+import logging
+import argparse
+import subprocess
+
+
+log = logging.getLogger(__name__)
+
+
+DAS_CACHE_FILE = os.environ.get('L1JEC_DAS_CACHE',
+                                os.path.join(os.path.expanduser('~'), '.l1jec_das_cache.json'))
+
+DAS_CACHE_TTL = float(os.environ.get('L1JEC_DAS_CACHE_TTL', 24 * 60 * 60))
+
+# Snapshot filename for offline mode, None if online
+DAS_OFFLINE_SNAPSHOT = os.environ.get('L1JEC_DAS_OFFLINE', None)
+
+
+# das_client args that don't change the result of a query (credentials,
+# connection settings), so are left out of the cache key. Otherwise e.g. the
+# --key/--cert paths would give each user their own entries, and queries with
+# them would not be found in snapshots.
+DAS_ARGS_IGNORED = ['--key', '--cert', '--capath', '--limit', '--retry', '--threshold',
+                    '--verbose']
+
+
+def set_offline(snapshot_filename):
+    """Answer all queries from snapshot_filename, never call DAS. None to go back online."""
+    global DAS_OFFLINE_SNAPSHOT
+    DAS_OFFLINE_SNAPSHOT = snapshot_filename
+
+
+def load_cache(filename):
+    """Load cache/snapshot from file. Returns empty dict if it doesn't exist."""
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_cache(filename, cache):
+    """Save cache to file. Written to a unique temp file in the same directory
+    first, then renamed, so it's never half-written, even if several processes
+    or threads save at once."""
+    fd, tmp_filename = tempfile.mkstemp(prefix=os.path.basename(filename) + '.',
+                                        suffix='.tmp',
+                                        dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.rename(tmp_filename, filename)
+    except Exception:
+        os.remove(tmp_filename)
+        raise
+
+
+def get_query_key(query, das_args=None):
+    """Get the cache key for a query: its name, plus any das_args
+    that change its result (i.e. not in DAS_ARGS_IGNORED).
+
+    Handles both --arg=value and --arg value forms.
+    """
+    kept = []
+    skip_value = False
+    for arg in das_args or []:
+        if skip_value:
+            skip_value = False
+            continue
+        if arg.split('=', 1)[0] in DAS_ARGS_IGNORED:
+            skip_value = '=' not in arg
+            continue
+        kept.append(arg)
+    return ' '.join([query] + kept)
+
+
+def cached_query(dataset, query, func, das_args=None):
+    """Get result of query about dataset from the cache, or from func() if
+    not in cache or older than DAS_CACHE_TTL, and store it.
+
+    Parameters
+    ----------
+    dataset : str
+        Name of dataset.
+    query : str
+        Name of query, e.g. 'summary'.
+    func : callable
+        Does the DAS query, returns JSON-able result.
+    das_args : list[str], optional
+        Extra args for das_client.py used by func. Those that change the
+        result are part of the cache key (see get_query_key), so results
+        for different args are kept apart.
+
+    Returns
+    -------
+    Result of func()
+
+    Raises
+    ------
+    KeyError
+        If offline and query not in snapshot.
+    """
+    query = get_query_key(query, das_args)
+
+    if DAS_OFFLINE_SNAPSHOT:
+        try:
+            return load_cache(DAS_OFFLINE_SNAPSHOT)[dataset][query]['result']
+        except KeyError:
+            raise KeyError('%s query for %s not in offline snapshot %s'
+                           % (query, dataset, DAS_OFFLINE_SNAPSHOT))
+
+    entry = load_cache(DAS_CACHE_FILE).get(dataset, {}).get(query)
+    if entry and time.time() - entry['time'] < DAS_CACHE_TTL:
+        log.debug("Using cached DAS %s for %s", query, dataset)
+        return entry['result']
+
+    result = func()
+    # reload in case another process has updated the cache meanwhile
+    cache = load_cache(DAS_CACHE_FILE)
+    cache.setdefault(dataset, {})[query] = {'time': time.time(), 'result': result}
+    save_cache(DAS_CACHE_FILE, cache)
+    return result
+
+
+def get_summary(dataset, das_args=None):
+    """Get DAS summary for dataset (nfiles, nevents, ...)
+
+    Parameters
+    ----------
+    dataset : str
+        Name of dataset.
+    das_args : list[str], optional
+        Extra args for das_client.py (e.g. --key/--cert).
+
+    Returns
+    -------
+    dict
+
+    Raises
+    ------
+    RuntimeError
+        If DAS fails to find dataset
+    """
+    def query():
+        log.info("Querying DAS for dataset info, please be patient...")
+        cmds = ['das_client.py', '--query', 'summary dataset=%s' % dataset, '--format=json']
+        output = subprocess.check_output(cmds + (das_args or []), stderr=subprocess.STDOUT)
+        log.debug(output)
+        summary = json.loads(output)
+        # check to make sure dataset is valid
+        if summary['status'] == 'fail':
+            log.error('Error querying dataset with das_client:')
+            log.error(summary['reason'])
+            raise RuntimeError('Error querying dataset with das_client')
+        return summary['data'][0]['summary'][0]
+
+    return cached_query(dataset, 'summary', query, das_args)
+
+
+def get_number_files(dataset, das_args=None):
+    """Get total number of files in dataset"""
+    return int(get_summary(dataset, das_args)['nfiles'])
+
+
+def get_files(dataset, num_files=None, das_args=None):
+    """Get list of filenames (/store/...) in dataset.
+
+    The full list is cached, so asking for a different number of files
+    later doesn't need another query.
+
+    Parameters
+    ----------
+    dataset : str
+        Name of dataset.
+    num_files : int, optional
+        Only return this many files. If None, returns all.
+    das_args : list[str], optional
+        Extra args for das_client.py
+
+    Returns
+    -------
+    list[str]
+    """
+    def query():
+        log.info("Querying DAS for filenames, please be patient...")
+        cmds = ['das_client.py', '--query', 'file dataset=%s' % dataset, '--limit=0']
+        output = subprocess.check_output(cmds + (das_args or []), stderr=subprocess.STDOUT)
+        return [line for line in output.splitlines() if line.lower().startswith("/store")]
+
+    files = cached_query(dataset, 'files', query, das_args)
+    return files if num_files is None else files[:int(num_files)]
+
+
+def get_sites(dataset, quantities):
+    """Get site info for dataset, one line of space-separated quantities per site.
+
+    Parameters
+    ----------
+    dataset : str
+        Name of dataset.
+    quantities : list[str]
+        Site quantities to get, e.g. ['name', 'dataset_fraction']
+
+    Returns
+    -------
+    list[str]
+    """
+    def query():
+        # yes, you prob shouldn't use shell=True,
+        # but CBA to figure out how to split the string for das_client
+        grep_str = ' '.join(['site.%s' % q for q in quantities])
+        cmd = 'das_client --query="site dataset=%s | grep %s"' % (dataset, grep_str)
+        out = subprocess.check_output(cmd, shell=True)
+        return [x for x in out.split('\n') if 'Showing' not in x and x != '']
+
+    return cached_query(dataset, 'site ' + ' '.join(quantities), query)
+
+
+def make_snapshot(datasets, snapshot_filename):
+    """Query all datasets (via the cache), and write their cached results
+    to snapshot_filename for use in offline mode."""
+    for dataset in datasets:
+        get_summary(dataset)
+        get_files(dataset)
+    cache = load_cache(DAS_CACHE_FILE)
+    save_cache(snapshot_filename, {d: cache[d] for d in datasets})
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--snapshot', required=True, help='Snapshot file to write')
+    parser.add_argument('dataset', nargs='+', help='Dataset(s) to put in snapshot')
+    args = parser.parse_args()
+    make_snapshot(args.dataset, args.snapshot)
+    sys.exit(0)
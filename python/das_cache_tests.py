@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Unit tests for DAS query cache"""
+
+
+import das_cache
+import unittest
+import tempfile
+import shutil
+import os
+
+
+CREDENTIAL_ARGS = ['--key=/home/someone/.globus/userkey.pem',
+                   '--cert=/home/someone/.globus/usercert.pem']
+
+
+def fail_query():
+    raise AssertionError("DAS should not be queried")
+
+
+class TestQueryKey(unittest.TestCase):
+
+    def test_no_args(self):
+        self.assertEqual(das_cache.get_query_key('summary'), 'summary')
+
+    def test_credentials_ignored(self):
+        self.assertEqual(das_cache.get_query_key('summary', CREDENTIAL_ARGS), 'summary')
+        self.assertEqual(das_cache.get_query_key('files', ['--key', '/a/key.pem', '--limit=10']),
+                         'files')
+
+    def test_result_args_kept(self):
+        self.assertEqual(das_cache.get_query_key('summary', CREDENTIAL_ARGS + ['--host=https://x']),
+                         'summary --host=https://x')
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'cache.json')
+        self.snapshot_file = os.path.join(self.tmp_dir, 'snapshot.json')
+        self.orig_cache_file = das_cache.DAS_CACHE_FILE
+        das_cache.DAS_CACHE_FILE = self.cache_file
+
+    def tearDown(self):
+        das_cache.DAS_CACHE_FILE = self.orig_cache_file
+        das_cache.set_offline(None)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cache_shared_across_credentials(self):
+        summary = {'nfiles': 12}
+        result = das_cache.cached_query('/A/B/C', 'summary', lambda: summary, CREDENTIAL_ARGS)
+        self.assertEqual(result, summary)
+        self.assertEqual(das_cache.get_number_files('/A/B/C'), 12)
+        self.assertEqual(os.listdir(self.tmp_dir), ['cache.json'])
+
+    def test_offline_with_credentials(self):
+        das_cache.save_cache(self.snapshot_file,
+                             {'/A/B/C': {'summary': {'time': 0, 'result': {'nfiles': 7}}}})
+        das_cache.set_offline(self.snapshot_file)
+        self.assertEqual(das_cache.get_number_files('/A/B/C', CREDENTIAL_ARGS), 7)
+        self.assertEqual(das_cache.cached_query('/A/B/C', 'summary', fail_query, CREDENTIAL_ARGS),
+                         {'nfiles': 7})
+
+    def test_offline_missing(self):
+        das_cache.save_cache(self.snapshot_file, {})
+        das_cache.set_offline(self.snapshot_file)
+        self.assertRaises(KeyError, das_cache.get_number_files, '/A/B/C', CREDENTIAL_ARGS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,18 +23,15 @@ totalUnits can take the values:
 
 from collections import namedtuple
 import subprocess
-import json
 import os
+import L1Trigger.L1JetEnergyCorrections.das_cache as das_cache
 
 # some helper functions
 def get_number_files(dataset):
-    """Get total number of files in dataset"""
+    """Get total number of files in dataset (cached on disk, see das_cache.py)"""
     HOME = os.environ['HOME']
-    cmds = ['das_client.py', '--query', 'summary dataset=%s' % dataset, '--format=json',
-            '--key=%s/.globus/userkey.pem' % HOME, '--cert=%s/.globus/usercert.pem' % HOME]
-    output = subprocess.check_output(cmds, stderr=subprocess.STDOUT)
-    summary_dict = json.loads(output)
-    return int(summary_dict['data'][0]['summary'][0]['nfiles'])
+    das_args = ['--key=%s/.globus/userkey.pem' % HOME, '--cert=%s/.globus/usercert.pem' % HOME]
+    return das_cache.get_number_files(dataset, das_args)
 
 
 def check_dataset_exists(dataset):
@@ -20,26 +20,23 @@ totalUnits can take the values:
 >1: run over this many files
 
 You can use get_number_files() to ask DAS how many files there are in a dataset.
+(Answers are cached on disk, see das_cache.py)
 """
 
 
 from collections import namedtuple
 import re
 import subprocess
-import json
 import os
+import L1Trigger.L1JetEnergyCorrections.das_cache as das_cache
 
 
 # some helper functions
 def get_number_files(dataset):
     """Get total number of files in dataset"""
-    HOME = os.environ['HOME']
-    # cmds = ['das_client.py', '--query', 'summary dataset=%s' % dataset, '--format=json',
-    #         '--key=%s/.globus/userkey.pem' % HOME, '--cert=%s/.globus/usercert.pem' % HOME]
-    cmds = ['das_client.py', '--query', 'summary dataset=%s' % dataset, '--format=json']
-    output = subprocess.check_output(cmds, stderr=subprocess.STDOUT)
-    summary_dict = json.loads(output)
-    return int(summary_dict['data'][0]['summary'][0]['nfiles'])
+    # HOME = os.environ['HOME']
+    # das_args = ['--key=%s/.globus/userkey.pem' % HOME, '--cert=%s/.globus/usercert.pem' % HOME]
+    return das_cache.get_number_files(dataset)
 
 
 def check_dataset_exists(dataset):